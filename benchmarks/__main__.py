@@ -0,0 +1,146 @@
+"""
+Run the benchmark suite and compare the results with a stored baseline.
+
+    python -m benchmarks                       # run everything, compare with benchmarks/baseline.json
+    python -m benchmarks --quick               # smaller workloads and fewer pipeline scenarios
+    python -m benchmarks --update-baseline     # store the current results as the new baseline
+    python -m benchmarks --runs 5              # median of 5 runs of the suite (default 3)
+    python -m benchmarks.importtime            # import-time profile of the library and the GUI
+
+Results are written as JSON to --output. The baseline stores the measured 'samples_per_s',
+'latency_p99_ms' and 'peak_rss_mb' of every benchmark, and the relative 'margins' allowed per
+metric. The exit code is 1 if any result is worse than its baseline by more than its margin:
+throughput below (1 - margin) times, or latency/memory above (1 + margin) times the stored value.
+Every metric is the median over --runs runs of the suite, as single runs vary too much for tight
+margins. Compare with the same number of runs as the baseline was stored with, since the hot path
+benchmarks of later runs start with the memory of earlier ones. Each pipeline scenario runs in a fresh process, so that its peak RSS is
+measured on its own, as does each busy_gui scenario, which needs a (offscreen) QApplication.
+"""
+import os
+import sys
+import json
+import statistics
+import dataclasses
+import argparse
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List
+from .suite import BenchmarkResult, bench_busy_gui, bench_pipeline, hot_path_benchmarks, import_benchmarks, pipeline_scenarios
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+# Relative margins stored with a new baseline, as measurements vary between runs. Tail
+# latencies vary the most, in particular of the pipeline scenarios on few cores:
+MARGINS = {'samples_per_s': 0.2, 'peak_rss_mb': 0.2, 'latency_p99_ms': 0.5}
+
+
+def run_benchmarks(quick: bool) -> List[BenchmarkResult]:
+    results = hot_path_benchmarks(quick) + import_benchmarks(quick)
+    for r in results:
+        print(_format(r), flush=True)
+
+    scenarios, duration = pipeline_scenarios(quick)
+    ctx = multiprocessing.get_context('spawn')
+    for devices, sample_rate, shards in scenarios:
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+            r = pool.submit(bench_pipeline, devices, sample_rate, shards, duration).result()
+        print(_format(r), flush=True)
+        results.append(r)
+
+    # Notification handling while the GUI thread is blocked, on the GUI loop and on its own thread
+    for threaded in (False, True):
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+            r = pool.submit(bench_busy_gui, threaded, duration=duration).result()
+        print(_format(r), flush=True)
+        results.append(r)
+    return results
+
+
+def median_results(runs: List[List[BenchmarkResult]]) -> List[BenchmarkResult]:
+    """Median of every metric over repeated runs of the suite"""
+    merged = []
+    for results in zip(*runs):
+        by_throughput = sorted(results, key=lambda r: r.samples_per_s)
+        r = by_throughput[len(by_throughput) // 2]
+        if r.latency_p99_ms is not None:
+            r = dataclasses.replace(r, latency_p50_ms=statistics.median(x.latency_p50_ms for x in results),
+                                    latency_p99_ms=statistics.median(x.latency_p99_ms for x in results))
+        merged.append(dataclasses.replace(r, peak_rss_mb=statistics.median(x.peak_rss_mb for x in results)))
+    return merged
+
+
+def _format(r: BenchmarkResult) -> str:
+    latency = f'p50 {r.latency_p50_ms:8.3f} ms, p99 {r.latency_p99_ms:8.3f} ms' if r.latency_p50_ms is not None else ''
+    return f'{r.key:<55} {r.samples_per_s:14.0f} samples/s  {latency}  {r.peak_rss_mb:7.1f} MB'
+
+
+def make_baseline(results: List[BenchmarkResult]) -> Dict[str, Any]:
+    measured = {}
+    for r in results:
+        entry = {'samples_per_s': r.samples_per_s, 'peak_rss_mb': r.peak_rss_mb}
+        if r.latency_p99_ms is not None:
+            entry['latency_p99_ms'] = r.latency_p99_ms
+        measured[r.key] = {k: round(v, 3) for k, v in entry.items()}
+    return {'margins': MARGINS, 'results': measured}
+
+
+def compare(results: List[BenchmarkResult], baseline: Dict[str, Any]) -> List[str]:
+    failures = []
+    margins = baseline['margins']
+    for r in results:
+        measured = baseline['results'].get(r.key)
+        if measured is None:
+            continue
+        limit = measured['samples_per_s'] * (1 - margins['samples_per_s'])
+        if r.samples_per_s < limit:
+            failures.append(f"{r.key}: {r.samples_per_s:.0f} samples/s < {limit:.0f}")
+        if 'latency_p99_ms' in measured and r.latency_p99_ms is not None:
+            limit = measured['latency_p99_ms'] * (1 + margins['latency_p99_ms'])
+            if r.latency_p99_ms > limit:
+                failures.append(f"{r.key}: p99 latency {r.latency_p99_ms:.3f} ms > {limit:.3f} ms")
+        limit = measured['peak_rss_mb'] * (1 + margins['peak_rss_mb'])
+        if r.peak_rss_mb > limit:
+            failures.append(f"{r.key}: peak RSS {r.peak_rss_mb:.1f} MB > {limit:.1f} MB")
+    return failures
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Run the acquisition pipeline benchmarks.')
+    parser.add_argument('--quick', action='store_true', help='Smaller workloads and fewer pipeline scenarios')
+    parser.add_argument('--output', default='benchmark_results.json', help='JSON output file (default: benchmark_results.json)')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='Baseline to compare with')
+    parser.add_argument('--update-baseline', action='store_true', help='Store the results as the new baseline')
+    parser.add_argument('--runs', type=int, default=3, help='Runs of the suite, the median is compared (default: 3)')
+    args = parser.parse_args()
+
+    logging.getLogger('log').setLevel(logging.WARNING)
+    runs = []
+    for i in range(max(1, args.runs)):
+        print(f'Run {i + 1}/{max(1, args.runs)}', flush=True)
+        runs.append(run_benchmarks(args.quick))
+    results = median_results(runs)
+    if len(runs) > 1:
+        print('Median')
+        for r in results:
+            print(_format(r))
+
+    failures = []
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(make_baseline(results), f, indent=2)
+        print(f'Stored baseline in {args.baseline}')
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as f:
+            failures = compare(results, json.load(f))
+
+    with open(args.output, 'w') as f:
+        json.dump({'results': [r.to_dict() for r in results], 'failures': failures}, f, indent=2)
+
+    for failure in failures:
+        print(f'REGRESSION {failure}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""
+Import-time profile of a module, from 'python -X importtime' in a fresh interpreter.
+
+    python -m benchmarks.importtime                     # library, library.decoders, ... and gui
+    python -m benchmarks.importtime library.daemon --top 30
+
+Prints the total import time and peak RSS of every module, followed by its slowest imports
+(cumulative time, including the imports they trigger).
+"""
+import os
+import sys
+import argparse
+import subprocess
+from dataclasses import dataclass
+from typing import List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MODULES = ['library', 'library.decoders', 'library.datatypes', 'library.daemon', 'library.stream', 'gui']
+
+# Prints the peak RSS of the child after the import
+_PEAK_RSS = (
+    "import resource; rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024\n"
+    "try:\n"
+    "    rss = int([l for l in open('/proc/self/status') if l.startswith('VmHWM:')][0].split()[1]) / 1024\n"
+    "except OSError:\n"
+    "    pass\n"
+    "print(rss)\n"
+)
+
+
+@dataclass
+class ImportEntry:
+    module: str
+    depth: int
+    self_us: int
+    cumulative_us: int
+
+
+@dataclass
+class ImportProfile:
+    module: str
+    total_us: int
+    peak_rss_mb: float
+    entries: List[ImportEntry]
+
+    def slowest(self, n: int) -> List[ImportEntry]:
+        return sorted(self.entries, key=lambda e: e.cumulative_us, reverse=True)[:n]
+
+
+def _parse(stderr: str) -> List[ImportEntry]:
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        entries.append(ImportEntry(name.strip(), (len(name) - len(name.lstrip()) - 1) // 2,
+                                   int(self_us), int(cumulative_us)))
+    return entries
+
+
+def profile_import(module: str) -> ImportProfile:
+    env = dict(os.environ, QT_QPA_PLATFORM=os.environ.get('QT_QPA_PLATFORM', 'offscreen'))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}\n{_PEAK_RSS}'],
+                            cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    entries = _parse(result.stderr)
+    total = sum(e.cumulative_us for e in entries if e.depth == 0)
+    return ImportProfile(module, total, float(result.stdout.split()[-1]), entries)
+
+
+def measure_import(module: str, runs: int = 5) -> Tuple[List[float], float]:
+    """Import times [s] of 'runs' fresh interpreters, and the largest peak RSS [MB]"""
+    profiles = [profile_import(module) for _ in range(runs)]
+    return [p.total_us / 1e6 for p in profiles], max(p.peak_rss_mb for p in profiles)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Profile the import time of modules.')
+    parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES)
+    parser.add_argument('--top', type=int, default=15, help='Number of slowest imports to list per module')
+    args = parser.parse_args()
+    for module in args.modules:
+        p = profile_import(module)
+        print(f'{module}: {p.total_us / 1e3:.1f} ms, peak RSS {p.peak_rss_mb:.1f} MB')
+        for e in p.slowest(args.top):
+            print(f'    {e.cumulative_us / 1e3:8.1f} ms  {e.self_us / 1e3:8.1f} ms  {"  " * e.depth}{e.module}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
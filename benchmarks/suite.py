@@ -0,0 +1,550 @@
+"""
+Benchmarks of the acquisition hot paths, on synthetic packets from the tracker simulator.
+
+Every benchmark returns one or more BenchmarkResults. Throughput is counted in data rows (IMU,
+quaternion and magnetometer samples), latencies are per call unless noted otherwise. Peak RSS is
+the high-water mark of the process since the start of the benchmark, where the OS allows to reset
+it (Linux), and since the start of the process otherwise.
+"""
+import os
+import time
+import random
+import asyncio
+import logging
+import tempfile
+import resource
+import dataclasses
+import numpy as np
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+from library.acquisitionthread import AcquisitionThread
+from library.config import conf
+from library.consumermanager import ConsumerManager
+from library.csvlogger import CSVLogger
+from library.datatypes import Configuration, Consumer, NotifData, SeenDevice, SeenDeviceState, SimulatorSettings
+from library.datatypes.predictor import Predictor
+from library.decoders import SCALING_FACTORS, decode_data
+from library.featuregraph import FeatureGraph
+from library.features import FeatureEngine, imu_rows
+from library.quaternion import QuaternionArray
+from library.simulator import SimulatedTracker, Simulator, with_simulated_aliases
+from library.stream import Stream
+from library.tracing import tracer
+from library.udpstream import UDPReceiver, UDPStreamer
+from .importtime import DEFAULT_MODULES, measure_import
+
+
+@dataclass
+class BenchmarkResult:
+    name: str
+    params: Dict[str, Any] = field(default_factory=dict)
+    samples: int = 0
+    elapsed: float = 0.0
+    latency_p50_ms: Optional[float] = None
+    latency_p99_ms: Optional[float] = None
+    peak_rss_mb: Optional[float] = None
+
+    @property
+    def key(self) -> str:
+        if not self.params:
+            return self.name
+        return f"{self.name}[{','.join(f'{k}={v}' for k, v in self.params.items())}]"
+
+    @property
+    def samples_per_s(self) -> float:
+        return self.samples / self.elapsed if self.elapsed > 0 else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        d = dataclasses.asdict(self)
+        d['key'] = self.key
+        d['samples_per_s'] = self.samples_per_s
+        return d
+
+
+def reset_peak_rss() -> None:
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss_mb() -> float:
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _percentiles(latencies_s: List[float]):
+    if not latencies_s:
+        return None, None
+    p50, p99 = np.percentile(latencies_s, [50, 99]) * 1e3
+    return float(p50), float(p99)
+
+
+def _config(**kwargs) -> Configuration:
+    return dataclasses.replace(conf, known_devices_file=None, **kwargs)
+
+
+def synthetic_packets(n: int, samples_per_notification: int = 1, seed: int = 0) -> List[bytearray]:
+    """Notifications as sent by a simulated tracker."""
+    random.seed(seed)
+    settings = SimulatorSettings(samples_per_notification=samples_per_notification)
+    tracker = SimulatedTracker(adr='5E:00:00:00:00:00', name=settings.name, rssi=-50, rotation_rate=0.5, heading=0.0)
+    packets = []
+    for _ in range(n):
+        payload = bytearray()
+        for _ in range(samples_per_notification):
+            payload += tracker.next_sample(settings)
+        packets.append(payload)
+    return packets
+
+
+def synthetic_rows(n: int) -> List[List[Any]]:
+    rows = []
+    for p in synthetic_packets(n):
+        rows.extend(decode_data(p, receive_time=0.0))
+    return rows
+
+
+# ==================== Hot paths ====================
+
+def bench_decode(notifications: int = 20000, samples_per_notification: int = 1) -> BenchmarkResult:
+    reset_peak_rss()
+    packets = synthetic_packets(notifications, samples_per_notification)
+    latencies = []
+    samples = 0
+    t_start = time.perf_counter()
+    for p in packets:
+        t = time.perf_counter()
+        rows = decode_data(p, receive_time=0.0)
+        latencies.append(time.perf_counter() - t)
+        samples += len(rows)
+    elapsed = time.perf_counter() - t_start
+    p50, p99 = _percentiles(latencies)
+    return BenchmarkResult('decode_data', {'samples_per_notification': samples_per_notification},
+                           samples, elapsed, p50, p99, peak_rss_mb())
+
+
+class _CountingConsumer(Consumer):
+    def __init__(self, halt_event: asyncio.Event, expected: int, done: asyncio.Event, latencies: List[float]):
+        super().__init__()
+        self.halt_event = halt_event
+        self.expected = expected
+        self.done = done
+        self.latencies = latencies
+        self.received = 0
+
+    async def run(self) -> None:
+        while not self.halt_event.is_set() or not self.input_queue.empty():
+            try:
+                data = await asyncio.wait_for(self.input_queue.get(), timeout=0.5)  # type: NotifData
+            except asyncio.TimeoutError:
+                continue
+            # The first column holds the (perf_counter) time the block was queued
+            self.latencies.append(time.perf_counter() - data.data[0][0])
+            self.received += 1
+            if self.received == self.expected:
+                self.done.set()
+
+
+def bench_consumer_fanout(consumers: int = 4, blocks: int = 5000, rows_per_block: int = 4) -> BenchmarkResult:
+    reset_peak_rss()
+
+    async def run():
+        config = _config()
+        halt_event = asyncio.Event()
+        manager = ConsumerManager(config, halt_event)
+        latencies = []
+        done_events = [asyncio.Event() for _ in range(consumers)]
+        for done in done_events:
+            manager.add_consumer(_CountingConsumer(halt_event, blocks, done, latencies))
+        char = config.characteristics[0]
+        rows = synthetic_rows(rows_per_block)
+        task = asyncio.create_task(manager.run())
+        t_start = time.perf_counter()
+        for _ in range(blocks):
+            block = [list(r) for r in rows]
+            block[0][0] = time.perf_counter()
+            manager.input_queue.put_nowait(NotifData('5E:00:00:00:00:00', 'bench', char, block))
+            await asyncio.sleep(0)
+        await asyncio.gather(*[d.wait() for d in done_events])
+        elapsed = time.perf_counter() - t_start
+        halt_event.set()
+        await task
+        return elapsed, latencies
+
+    elapsed, latencies = asyncio.run(run())
+    p50, p99 = _percentiles(latencies)
+    return BenchmarkResult('consumer_fanout', {'consumers': consumers},
+                           blocks * rows_per_block * consumers, elapsed, p50, p99, peak_rss_mb())
+
+
+def bench_csv_logger(blocks: int = 2000, rows_per_block: int = 8) -> BenchmarkResult:
+    reset_peak_rss()
+
+    async def run(path):
+        config = _config()
+        halt_event = asyncio.Event()
+        latencies = []
+        done = asyncio.Event()
+
+        def written(data: NotifData):
+            latencies.append(time.perf_counter() - data.data[0][0])
+            if len(latencies) == blocks:
+                done.set()
+
+        logger = CSVLogger(config, halt_event, data_path=path, callback=written)
+        char = config.characteristics[0]
+        rows = synthetic_rows(rows_per_block)
+        task = asyncio.create_task(logger.run())
+        t_start = time.perf_counter()
+        for _ in range(blocks):
+            block = [list(r) for r in rows]
+            block[0][0] = time.perf_counter()
+            logger.input_queue.put_nowait(NotifData('5E:00:00:00:00:00', 'bench', char, block))
+            await asyncio.sleep(0)
+        await done.wait()
+        elapsed = time.perf_counter() - t_start
+        halt_event.set()
+        await task
+        return elapsed, latencies
+
+    with tempfile.TemporaryDirectory() as path:
+        elapsed, latencies = asyncio.run(run(path))
+    p50, p99 = _percentiles(latencies)
+    return BenchmarkResult('csv_logger', {'rows_per_block': rows_per_block},
+                           blocks * rows_per_block, elapsed, p50, p99, peak_rss_mb())
+
+
+def bench_udp_loopback(blocks: int = 5000, rows_per_block: int = 8, port: int = 45005) -> BenchmarkResult:
+    """UDPStreamer to UDPReceiver over the loopback interface. Latency is from queueing a block
+    to receiving the frame with its first row. Lost frames are logged as a warning."""
+    reset_peak_rss()
+
+    async def run():
+        config = _config(output_udp=True, udp_address='127.0.0.1', udp_port=port)
+        halt_event = asyncio.Event()
+        latencies = []
+        received = [0]
+        t_end = [0.0]
+
+        def on_frame(device_id, name, rows):
+            latencies.append(time.time() - rows[0][0])
+            received[0] += len(rows)
+            t_end[0] = time.perf_counter()
+
+        receiver = await UDPReceiver.listen(config.udp_address, config.udp_port, on_frame)
+        streamer = UDPStreamer(config, halt_event)
+        char = config.characteristics[0]
+        rows = synthetic_rows(rows_per_block)
+        task = asyncio.create_task(streamer.run())
+        await asyncio.sleep(0.05)
+        t_start = time.perf_counter()
+        for _ in range(blocks):
+            t = time.time()
+            block = [[t] + list(r[1:]) for r in rows]
+            streamer.input_queue.put_nowait(NotifData('5E:00:00:00:00:00', 'bench', char, block))
+            await asyncio.sleep(0)
+        # Wait until everything arrived, or nothing more arrives
+        last = -1
+        while received[0] < blocks * len(rows) and received[0] != last:
+            last = received[0]
+            await asyncio.sleep(0.05)
+        elapsed = t_end[0] - t_start
+        halt_event.set()
+        await task
+        receiver.close()
+        return elapsed, latencies, received[0], sum(s.lost for s in receiver.devices.values())
+
+    elapsed, latencies, samples, lost = asyncio.run(run())
+    p50, p99 = _percentiles(latencies)
+    result = BenchmarkResult('udp_loopback', {'rows_per_block': rows_per_block},
+                             samples, elapsed, p50, p99, peak_rss_mb())
+    if lost:
+        logging.getLogger('log').warning(f'udp_loopback: {lost} frames lost')
+    return result
+
+
+def bench_stream(blocks: int = 5000, rows_per_block: int = 8, trace_sample_every: int = 0) -> BenchmarkResult:
+    """Stream.handle_new_data, with tracing disabled (0) or recording every n-th block"""
+    reset_peak_rss()
+    config = _config(trace_sample_every=max(1, trace_sample_every))
+    stream = Stream(config, asyncio.Event(), {})
+    tracer.configure(config.trace_buffer_size, config.trace_sample_every)
+    if trace_sample_every:
+        tracer.start()
+    stream.output_queues['bench'] = deque(maxlen=config.buffer_size)
+    stream.sample_counts['bench'] = 0
+    stream.feature_engines['bench'] = FeatureEngine(config.feature_windows)
+    rows = synthetic_rows(rows_per_block)
+    latencies = []
+    t_start = time.perf_counter()
+    for _ in range(blocks):
+        t = time.perf_counter()
+        stream.handle_new_data('5E:00:00:00:00:00', 'bench', rows)
+        latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - t_start
+    tracer.stop()
+    p50, p99 = _percentiles(latencies)
+    params = {'rows_per_block': rows_per_block}
+    if trace_sample_every:
+        params['trace_sample_every'] = trace_sample_every
+    return BenchmarkResult('stream_handle_new_data', params,
+                           blocks * len(rows), elapsed, p50, p99, peak_rss_mb())
+
+
+def bench_quaternion(n: int = 100000, repeat: int = 20) -> List[BenchmarkResult]:
+    reset_peak_rss()
+    rng = np.random.default_rng(0)
+    q = QuaternionArray(rng.normal(size=(n, 4))).normalize()
+    r = QuaternionArray(rng.normal(size=(n, 4))).normalize()
+    v = rng.normal(size=(n, 3))
+    out_q = QuaternionArray.empty(n)
+    out_v = np.empty((n, 3))
+    kernels = {
+        'multiply': lambda: q.multiply(r, out=out_q),
+        'inverse': lambda: q.inverse(out=out_q),
+        'rotate': lambda: q.rotate(v, out=out_v),
+    }
+    results = []
+    for name, kernel in kernels.items():
+        latencies = []
+        t_start = time.perf_counter()
+        for _ in range(repeat):
+            t = time.perf_counter()
+            kernel()
+            latencies.append(time.perf_counter() - t)
+        elapsed = time.perf_counter() - t_start
+        p50, p99 = _percentiles(latencies)
+        results.append(BenchmarkResult(f'quaternion_{name}', {'n': n}, n * repeat, elapsed, p50, p99, peak_rss_mb()))
+    return results
+
+
+class _DummyPredictor(Predictor):
+    """Thresholds the mean global vertical acceleration, using a typical set of signals."""
+    required_signals = ('timestamps', 'acc', 'gyro', 'quat', 'acc_global')
+
+    def classify(self, ts, acc, gyro, quat):
+        return False, 0.0
+
+    def classify_signals(self, signals):
+        confidence = float(np.clip(np.abs(signals['acc_global'][:, 2].mean() - 9.81), 0, 1))
+        return confidence > 0.5, confidence
+
+
+def bench_predictor(window_size: int = 200, step: int = 20, windows: int = 1000) -> BenchmarkResult:
+    reset_peak_rss()
+    rows = np.array(synthetic_rows(window_size + step * windows), dtype=float) * SCALING_FACTORS
+    graph = FeatureGraph()
+    predictor = _DummyPredictor()
+    latencies = []
+    t_start = time.perf_counter()
+    for i in range(windows):
+        start = i * step
+        t = time.perf_counter()
+        graph.classify('bench', start, rows[start:start + window_size], [predictor])
+        latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - t_start
+    p50, p99 = _percentiles(latencies)
+    # Every window adds 'step' new rows
+    return BenchmarkResult('predictor', {'window_size': window_size, 'step': step},
+                           windows * step, elapsed, p50, p99, peak_rss_mb())
+
+
+# ==================== Whole pipeline ====================
+
+def bench_pipeline(devices: int, sample_rate: float, shards: int = 0, duration: float = 5.0,
+                   connect_timeout: float = 30.0) -> BenchmarkResult:
+    """
+    Simulated trackers -> connections -> decode stage -> Stream and CSVLogger. Latency is measured
+    from the receive time of a notification to the moment its rows are flushed to disk. With
+    'shards' > 1, the connections run in that many worker processes (whose memory is not included
+    in the peak RSS).
+    """
+    reset_peak_rss()
+
+    async def run(path):
+        config = with_simulated_aliases(_config(
+            ble_backend='simulator',
+            warm_start=True,
+            output_csv=True,
+            capture_raw=False,
+            max_active_connections=devices,
+            acquisition_shards=shards,
+            simulator=SimulatorSettings(devices=devices, sample_rate=sample_rate, latency=0.0, latency_jitter=0.0,
+                                        connect_latency=0.05),
+        ))
+        backend = Simulator(config)
+        halt_event = asyncio.Event()
+        stream = Stream(config, halt_event, {}, backend)
+        checked = {}
+        for t in backend.trackers.values():
+            device = SeenDevice(adr=t.adr, alias=config.device_aliases[t.adr], state=SeenDeviceState.RECENTLY_SEEN,
+                                name=t.name, last_seen=time.monotonic_ns(), rssi=t.rssi)
+            checked[device.get_id()] = (device, None)
+        stream.start(checked, path)
+
+        latencies = []
+        measuring = False
+
+        def written(data: NotifData):
+            if measuring:
+                latencies.append(time.time() - data.data[-1][0])
+        stream.consumer_manager.consumers[0].callback = written
+
+        # Start measuring once every device delivers data
+        deadline = time.perf_counter() + connect_timeout
+        while any(c == 0 for c in stream.sample_counts.values()) and time.perf_counter() < deadline:
+            await asyncio.sleep(0.1)
+        counts_start = sum(stream.sample_counts.values())
+        measuring = True
+        t_start = time.perf_counter()
+        await asyncio.sleep(duration)
+        samples = sum(stream.sample_counts.values()) - counts_start
+        elapsed = time.perf_counter() - t_start
+        measuring = False
+        halt_event.set()
+        await stream.stop()
+        return samples, elapsed, latencies
+
+    # Saturated scenarios would flood the output with lagging consumer warnings
+    logging.getLogger('log').setLevel(logging.ERROR)
+    with tempfile.TemporaryDirectory() as path:
+        samples, elapsed, latencies = asyncio.run(run(path))
+    p50, p99 = _percentiles(latencies)
+    params = {'devices': devices, 'sample_rate': sample_rate}
+    if shards > 1:
+        params['shards'] = shards
+    return BenchmarkResult('pipeline', params, samples, elapsed, p50, p99, peak_rss_mb())
+
+
+def bench_busy_gui(threaded: bool, devices: int = 5, sample_rate: float = 100.0, duration: float = 5.0,
+                   busy_ms: float = 200.0, busy_period_ms: float = 500.0, connect_timeout: float = 30.0) -> BenchmarkResult:
+    """
+    Notification handling while the GUI thread is busy: a Qt timer blocks the GUI thread for
+    'busy_ms' every 'busy_period_ms' (like a modal dialog or a slow repaint). Acquisition runs on
+    the qasync GUI loop, or on the loop of an AcquisitionThread if 'threaded'.
+
+    Latency is from the nominal time of an IMU sample (its device timestamp) until Stream hands
+    its block to the listeners, in excess of the lowest such latency of the device.
+    """
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    import qasync
+    from PySide6.QtCore import QTimer
+    from PySide6.QtWidgets import QApplication
+    reset_peak_rss()
+    app = QApplication.instance() or QApplication([])
+    config = with_simulated_aliases(_config(
+        ble_backend='simulator',
+        warm_start=True,
+        output_csv=False,
+        capture_raw=False,
+        max_active_connections=devices,
+        acquisition_shards=0,
+        simulator=SimulatorSettings(devices=devices, sample_rate=sample_rate, latency=0.0, latency_jitter=0.0,
+                                    connect_latency=0.05),
+    ))
+    handled = {}  # type: Dict[str, List]
+
+    def on_block(name, data):
+        # Called on the acquisition loop
+        handled.setdefault(name, []).append((imu_rows(data)[:, 1], time.time()))
+
+    def busy():
+        time.sleep(busy_ms / 1000)
+
+    async def run():
+        if threaded:
+            acquisition = AcquisitionThread(config)
+            acquisition.start()
+            stream, backend = acquisition.stream, acquisition.backend
+        else:
+            backend = Simulator(config)
+            stream = Stream(config, asyncio.Event(), {}, backend)
+        stream.block_listeners.append(on_block)
+        checked = {}
+        for t in backend.trackers.values():
+            device = SeenDevice(adr=t.adr, alias=config.device_aliases[t.adr], state=SeenDeviceState.RECENTLY_SEEN,
+                                name=t.name, last_seen=time.monotonic_ns(), rssi=t.rssi)
+            checked[device.get_id()] = device
+        if threaded:
+            await asyncio.wrap_future(acquisition.submit('start', checked))
+        else:
+            stream.start({name: (device, None) for name, device in checked.items()})
+
+        deadline = time.perf_counter() + connect_timeout
+        while len(handled) < devices and time.perf_counter() < deadline:
+            await asyncio.sleep(0.1)
+        handled.clear()
+        timer = QTimer()
+        timer.timeout.connect(busy)
+        timer.start(int(busy_period_ms))
+        t_start = time.perf_counter()
+        await asyncio.sleep(duration)
+        elapsed = time.perf_counter() - t_start
+        timer.stop()
+
+        if threaded:
+            await asyncio.wrap_future(acquisition.submit('shutdown'))
+            acquisition.join()
+        else:
+            stream.halt_event.set()
+            await stream.stop()
+        return elapsed
+
+    logging.getLogger('log').setLevel(logging.ERROR)
+    loop = qasync.QEventLoop(app)
+    asyncio.set_event_loop(loop)
+    with loop:
+        elapsed = loop.run_until_complete(run())
+
+    latencies = []
+    samples = 0
+    for blocks in handled.values():
+        lat = np.concatenate([t_handled - t_device for t_device, t_handled in blocks])
+        latencies.extend(lat - lat.min())
+        samples += len(lat)
+    p50, p99 = _percentiles(latencies)
+    return BenchmarkResult('busy_gui', {'acquisition': 'thread' if threaded else 'gui_loop', 'devices': devices},
+                           samples, elapsed, p50, p99, peak_rss_mb())
+
+
+def bench_import_time(module: str, runs: int = 5) -> BenchmarkResult:
+    """Import of 'module' in a fresh interpreter, see importtime.py. Peak RSS is of the child."""
+    times, rss = measure_import(module, runs)
+    p50, p99 = _percentiles(times)
+    return BenchmarkResult('import_time', {'module': module}, runs, sum(times), p50, p99, rss)
+
+
+def import_benchmarks(quick: bool = False) -> List[BenchmarkResult]:
+    return [bench_import_time(m, 3 if quick else 5) for m in DEFAULT_MODULES]
+
+
+def hot_path_benchmarks(quick: bool = False) -> List[BenchmarkResult]:
+    scale = 0.2 if quick else 1
+    results = [
+        bench_decode(int(20000 * scale), 1),
+        bench_decode(int(5000 * scale), 4),
+        bench_consumer_fanout(4, int(5000 * scale)),
+        bench_csv_logger(int(2000 * scale)),
+        bench_udp_loopback(int(5000 * scale)),
+        bench_stream(int(5000 * scale)),
+        bench_stream(int(5000 * scale), trace_sample_every=1),
+    ]
+    results.extend(bench_quaternion(repeat=int(20 * scale)))
+    results.append(bench_predictor(windows=int(1000 * scale)))
+    return results
+
+
+def pipeline_scenarios(quick: bool = False):
+    if quick:
+        return [(1, 100, 0), (10, 100, 0)], 3.0
+    return [(1, 100, 0), (10, 100, 0), (10, 400, 0), (50, 100, 0), (50, 100, 4)], 5.0
@@ -1,4 +1,6 @@
 from .acquisitionUI import AcquisitionUI
+from .adapters import AcquisitionEvents
 from .indicator import ConnectionIndicator
 from .guilogger import GUILogger
+from .liveplot import LivePlot
 from .main_window import MainWindow
\ No newline at end of file
@@ -13,6 +13,7 @@ from PySide6.QtWidgets import (
 from PySide6.QtGui import QFont
 from PySide6.QtCore import QSize
 from .guilogger import GUILogger
+from .liveplot import LivePlot
 
 
 class AcquisitionUI(QWidget):
@@ -97,6 +98,23 @@ class AcquisitionUI(QWidget):
         acquisition_layout.addWidget(main.stop_button)
 
         top_layout.addLayout(acquisition_layout)
+
+        # Create the "Trace" button, recording spans of the acquisition stages while checked
+        main.trace_button = QPushButton(" Trace", parent)
+        main.trace_button.setIcon(
+            main.style().standardIcon(QStyle.StandardPixmap.SP_FileDialogDetailedView)
+        )
+        main.trace_button.setCheckable(True)
+        main.trace_button.setFixedSize(400, 30)
+        main.trace_button.setFont(font)
+        top_layout.addWidget(main.trace_button)
+        top_layout.addStretch()
+
+        # Create the live plot of the streamed devices, next to the controls
+        controls_layout = QHBoxLayout()
+        controls_layout.addLayout(top_layout)
+        main.live_plot = LivePlot(main.imu_config, parent)
+        controls_layout.addWidget(main.live_plot, 1)
         
         # Create a layout for the log output
         bottom_layout = QVBoxLayout()
@@ -108,7 +126,7 @@ class AcquisitionUI(QWidget):
         bottom_layout.addWidget(main.log_output.widget)
         
         # Add layouts to main layout
-        main_layout.addLayout(top_layout,1)
+        main_layout.addLayout(controls_layout,1)
         main_layout.addLayout(bottom_layout,2)
         
         # Connect button actions to related methods to be activated on release
@@ -116,3 +134,4 @@ class AcquisitionUI(QWidget):
         main.scan_button.clicked.connect(lambda: asyncio.ensure_future(main.scan_for_devices()))
         main.start_button.clicked.connect(lambda: asyncio.ensure_future(main.start_recording()))
         main.stop_button.clicked.connect(lambda: asyncio.ensure_future(main.stop_recording()))
+        main.trace_button.toggled.connect(main.toggle_tracing)
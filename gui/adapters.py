@@ -0,0 +1,41 @@
+from PySide6.QtCore import QObject, QTimer, Signal, Slot
+
+
+class AcquisitionEvents(QObject):
+    """
+    Qt adapter of an AcquisitionThread: polls its event queue on the GUI thread and re-emits
+    the events as Qt signals, so widgets can connect to them like to any other signal.
+    """
+    device_found = Signal(object)
+    scan_done = Signal()
+    connect_state = Signal(str, bool)
+    new_data = Signal(str)
+    stopped = Signal()
+    error = Signal(str)
+
+    def __init__(self, acquisition, parent=None, interval_ms: int = 20):
+        super().__init__(parent)
+        self.acquisition = acquisition
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.poll)
+        self.timer.start(interval_ms)
+
+    @Slot(None)
+    def poll(self):
+        for event in self.acquisition.events():
+            kind, args = event[0], event[1:]
+            if kind == 'device':
+                self.device_found.emit(*args)
+            elif kind == 'scan_done':
+                self.scan_done.emit()
+            elif kind == 'connect_state':
+                self.connect_state.emit(*args)
+            elif kind == 'new_data':
+                self.new_data.emit(*args)
+            elif kind == 'stopped':
+                self.stopped.emit()
+            elif kind == 'error':
+                self.error.emit(*args)
+
+    def stop(self):
+        self.timer.stop()
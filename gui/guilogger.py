@@ -1,15 +1,80 @@
 import logging
+from collections import deque
 from PySide6 import QtCore, QtWidgets
 
 
 class GUILogger(logging.Handler, QtCore.QObject):
+    '''Log handler showing the records in a QPlainTextEdit.
 
-    def __init__(self, parent):
+    emit() only queues the record, so logging from the acquisition loop (or any other thread)
+    never waits for the widget. The queue is flushed to the widget in one batch per timer tick,
+    on the GUI thread. Consecutive repeats of a message are collapsed into one line ending in
+    "×N", records that do not fit in the queue are counted and reported as suppressed, and the
+    widget keeps at most max_lines lines.
+    '''
+    def __init__(self, parent, flush_interval_ms: int = 100, max_lines: int = 5000, max_queued: int = 2000):
         super().__init__()
         QtCore.QObject.__init__(self)
         self.widget = QtWidgets.QPlainTextEdit(parent)
         self.widget.setReadOnly(True)
+        self.widget.setMaximumBlockCount(max_lines)
+
+        self.max_queued = max_queued
+        self.records = deque()
+        # Records dropped because the queue was full, since the last flush and in total
+        self.suppressed = 0
+        self.total_suppressed = 0
+        # Last shown message, and the number of repeats of it not shown yet
+        self.last_message = None
+        self.repeats = 0
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self._flush_to_widget)
+        self.timer.start(flush_interval_ms)
 
     def emit(self, record):
-        msg = self.format(record)
-        self.widget.appendPlainText(msg)
\ No newline at end of file
+        # Called from any thread: only queue the record, it is formatted on the GUI thread
+        if len(self.records) >= self.max_queued:
+            self.suppressed += 1
+            return
+        self.records.append(record)
+
+    def flush(self):
+        # Called by logging (e.g. at shutdown) from any thread, possibly after the widget was
+        # deleted: records are only written to the widget by the timer, on the GUI thread
+        pass
+
+    @QtCore.Slot()
+    def _flush_to_widget(self):
+        lines = []
+        while self.records:
+            record = self.records.popleft()
+            message = (record.levelno, record.getMessage())
+            if message == self.last_message:
+                self.repeats += 1
+                continue
+            self._end_repeats(lines)
+            self.last_message = message
+            lines.append(self.format(record))
+        # Report repeats once per flush, so a message storm shows up as one line per tick
+        self._end_repeats(lines)
+        if self.suppressed:
+            self.total_suppressed += self.suppressed
+            lines.append(f'... {self.suppressed} log records suppressed ({self.total_suppressed} in total)')
+            self.suppressed = 0
+        if lines:
+            self.widget.appendPlainText('\n'.join(lines))
+
+    def _end_repeats(self, lines):
+        if self.repeats:
+            lines.append(f'{self.last_message[1]} ×{self.repeats}')
+            self.repeats = 0
+
+    def close(self):
+        try:
+            self.timer.stop()
+            self._flush_to_widget()
+        except RuntimeError:
+            # The widget was already deleted together with the window
+            pass
+        super().close()
\ No newline at end of file
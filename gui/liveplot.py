@@ -0,0 +1,213 @@
+import math
+import numpy as np
+from typing import Dict, List, Set
+from PySide6.QtCore import QPointF, QRect, Qt, QTimer, Slot
+from PySide6.QtGui import QColor, QPainter, QPen, QPolygonF
+from PySide6.QtWidgets import QWidget
+from library.features import MAG_COLS, QUAT_COLS, imu_rows, mag_rows, quat_rows
+from library.tracing import tracer
+
+COLORS = [QColor(Qt.GlobalColor.red), QColor(Qt.GlobalColor.darkGreen), QColor(Qt.GlobalColor.blue),
+          QColor(Qt.GlobalColor.darkMagenta), QColor(Qt.GlobalColor.darkCyan), QColor(Qt.GlobalColor.darkYellow)]
+MARGIN = 4
+LABEL_WIDTH = 60
+
+_REFRESH = tracer.site('plot_refresh', 'gui')
+
+
+def _rows_with(data: np.ndarray, column: int) -> np.ndarray:
+    """Rows of the sample type that fills 'column', as the other types leave it zeroed"""
+    if QUAT_COLS.start <= column < QUAT_COLS.stop:
+        return quat_rows(data)
+    if MAG_COLS.start <= column < MAG_COLS.stop:
+        return mag_rows(data)
+    return imu_rows(data)
+
+
+class DeviceTrace:
+    """
+    Min/max of every plotted channel per pixel column, over the last 'history' seconds.
+
+    The columns form a ring indexed by absolute bin number (sys_time / bin width), so new rows
+    are folded in at a cost proportional to their number, and drawing costs the same whatever
+    the sample rate and history length.
+    """
+    def __init__(self, width: int, channels: int, bin_width: float):
+        self.width = width
+        self.bin_width = bin_width
+        self.mins = np.full((width, channels), np.inf)
+        self.maxs = np.full((width, channels), -np.inf)
+        # Polyline points of one channel, reused for every frame
+        self.points = np.empty((2 * width, 2))
+        self.head = None  # Absolute number of the newest bin
+        self.consumed = 0  # Stream sample count up to which rows were folded in
+
+    def fold(self, data: np.ndarray, columns: List[int]) -> None:
+        bins = np.floor(data[:, 0] / self.bin_width).astype(np.int64)
+        newest = int(bins.max())
+        if self.head is None:
+            self.head = newest
+        elif newest > self.head:
+            # Clear the bins that scroll in
+            cleared = np.arange(max(self.head + 1, newest - self.width + 1), newest + 1) % self.width
+            self.mins[cleared] = np.inf
+            self.maxs[cleared] = -np.inf
+            self.head = newest
+
+        for k, column in enumerate(columns):
+            rows = _rows_with(data, column)
+            b = np.floor(rows[:, 0] / self.bin_width).astype(np.int64)
+            keep = b > self.head - self.width
+            positions = b[keep] % self.width
+            np.minimum.at(self.mins[:, k], positions, rows[keep, column])
+            np.maximum.at(self.maxs[:, k], positions, rows[keep, column])
+
+    def ordered(self):
+        """Min and max per pixel column, from oldest to newest"""
+        order = np.arange(self.head + 1, self.head + 1 + self.width) % self.width
+        return self.mins[order], self.maxs[order]
+
+
+class LivePlot(QWidget):
+    """
+    Live view of the streamed devices, one strip per device.
+
+    New data only marks a device as changed (mark_changed), at most 'plot_max_fps' times per
+    second the new rows of the changed devices are folded into their DeviceTrace, and only their
+    strips are repainted. The Stream may run on another thread: its buffers are only read.
+    """
+    def __init__(self, config, parent=None):
+        super().__init__(parent)
+        self.config = config
+        headers = list(config.characteristics[0].column_headers)
+        self.channels = list(config.plot_channels)
+        self.columns = [headers.index(c) for c in self.channels]
+        self.history = config.plot_history
+        self.stream = None
+        self.devices = []  # type: List[str]
+        self.traces = {}  # type: Dict[str, DeviceTrace]
+        self.changed = set()  # type: Set[str]
+        self.setMinimumSize(400, 200)
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(max(1, int(1000 / config.plot_max_fps)))
+        self.timer.timeout.connect(self.refresh)
+
+    def start(self, stream, devices: List[str]) -> None:
+        self.stream = stream
+        self.devices = sorted(devices)
+        self._reset_traces()
+        self.timer.start()
+
+    def stop(self) -> None:
+        self.stream = None
+        self.timer.stop()
+
+    @Slot(str)
+    def mark_changed(self, device_name: str) -> None:
+        self.changed.add(device_name)
+
+    def _plot_width(self) -> int:
+        return max(1, self.width() - LABEL_WIDTH - 2 * MARGIN)
+
+    def _reset_traces(self) -> None:
+        width = self._plot_width()
+        self.traces = {name: DeviceTrace(width, len(self.columns), self.history / width) for name in self.devices}
+        self.changed = set(self.devices)
+
+    def _strip_rect(self, i: int) -> QRect:
+        height = max(1, (self.height() - MARGIN) // max(1, len(self.devices)))
+        return QRect(LABEL_WIDTH + MARGIN, MARGIN + i * height, self._plot_width(), height - MARGIN)
+
+    @Slot(None)
+    def refresh(self) -> None:
+        if self.stream is None:
+            return
+        t0 = _REFRESH.start()
+        for name in self.changed:
+            trace = self.traces.get(name)
+            if trace is None or name not in self.stream.output_queues:
+                continue
+            self._fold_new_rows(name, trace)
+            self.update(self._strip_rect(self.devices.index(name)).adjusted(-LABEL_WIDTH, 0, 0, 0))
+        _REFRESH.end(t0, len(self.changed))
+        self.changed = set()
+
+    def _fold_new_rows(self, name: str, trace: DeviceTrace) -> None:
+        count = self.stream.sample_counts.get(name, 0)
+        new = count - trace.consumed
+        if new <= 0:
+            return
+        # Take the newest blocks until they cover the new rows
+        blocks = []
+        rows = 0
+        # Copy the deque first, as the acquisition thread keeps appending to it
+        for block in reversed(list(self.stream.output_queues[name])):
+            blocks.append(block)
+            rows += len(block)
+            if rows >= new:
+                break
+        trace.consumed = count
+        if blocks:
+            trace.fold(np.vstack(blocks[::-1])[-new:], self.columns)
+
+    def resizeEvent(self, event) -> None:
+        super().resizeEvent(event)
+        # Rebuild the traces at the new width from the buffered rows
+        if self.stream is not None:
+            self._reset_traces()
+            self.refresh()
+
+    def paintEvent(self, event) -> None:
+        painter = QPainter(self)
+        painter.fillRect(event.rect(), self.palette().base())
+        for i, name in enumerate(self.devices):
+            rect = self._strip_rect(i)
+            if not event.rect().intersects(rect.adjusted(-LABEL_WIDTH, 0, 0, 0)):
+                continue
+            painter.setPen(QPen(self.palette().mid().color()))
+            painter.drawRect(rect)
+            painter.setPen(QPen(self.palette().text().color()))
+            painter.drawText(QRect(MARGIN, rect.top(), LABEL_WIDTH - MARGIN, rect.height()),
+                             Qt.AlignmentFlag.AlignVCenter, name)
+            trace = self.traces.get(name)
+            if trace is not None and trace.head is not None:
+                self._draw_trace(painter, rect, trace)
+            if i == 0:
+                self._draw_legend(painter, rect)
+        painter.end()
+
+    def _draw_legend(self, painter: QPainter, rect: QRect) -> None:
+        x = rect.right() - MARGIN
+        for k in reversed(range(len(self.channels))):
+            width = painter.fontMetrics().horizontalAdvance(self.channels[k])
+            x -= width
+            painter.setPen(QPen(COLORS[k % len(COLORS)]))
+            painter.drawText(x, rect.top() + painter.fontMetrics().ascent() + MARGIN, self.channels[k])
+            x -= 2 * MARGIN
+
+    def _draw_trace(self, painter: QPainter, rect: QRect, trace: DeviceTrace) -> None:
+        mins, maxs = trace.ordered()
+        valid = np.isfinite(mins)
+        if not valid.any():
+            return
+        lo, hi = mins[valid].min(), maxs[valid].max()
+        if math.isclose(lo, hi):
+            lo, hi = lo - 1, hi + 1
+        scale = (rect.height() - 2) / (hi - lo)
+        # Traces of a stopped stream keep their width when the widget is resized
+        painter.setClipRect(rect)
+        x = rect.left() + np.arange(trace.width)
+        for k in range(len(self.columns)):
+            v = valid[:, k]
+            n = int(v.sum())
+            if not n:
+                continue
+            # Vertical min/max segment per pixel column, joined into one polyline
+            points = trace.points[:2 * n]
+            points[0::2, 0] = points[1::2, 0] = x[v]
+            points[0::2, 1] = rect.bottom() - 1 - (mins[v, k] - lo) * scale
+            points[1::2, 1] = rect.bottom() - 1 - (maxs[v, k] - lo) * scale
+            painter.setPen(QPen(COLORS[k % len(COLORS)]))
+            painter.drawPolyline(QPolygonF([QPointF(px, py) for px, py in points.tolist()]))
+        painter.setClipping(False)
@@ -1,8 +1,8 @@
 import asyncio
+import bisect
 import logging
-from collections import deque
 from PySide6.QtGui import QFont
-from PySide6.QtCore import QEvent, QThread, Slot
+from PySide6.QtCore import QEvent, Slot
 from PySide6.QtWidgets import (
     QApplication, 
     QCheckBox, 
@@ -13,7 +13,7 @@ from PySide6.QtWidgets import (
     QWidget, 
 )
 
-from gui import AcquisitionUI, ConnectionIndicator
+from gui import AcquisitionEvents, AcquisitionUI, ConnectionIndicator
 import library as imu
 
 
@@ -36,27 +36,58 @@ class MainWindow(QMainWindow):
         
         # Set up logging
         self.imu_config = imu.conf
-        self.log = imu.Log(log_file='log.txt', 
-                       log_level=logging.DEBUG, 
-                       gui_logger=self.log_output)
+        self.log_setup = imu.Log(log_file='log.txt',
+                                 log_level=logging.DEBUG,
+                                 gui_logger=self.log_output,
+                                 json_file=self.imu_config.log_json_file,
+                                 rate_limit=self.imu_config.log_rate_limit,
+                                 rate_interval=self.imu_config.log_rate_interval)
+        self.log = logging.getLogger('log')
         self.log.info("Application started")
+        imu.tracer.configure(self.imu_config.trace_buffer_size, self.imu_config.trace_sample_every)
 
         # Set local variable defaults
-        self.halt_event = asyncio.Event()
+        self.scanned_devices = []
+        self.device_layouts = []
         self.checkboxes = []
         self.indicators = []
-        self.imu_data_queues = {}
+        self.checked_indicators = {}
 
-        # Set up a BT scanner for the motion trackers
-        self.imu_scanner = imu.Scanner(self.imu_config, self.halt_event)
+        # Scanning and data streaming run on their own event loop, in the acquisition thread,
+        # so that a busy GUI does not delay notification handling
+        self.acquisition = imu.AcquisitionThread(self.imu_config)
+        self.acquisition.start()
+        self.imu_scanner = self.acquisition.scanner
+        self.stream = self.acquisition.stream
         self.imu_path = self.imu_config.output_folder
 
-        # Set up data streaming from the motion trackers
-        self.stream = imu.Stream(self.imu_config, self.halt_event, self.imu_data_queues)
-        self.stream_thread = QThread()
-        self.stream_thread.setObjectName('Stream Thread')
-        self.stream.moveToThread(self.stream_thread)
-        self.stream_thread.start()
+        # List configured and previously seen devices, so recording can start without a scan
+        if self.imu_config.warm_start:
+            for device in self.imu_scanner.registry.known_devices():
+                self.add_device(device, checked=device.adr in self.imu_scanner.registry.persisted)
+            self.scan_done()
+
+        # Handle the events of the acquisition thread on the GUI thread
+        self.acquisition_events = AcquisitionEvents(self.acquisition, self)
+        self.acquisition_events.device_found.connect(self.add_device)
+        self.acquisition_events.connect_state.connect(self.set_connect_state)
+        self.acquisition_events.new_data.connect(self.live_plot.mark_changed)
+        self.acquisition_events.error.connect(self.show_error)
+
+    @Slot(str, bool)
+    def set_connect_state(self, device_name, state):
+        indicator = self.checked_indicators.get(device_name)
+        if indicator is None:
+            return
+        if state:
+            indicator.on()
+        else:
+            indicator.off()
+
+    @Slot(str)
+    def show_error(self, message):
+        # Failed acquisition commands, already logged by the acquisition thread
+        QMessageBox.warning(self, "Error", message, QMessageBox.StandardButton.Ok)
 
     @Slot(None)
     def browse_imu_path(self):
@@ -70,55 +101,82 @@ class MainWindow(QMainWindow):
             self.imu_path_input.setText(data_path)
             self.imu_path = data_path
 
+    @Slot(bool)
+    def toggle_tracing(self, checked):
+        """
+        Start recording spans of the acquisition stages, or stop and save them to the data path
+        """
+        if checked:
+            imu.tracer.start()
+            self.log.info("Tracing started")
+        else:
+            imu.tracer.stop()
+            path = imu.tracer.export_to(self.imu_path)
+            self.log.info(f"Trace saved to {path}")
+
     @Slot(None)
     async def scan_for_devices(self):
         # Enable/disable buttons
         self.scan_button.setText(" Scanning...")
         self.scan_button.setEnabled(False)
         self.start_button.setEnabled(False)
-        # Wait for the scan to finish, then execute the scan_done function
+        self.clear_devices()
+        # Devices are added to the list as soon as they are seen, then execute the scan_done function
         self.log.info("Starting device scan")
-        await self.imu_scanner.scan_for_devices()
-        self.log.info("Completed device scan")
+        try:
+            await asyncio.wrap_future(self.acquisition.submit('scan'))
+            self.log.info("Completed device scan")
+        except Exception:
+            # Reported by show_error
+            pass
+        # Add the devices found last, before the scan buttons are reset
+        self.acquisition_events.poll()
         self.scan_done()
 
-    def scan_done(self):
+    def clear_devices(self):
         # Clear the device lists
         for checkbox in self.checkboxes:
             checkbox.deleteLater()
         for indicator in self.indicators:
             indicator.deleteLater()
+        for device_layout in self.device_layouts:
+            self.device_frame_layout.removeItem(device_layout)
+            device_layout.deleteLater()
+        self.scanned_devices = []
+        self.device_layouts = []
         self.checkboxes = []
         self.indicators = []
 
-        # Sort the scanned devices alphabetically by device name
-        self.imu_scanner.scanned_devices = sorted(self.imu_scanner.scanned_devices, key=lambda device: device.get_id())
-        
-        # Create checkboxes for each device
-        for device in self.imu_scanner.scanned_devices:
-            # Create layout for each device
-            device_layout = QHBoxLayout()
-
-            # Create checkbox for each device
-            device_name = device.get_id()
-            checkbox = QCheckBox(device_name)
-            checkbox.setFont(QFont("Arial", 12))
-            checkbox.setChecked(True)
-            device_layout.addWidget(checkbox)
-            self.checkboxes.append(checkbox)
-            
-            # Create connection status indicator for each device
-            indicator = ConnectionIndicator()
-            device_layout.addWidget(indicator)
-            self.indicators.append(indicator)
-            
-            # Add the device layout to the frame
-            self.device_frame_layout.addLayout(device_layout)
-        
+    def add_device(self, device, checked=True):
+        # Keep the device list sorted alphabetically by device name
+        device_name = device.get_id()
+        index = bisect.bisect([d.get_id() for d in self.scanned_devices], device_name)
+
+        # Create layout for the device
+        device_layout = QHBoxLayout()
+
+        # Create checkbox for the device
+        checkbox = QCheckBox(device_name)
+        checkbox.setFont(QFont("Arial", 12))
+        checkbox.setChecked(checked)
+        device_layout.addWidget(checkbox)
+
+        # Create connection status indicator for the device
+        indicator = ConnectionIndicator()
+        device_layout.addWidget(indicator)
+
+        # Add the device layout to the frame
+        self.scanned_devices.insert(index, device)
+        self.device_layouts.insert(index, device_layout)
+        self.checkboxes.insert(index, checkbox)
+        self.indicators.insert(index, indicator)
+        self.device_frame_layout.insertLayout(index, device_layout)
+
+    def scan_done(self):
         # Reset the buttons
         self.scan_button.setText(" Device Scan")
         self.scan_button.setEnabled(True)
-        if self.imu_scanner.scanned_devices:
+        if self.scanned_devices:
             self.start_button.setEnabled(True)
         else:
             self.start_button.setEnabled(False)
@@ -144,7 +202,7 @@ class MainWindow(QMainWindow):
         # Check if any recording devices are selected
         self.checked_devices = {
             checkbox.text(): (device, indicator) for device, checkbox, indicator 
-            in zip(self.imu_scanner.scanned_devices, self.checkboxes, self.indicators) if checkbox.isChecked()
+            in zip(self.scanned_devices, self.checkboxes, self.indicators) if checkbox.isChecked()
         }
         if not self.recording_devices_selected():
             return
@@ -154,7 +212,19 @@ class MainWindow(QMainWindow):
         self.log.info(f"Saving data to {self.imu_path}")
         
         # Start the data stream
-        self.stream.start(self.checked_devices, self.imu_path)
+        self.checked_indicators = {name: indicator for name, (_, indicator) in self.checked_devices.items()}
+        self.start_button.setEnabled(False)
+        self.scan_button.setEnabled(False)
+        try:
+            await asyncio.wrap_future(self.acquisition.submit(
+                'start', {name: device for name, (device, _) in self.checked_devices.items()}, self.imu_path))
+        except Exception:
+            # Reported by show_error, reset the buttons for another attempt
+            self.checked_indicators = {}
+            self.start_button.setEnabled(True)
+            self.scan_button.setEnabled(True)
+            return
+        self.live_plot.start(self.stream, list(self.checked_devices))
         
         # Enable/disable buttons
         self.start_button.setText(" Recording")
@@ -164,15 +234,10 @@ class MainWindow(QMainWindow):
     
     @Slot(None)
     async def stop_recording(self):
-        # Set global halt event
-        self.halt_event.set()
-
-        # Stop the prediction and data stream
-        await self.stream.stop()
+        # Stop the data stream, this also persists the connection history of all devices
+        await asyncio.wrap_future(self.acquisition.submit('stop'))
+        self.live_plot.stop()
         self.log.info("Stopped recording")
-        
-        # Clear halt event
-        self.halt_event.clear()
 
         # Reset the buttons and indicators
         for indicator in self.indicators:
@@ -193,13 +258,13 @@ class MainWindow(QMainWindow):
             while not event.isAccepted():
                 app.processEvents()
             self.log.info("Closing application")
+            self.log_setup.close()
             app.quit()
     
     @Slot(QEvent)
     async def closeApplication(self, event):
-        # Set global halt event
-        self.halt_event.set()
-        # Stop threads and processes
-        await self.stream.stop()
-        self.stream_thread.quit()
+        # Stop the acquisition loop and its thread
+        self.acquisition_events.stop()
+        await asyncio.wrap_future(self.acquisition.submit('shutdown'))
+        self.acquisition.join()
         event.accept()
@@ -1,9 +1,60 @@
-from .config import conf
-from .connectionmanager import ConnectionManager
-from .consumermanager import ConsumerManager
-from .csvlogger import CSVLogger
-from .decoders import decode_data
-from .log import Log, LogReroute
-from .scanner import Scanner
-from .stream import Stream
-from .quaternion import Quaternion
\ No newline at end of file
+"""
+The public names of the library are imported on first access, so that importing e.g.
+library.decoders or library.datatypes does not load bleak, aiofiles, vqf or the consumers.
+"""
+import importlib
+from typing import TYPE_CHECKING
+
+_EXPORTS = {
+    'conf': '.config',
+    'create_backend': '.blebackend',
+    'ConnectionManager': '.connectionmanager',
+    'ConsumerManager': '.consumermanager',
+    'CSVLogger': '.csvlogger',
+    'decode_data': '.decoders',
+    'Evaluator': '.evaluation',
+    'Recording': '.evaluation',
+    'FeatureEngine': '.features',
+    'FeatureGraph': '.featuregraph',
+    'Log': '.log',
+    'LogReroute': '.log',
+    'Scanner': '.scanner',
+    'Stream': '.stream',
+    'tracer': '.tracing',
+    'Tracer': '.tracing',
+    'AcquisitionThread': '.acquisitionthread',
+    'Quaternion': '.quaternion',
+    'QuaternionArray': '.quaternion',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
+
+
+if TYPE_CHECKING:
+    from .config import conf
+    from .blebackend import create_backend
+    from .connectionmanager import ConnectionManager
+    from .consumermanager import ConsumerManager
+    from .csvlogger import CSVLogger
+    from .decoders import decode_data
+    from .evaluation import Evaluator, Recording
+    from .features import FeatureEngine
+    from .featuregraph import FeatureGraph
+    from .log import Log, LogReroute
+    from .scanner import Scanner
+    from .stream import Stream
+    from .tracing import Tracer, tracer
+    from .acquisitionthread import AcquisitionThread
+    from .quaternion import Quaternion, QuaternionArray
\ No newline at end of file
@@ -0,0 +1,171 @@
+"""
+Acquisition on a dedicated asyncio loop, in its own thread.
+
+The scanner, the Stream with its connections, decoding and consumers, and the BLE backend all
+live on this loop, so a busy GUI thread (modal dialogs, slow repaints) does not delay the
+handling of notifications. Other threads only talk to it through two thread-safe queues:
+
+    commands    submit() puts a Command on the loop's command queue, and returns a future
+                for its result ('scan', 'start', 'stop' and 'shutdown')
+    events      acquisition events, collected with events(): ('device', SeenDevice),
+                ('scan_done',), ('connect_state', name, connected), ('new_data', name),
+                ('stopped',) and ('error', message). New data is reported once per device
+                and call of events(), however many blocks arrived in between
+
+Attributes such as stream.output_queues may be read from other threads (e.g. by copying a deque
+with list()), but must only be modified on the acquisition loop.
+"""
+import queue
+import asyncio
+import logging
+import threading
+import concurrent.futures
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Tuple, Union
+from .blebackend import backend_config, create_backend
+from .datatypes import Configuration, SeenDevice
+from .scanner import Scanner
+from .stream import Stream
+
+
+@dataclass
+class Command:
+    name: str
+    args: Tuple[Any, ...] = ()
+    future: concurrent.futures.Future = field(default_factory=concurrent.futures.Future)
+
+
+class AcquisitionThread:
+    def __init__(self, config: Configuration):
+        self.log = logging.getLogger('log')
+        self.config = backend_config(config)
+        self.loop = None  # type: asyncio.AbstractEventLoop
+        self.thread = threading.Thread(target=self._run, name='Acquisition Thread', daemon=True)
+        self.ready = threading.Event()
+        # Raised by start() if the acquisition loop could not be set up:
+        self.setup_error = None  # type: Union[BaseException, None]
+        self.event_queue = queue.SimpleQueue()
+        # Devices with new data since the last call of events():
+        self.new_data = set()
+        self.new_data_lock = threading.Lock()
+        self.command_queue = None  # type: asyncio.Queue
+        # Created on the acquisition loop:
+        self.backend = None
+        self.halt_event = None  # type: asyncio.Event
+        self.scanner = None  # type: Scanner
+        self.stream = None  # type: Stream
+        self.output_queues = {}
+        self.recording = False
+
+    def start(self) -> None:
+        """Start the thread, and wait until the scanner and stream exist"""
+        self.thread.start()
+        self.ready.wait()
+        if self.setup_error is not None:
+            self.thread.join()
+            raise self.setup_error
+
+    def submit(self, name: str, *args) -> concurrent.futures.Future:
+        """Queue a command for the acquisition loop, from any thread"""
+        if self.loop is None or self.command_queue is None or self.loop.is_closed():
+            raise RuntimeError(f'Cannot submit {name}: the acquisition loop is not running')
+        command = Command(name, args)
+        try:
+            self.loop.call_soon_threadsafe(self.command_queue.put_nowait, command)
+        except RuntimeError:
+            # Closed after the check above
+            raise RuntimeError(f'Cannot submit {name}: the acquisition loop is not running')
+        return command.future
+
+    def events(self) -> List[Tuple]:
+        """All events since the last call, from any thread"""
+        events = []
+        while True:
+            try:
+                events.append(self.event_queue.get_nowait())
+            except queue.Empty:
+                break
+        with self.new_data_lock:
+            names, self.new_data = self.new_data, set()
+        events += [('new_data', name) for name in names]
+        return events
+
+    def join(self, timeout: float = None) -> None:
+        self.thread.join(timeout)
+
+    def _run(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._main())
+        finally:
+            self.loop.close()
+
+    async def _main(self) -> None:
+        try:
+            self.halt_event = asyncio.Event()
+            self.backend = create_backend(self.config)
+            self.scanner = Scanner(self.config, self.halt_event, self.backend)
+            self.stream = Stream(self.config, self.halt_event, self.output_queues, self.backend)
+            self.stream.block_listeners.append(self._on_new_data)
+        except Exception as e:
+            self.log.error(f'Could not set up the acquisition: {e}')
+            self.setup_error = e
+            return
+        else:
+            self.command_queue = asyncio.Queue()
+        finally:
+            # Never leave start() waiting
+            self.ready.set()
+
+        while True:
+            command = await self.command_queue.get()
+            try:
+                result = await getattr(self, f'_cmd_{command.name}')(*command.args)
+                command.future.set_result(result)
+            except Exception as e:
+                self.log.error(f'Acquisition command {command.name} failed: {e}')
+                self.event_queue.put(('error', str(e)))
+                command.future.set_exception(e)
+            if command.name == 'shutdown':
+                return
+
+    def _on_new_data(self, name: str, data) -> None:
+        with self.new_data_lock:
+            self.new_data.add(name)
+
+    async def _cmd_scan(self) -> List[SeenDevice]:
+        await self.scanner.scan_for_devices(on_device=lambda d: self.event_queue.put(('device', d)))
+        self.event_queue.put(('scan_done',))
+        return list(self.scanner.scanned_devices)
+
+    async def _cmd_start(self, devices: Dict[str, SeenDevice], data_path: str = None) -> None:
+        # Indicators belong to the GUI thread, connection states are sent as events instead
+        try:
+            self.stream.start({name: (device, None) for name, device in devices.items()}, data_path)
+        except Exception:
+            # Release what was set up before the failure, e.g. the shared memory export
+            await self.stream.stop()
+            raise
+        self.stream.connection_manager.connect_state.connect(lambda d, s: self.event_queue.put(('connect_state', d, s)))
+        self.recording = True
+        # Keep scanning while connecting, so that devices that cannot be reached
+        # directly are connected as soon as they are seen
+        if self.config.warm_start:
+            await self.scanner.start()
+
+    async def _cmd_stop(self) -> None:
+        if not self.recording:
+            return
+        self.halt_event.set()
+        await self.stream.stop()
+        # Persist the connection history of all devices
+        self.scanner.registry.save()
+        self.halt_event.clear()
+        self.recording = False
+        self.event_queue.put(('stopped',))
+
+    async def _cmd_shutdown(self) -> None:
+        await self._cmd_stop()
+        self.halt_event.set()
+        await self.scanner.stop()
@@ -5,34 +5,66 @@ import functools
 from typing import Dict, Union, Callable
 from bleak import BleakClient
 from bleak.exc import BleakDeviceNotFoundError, BleakDBusError, BleakError
-from .datatypes import Characteristic, Configuration, ConnectionState, NotifData
+from .blebackend import BLEBackend, BleakBackend
+from .capture import CaptureWriter
+from .datatypes import Characteristic, Configuration, ConnectionState
+from .decodestage import DecodeStage, NotifBuffer
+from .events import wait_any
+from .timeouts import TimeoutScheduler
+from .tracing import tracer
+
+_NOTIFICATION = tracer.site('notification', 'ble')
+_CONNECT = tracer.site('connect', 'ble', sampled=False, asynchronous=True)
 
 
 class ActiveConnectionException(Exception): ...
 
 
 class ActiveConnection:
-    def __init__(self, adr: str, name: str,  config: Configuration, halt_event: asyncio.Event, output_queue: asyncio.Queue, callback: Callable) -> None:
+    def __init__(self, adr: str, name: str,  config: Configuration, halt_event: asyncio.Event, decode_stage: DecodeStage, timeouts: TimeoutScheduler, state_callback: Callable = None,
+                 capture: CaptureWriter = None, backend: BLEBackend = None) -> None:
         self.log = logging.getLogger('log')
         
         self.adr = adr
         self.name = name
         self.halt_event = halt_event
         self.config = config
-        self.output_queue = output_queue
-        self.data_received_callback = callback
+        self.decode_stage = decode_stage
+        self.notif_buffer = NotifBuffer(config.notif_buffer_size)
+        self.state_callback = state_callback
+        self.timeouts = timeouts
+        self.timed_out_char = None
+        # Optional raw notification capture:
+        self.capture = capture
+        self.backend = backend if backend is not None else BleakBackend()
         
-        self.state = ConnectionState.CONNECTING
+        self._state = ConnectionState.CONNECTING
         self.did_disconnect = False
         self.initial_connection_time = None
+        self.first_notif_time = None
+
+    @property
+    def state(self) -> ConnectionState:
+        return self._state
+
+    @state.setter
+    def state(self, state: ConnectionState) -> None:
+        # Notify the connection manager of state transitions only
+        if state != self._state:
+            self._state = state
+            if self.state_callback:
+                self.state_callback(self.adr, state)
 
     async def run(self) -> None:
         # Reset initial parameters
         self.state = ConnectionState.CONNECTING
         self.did_disconnect = False
         self.initial_connection_time = None
+        self.first_notif_time = None
+        self.timed_out_char = None
+        self.wake_event = asyncio.Event()
         self.last_notif = {c.uuid: None for c in self.config.characteristics}  # type: Dict[str, Union[None, int]]
-        self.con = BleakClient(
+        self.con = self.backend.create_client(
             self.adr,
             timeout=self.config.connect_timeout,
             disconnected_callback=self._disconnected_callback,
@@ -45,9 +77,14 @@ class ActiveConnection:
                 raise ActiveConnectionException()
 
             # Connect:
-            await self._connect(self.con)
+            t0 = _CONNECT.start()
+            try:
+                await self._connect(self.con)
+            finally:
+                _CONNECT.end(t0, self.name)
             self.initial_connection_time = time.monotonic_ns()
             self.state = ConnectionState.CONNECTED
+            self._arm_initial_timeouts()
 
             while not self.halt_event.is_set():
                 # Check disconnect flag (set by disconnect callback or manual disconnect)
@@ -56,7 +93,7 @@ class ActiveConnection:
                     raise ActiveConnectionException()
 
                 await self._check_for_timeout()
-                await asyncio.sleep(0.2)
+                await self._wait_for_event()
         except TimeoutError:
             self.state = ConnectionState.TIMEOUT
         except ActiveConnectionException:
@@ -68,6 +105,14 @@ class ActiveConnection:
         else:
             await self._do_disconnect()
             self.state = ConnectionState.DISCONNECTED
+        finally:
+            for char in self.config.characteristics:
+                self.timeouts.cancel((self.adr, char.uuid))
+
+    async def _wait_for_event(self) -> None:
+        # Sleep until disconnected, a characteristic timed out or the halt event is set
+        await wait_any(self.wake_event, self.halt_event)
+        self.wake_event.clear()
 
     async def _connect(self, con: BleakClient) -> None:
         # Note: According to the docs, Bleak generates exceptions if connecting fails under linux,
@@ -109,60 +154,55 @@ class ActiveConnection:
             await con.start_notify(char.uuid, callback_wrapper)
         self.log.debug(f'Enabled notifications for all characteristics for {self.name}')
 
-    async def _check_for_timeout(self) -> None:
+    def _arm_initial_timeouts(self) -> None:
+        # Characteristics get an additional initial timeout for their first notification.
+        # Without initial_characteristic_timeout, only notifying characteristics time out.
+        if self.config.initial_characteristic_timeout is None:
+            return
         for char in self.config.characteristics:
-            if char.timeout is not None:
-                last_notif = self.last_notif[char.uuid]
-
-                if last_notif is not None:
-                    # Check if normal timeout expired
-                    timeout = char.timeout
-                    has_been = (time.monotonic_ns() - last_notif)/1e9
+            if char.timeout is not None and self.last_notif[char.uuid] is None:
+                timeout = char.timeout + self.config.initial_characteristic_timeout
+                deadline = self.initial_connection_time + int(timeout * 1e9)
+                self.timeouts.arm((self.adr, char.uuid), deadline, self._on_char_timeout)
 
-                    if has_been > timeout:
-                        self.log.warning(f'{self.name}: Timeout for characteristic {char.name} expired, disconnecting..')
-                        self.state = ConnectionState.TIMEOUT
-                        await self._do_disconnect()
-                        raise ActiveConnectionException()
+    def _on_char_timeout(self, key) -> None:
+        self.timed_out_char = self.config.get_characteristic(key[1])
+        self.wake_event.set()
 
-                elif self.config.initial_characteristic_timeout is not None:
-                    if self.initial_connection_time is None:
-                        raise Exception("Implementation error")
-
-                    # Check if initial timeout expired
-                    timeout = char.timeout + self.config.initial_characteristic_timeout
-                    has_been = (time.monotonic_ns() - self.initial_connection_time) / 1e9
-
-                    if has_been > timeout:
-                        self.log.warning(f'{self.name}: Never received a notification for {char.name}, disconnecting...')
-                        self.state = ConnectionState.TIMEOUT
-                        await self._do_disconnect()
+    async def _check_for_timeout(self) -> None:
+        char = self.timed_out_char
+        if char is None:
+            return
+        if self.last_notif[char.uuid] is not None:
+            self.log.warning(f'{self.name}: Timeout for characteristic {char.name} expired, disconnecting..')
+        else:
+            self.log.warning(f'{self.name}: Never received a notification for {char.name}, disconnecting...')
+        self.state = ConnectionState.TIMEOUT
+        await self._do_disconnect()
+        raise ActiveConnectionException()
 
     def _disconnected_callback(self, _) -> None:
         self.did_disconnect = True
+        self.wake_event.set()
 
     def _notif_callback(self, dev: int, data: bytearray, char: Characteristic) -> None:
         _ = dev
 
-        self.last_notif[char.uuid] = time.monotonic_ns()
-
-        try:
-            # Decode and package data:
-            decoded_data = char.decoder(data)
-            result = NotifData(self.adr, self.name, char, decoded_data)
-            
-            # Notify Stream class if callback function is set
-            if self.data_received_callback:
-                self.data_received_callback(self.adr, self.name, result.data)
-            
-            # Put data into file output queue
-            try:
-                self.output_queue.put_nowait(result)
-            except asyncio.QueueFull:
-                self.self.log.error(f"{self.name} failed to put data into queue")
-                
-        except Exception as e:
-            self.log.error(f"Decoder for {char.name} raised an exception: {e}")
+        t0 = _NOTIFICATION.start()
+        t = time.monotonic_ns()
+        self.last_notif[char.uuid] = t
+        if self.first_notif_time is None:
+            self.first_notif_time = t
+        if self.capture is not None:
+            self.capture.write(t, self.adr, char.uuid, data)
+        if char.timeout is not None:
+            # Push the characteristic's deadline back
+            self.timeouts.arm((self.adr, char.uuid), t + int(char.timeout * 1e9), self._on_char_timeout)
+
+        # Defer decoding to the decode stage
+        if self.notif_buffer.put(t, char, data):
+            self.decode_stage.schedule(self)
+        _NOTIFICATION.end(t0, self.name)
     
     async def _do_disconnect(self) -> None:
         if self.con is not None:
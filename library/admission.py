@@ -0,0 +1,43 @@
+import math
+import logging
+from typing import Union
+from .datatypes import Configuration
+
+
+class AdmissionController:
+    """
+    Adapts the number of simultaneous connection attempts to how well the adapter copes.
+
+    Additive increase / multiplicative decrease: every successful attempt raises the limit by
+    1/limit (about one per round of attempts) as long as the average connect latency stays below
+    'connect_latency_target'. A failed attempt halves the limit, and slow connections shrink it.
+    """
+    def __init__(self, config: Configuration):
+        self.config = config
+        self.log = logging.getLogger('log')
+        self.min_limit = 1
+        self.max_limit = max(config.max_simultaneous_connection_attempts, config.max_connection_attempts_limit)
+        self.limit = float(config.max_simultaneous_connection_attempts)
+        self.latency = None  # type: Union[float, None]
+        self.smoothing = 0.3
+
+    def allowed_attempts(self) -> int:
+        if not self.config.adaptive_connection_attempts:
+            return self.config.max_simultaneous_connection_attempts
+        return int(math.floor(self.limit))
+
+    def on_success(self, latency: float) -> None:
+        self.latency = latency if self.latency is None else (1 - self.smoothing) * self.latency + self.smoothing * latency
+        if self.latency > self.config.connect_latency_target:
+            self._set_limit(self.limit * 0.75)
+        else:
+            self._set_limit(self.limit + 1 / self.limit)
+
+    def on_failure(self) -> None:
+        self._set_limit(self.limit / 2)
+
+    def _set_limit(self, limit: float) -> None:
+        old = self.allowed_attempts()
+        self.limit = min(self.max_limit, max(self.min_limit, limit))
+        if self.config.adaptive_connection_attempts and self.allowed_attempts() != old:
+            self.log.debug(f'Simultaneous connection attempts: {old} -> {self.allowed_attempts()}')
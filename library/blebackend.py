@@ -0,0 +1,62 @@
+"""
+BLE backends used by the Scanner and ActiveConnection.
+
+A backend creates scanners and clients with the interface of bleak's BleakScanner and
+BleakClient, as far as it is used by this library:
+
+    scanner = backend.create_scanner(detection_callback)    # callback(device, advertisement_data)
+    await scanner.start() / await scanner.stop()
+
+    client = backend.create_client(address, timeout=..., disconnected_callback=...)
+    await client.connect() / write_gatt_char(uuid, data) / start_notify(uuid, callback) / disconnect()
+
+Errors are raised as bleak exceptions. The backend is selected with 'ble_backend' in config.py.
+"""
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Callable, Set, Union
+from .datatypes import Configuration
+
+if TYPE_CHECKING:
+    from bleak import BleakClient, BleakScanner
+
+
+class BLEBackend(ABC):
+    """Basic interface for a BLE backend"""
+
+    @abstractmethod
+    def create_scanner(self, detection_callback: Callable): ...
+
+    @abstractmethod
+    def create_client(self, adr: str, timeout: float = None, disconnected_callback: Callable = None, **kwargs): ...
+
+    def addresses(self) -> Union[Set[str], None]:
+        """Addresses of the devices the backend can reach, None if they are not known in advance"""
+        return None
+
+
+class BleakBackend(BLEBackend):
+    """Real Bluetooth hardware, through bleak."""
+    def create_scanner(self, detection_callback: Callable) -> 'BleakScanner':
+        from bleak import BleakScanner
+        return BleakScanner(detection_callback=detection_callback)
+
+    def create_client(self, adr: str, timeout: float = None, disconnected_callback: Callable = None, **kwargs) -> 'BleakClient':
+        from bleak import BleakClient
+        return BleakClient(adr, timeout=timeout, disconnected_callback=disconnected_callback, **kwargs)
+
+
+def backend_config(config: Configuration) -> Configuration:
+    """The configuration to use with the selected backend: the simulator names its trackers with aliases"""
+    if config.ble_backend == 'simulator':
+        from .simulator import with_simulated_aliases
+        return with_simulated_aliases(config)
+    return config
+
+
+def create_backend(config: Configuration) -> BLEBackend:
+    if config.ble_backend == 'bleak':
+        return BleakBackend()
+    elif config.ble_backend == 'simulator':
+        from .simulator import Simulator
+        return Simulator(config)
+    raise ValueError(f'Unknown BLE backend "{config.ble_backend}"')
@@ -0,0 +1,141 @@
+"""
+Binary capture of raw BLE notifications.
+
+A capture file starts with the magic bytes below, followed by a sequence of records. Device
+addresses and characteristic UUIDs are defined once, the first time they occur, and referenced
+by a 16 bit ID afterwards:
+
+    definition:   tag (u8: 0 = device, 1 = characteristic), id (u16), length (u16), UTF-8 string
+    notification: tag (u8: 2), receive time [monotonic ns] (i64), device id (u16),
+                  characteristic id (u16), length (u16), raw notification bytes
+
+All integers are little endian. Captures are replayed with library.replay.
+"""
+import os
+import struct
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, List, Tuple
+from .datatypes import Configuration
+
+MAGIC = b'HLCAP\x00\x01\x00'
+TAG_DEVICE = 0
+TAG_CHARACTERISTIC = 1
+TAG_NOTIFICATION = 2
+DEFINITION = struct.Struct('<BHH')
+NOTIFICATION = struct.Struct('<BqHHH')
+
+
+class CaptureWriter:
+    """
+    Records raw notifications of all connections to a single capture file.
+
+    'write' is called from the BLE notification callback and only appends to an in-memory
+    buffer. The buffer is written to disk every 'flush_interval' seconds by 'run'.
+    """
+    flush_interval = 0.5
+
+    def __init__(self, config: Configuration, data_path=None, tag: str = None):
+        self.log = logging.getLogger('log')
+        self.config = config
+        if data_path:
+            self.data_path = data_path
+        else:
+            self.data_path = self.config.output_folder
+        if not os.path.exists(self.data_path):
+            os.makedirs(self.data_path)
+        start_time = datetime.now().strftime("%Y%m%d_%H%M%S")
+        suffix = f'_{tag}' if tag else ''
+        self.file_name = os.path.join(self.data_path, f'capture_{start_time}{suffix}.hlcap')
+        self.device_ids = {}  # type: Dict[str, int]
+        self.char_ids = {}  # type: Dict[str, int]
+        self.pending = bytearray(MAGIC)
+        self.notifications = 0
+        self.file = None
+
+    def write(self, t: int, adr: str, uuid: str, data: bytearray) -> None:
+        dev_id = self.device_ids.get(adr)
+        if dev_id is None:
+            dev_id = self._define(self.device_ids, TAG_DEVICE, adr)
+        char_id = self.char_ids.get(uuid)
+        if char_id is None:
+            char_id = self._define(self.char_ids, TAG_CHARACTERISTIC, uuid)
+        self.pending += NOTIFICATION.pack(TAG_NOTIFICATION, t, dev_id, char_id, len(data))
+        self.pending += data
+        self.notifications += 1
+
+    def _define(self, ids: Dict[str, int], tag: int, value: str) -> int:
+        new_id = len(ids)
+        ids[value] = new_id
+        encoded = value.encode()
+        self.pending += DEFINITION.pack(tag, new_id, len(encoded))
+        self.pending += encoded
+        return new_id
+
+    async def run(self, halt_event: asyncio.Event) -> None:
+        import aiofiles
+        self.log.info(f'Capturing raw notifications to {self.file_name}')
+        self.file = await aiofiles.open(self.file_name, 'wb')
+        while not halt_event.is_set():
+            try:
+                await asyncio.wait_for(halt_event.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    async def flush(self) -> None:
+        if self.file is None or not self.pending:
+            return
+        chunk, self.pending = self.pending, bytearray()
+        await self.file.write(chunk)
+
+    async def close(self) -> None:
+        """Write out the remaining notifications. Call once all connections have finished."""
+        if self.file is None:
+            return
+        await self.flush()
+        await self.file.close()
+        self.file = None
+        self.log.info(f'Captured {self.notifications} notifications to {self.file_name}')
+
+
+def read_capture(path: str) -> Dict[str, List[Tuple[int, str, bytes]]]:
+    """Read a capture file into lists of (receive time [ns], characteristic UUID, data) per device address."""
+    with open(path, 'rb') as f:
+        buf = f.read()
+    if not buf.startswith(MAGIC):
+        raise ValueError(f'{path} is not a capture file')
+
+    devices = {}  # type: Dict[int, str]
+    chars = {}  # type: Dict[int, str]
+    records = {}  # type: Dict[str, List[Tuple[int, str, bytes]]]
+    pos = len(MAGIC)
+    while pos < len(buf):
+        tag = buf[pos]
+        if tag == TAG_NOTIFICATION:
+            if pos + NOTIFICATION.size > len(buf):
+                break
+            _, t, dev_id, char_id, n = NOTIFICATION.unpack_from(buf, pos)
+            pos += NOTIFICATION.size
+            if pos + n > len(buf):
+                break
+            records[devices[dev_id]].append((t, chars[char_id], bytes(buf[pos:pos + n])))
+        elif tag in (TAG_DEVICE, TAG_CHARACTERISTIC):
+            if pos + DEFINITION.size > len(buf):
+                break
+            _, def_id, n = DEFINITION.unpack_from(buf, pos)
+            pos += DEFINITION.size
+            if pos + n > len(buf):
+                break
+            value = buf[pos:pos + n].decode()
+            if tag == TAG_DEVICE:
+                devices[def_id] = value
+                records[value] = []
+            else:
+                chars[def_id] = value
+        else:
+            raise ValueError(f'{path}: unknown record tag {tag} at offset {pos}')
+        pos += n
+    # A truncated last record (e.g. after a crash) is dropped
+    return records
@@ -1,5 +1,5 @@
 from .decoders import decode_data
-from .datatypes import Characteristic, Configuration
+from .datatypes import Characteristic, Configuration, SimulatorSettings
 
 conf = Configuration(
     # ======================= Devices ============================
@@ -29,6 +29,9 @@ conf = Configuration(
         Characteristic(
             name='data',
             uuid='CE60014D-AE91-11E1-4495-9FC5DD4AFF08',
+            # Time in seconds without notifications after which the
+            # connection is considered dead and re-established (None
+            # to disable):
             timeout=None,
             decoder=decode_data,
             column_headers=['sys_time', 'timestamp', 
@@ -48,6 +51,20 @@ conf = Configuration(
             b'\x08\x0c*\x04\x12\x02\x08\n'
         ), # mag config
     ],
+    # ===================== BLE Backend ==========================
+    # 'bleak' to use the Bluetooth adapter, or 'simulator' to connect
+    # to simulated trackers (see simulator.py), e.g. to test the app
+    # with many devices:
+    ble_backend="bleak",
+    # Simulated trackers, if ble_backend is 'simulator'. Their name
+    # has to match one of the name_regexes:
+    simulator=SimulatorSettings(
+        devices=20,
+        name="SmartVNS",
+        sample_rate=100,
+        packet_loss=0.01,
+        mean_time_between_disconnects=300,
+    ),
     # ================ Connection Parameters =====================
     # Maximum number of simultaneously active connections:
     max_active_connections=3,
@@ -56,35 +73,153 @@ conf = Configuration(
     connect_timeout=15,
     # Maximum number of simultaneous connection attempts:
     # Anything higher than one sometimes causes instability.
+    # With adaptive connection attempts, this is the initial value:
     max_simultaneous_connection_attempts=3,
+    # Adaptive connection attempts:
+    # Raise the number of simultaneous connection attempts while
+    # attempts succeed quickly, and lower it on failures or when the
+    # average connect latency exceeds the target (in seconds), up to
+    # the given limit. Experimental, not yet validated on all adapters:
+    adaptive_connection_attempts=False,
+    max_connection_attempts_limit=6,
+    connect_latency_target=5,
     # Initial Characteristic Timeout:
     # An additional amount of time (in seconds) allowed in addition to the
     # characteristic timeout for the first notification.
     initial_characteristic_timeout=10,
     # Manager Interval:
-    # Time in seconds between connection manager attempting to
-    # create new connections
+    # Time in seconds between connection manager checks for devices
+    # that are waiting to be seen by the scanner. All other connection
+    # handling is driven by connection events:
     manager_interval=0.1,
+    # Reconnect backoff:
+    # After a failed or lost connection, the next attempt is delayed by
+    # base * 2^(consecutive failures - 1) seconds, up to max, randomly
+    # varied by +/- jitter (as a fraction of the delay):
+    reconnect_backoff_base=0.5,
+    reconnect_backoff_max=30,
+    reconnect_backoff_jitter=0.2,
+    # Warm start:
+    # Connect to the selected devices directly by address, without
+    # waiting for them to be seen by the scanner. Devices that fail
+    # to connect are retried once they are seen by the scanner:
+    warm_start=False,
+    # Acquisition shards:
+    # Number of worker processes the connections are divided between,
+    # each with its own event loop and decode stage. Decoded data is
+    # passed to the main process through shared memory queues of
+    # 'shard_queue_slots' blocks of up to 'shard_block_rows' rows.
+    # Workers that exit unexpectedly are restarted after
+    # 'shard_restart_delay' seconds. 0 or 1 to run all connections
+    # in the main process:
+    acquisition_shards=0,
+    shard_queue_slots=256,
+    shard_block_rows=64,
+    shard_restart_delay=2,
     # ================== Scanner Parameters ======================
-    # Time, in seconds, a scan should last::
+    # Maximum time, in seconds, a scan should last. A scan finishes
+    # early once all devices listed in device_aliases have been seen:
     scan_duration=5,
-    # Time, in seconds, a Bleak discovery scan should last:
-    # Increasing this may help if devices are not being discovered:
-    scan_timeout=5,
-    # Time, in seconds, to pause between scans:
-    scan_cooldown=0.1,
+    # Background scanning:
+    # Keep scanning after a scan has finished (including during
+    # recording) to keep the 'recently seen' state of devices fresh.
+    # Disable if the BLE adapter becomes unstable while scanning
+    # and connecting at the same time:
+    background_scan=False,
     # Last-seen timeout:
     # StreamLog will only attempt to connect to a device if it has been
     # recently seen by the scanner. This is the time (in seconds) that a
     # device will be marked as 'recently seen' after being seen.
     seen_timeout=5,
+    # Known devices file:
+    # Devices that matched name_regexes, and their connection history,
+    # are stored in this file and recognised immediately in later
+    # sessions, e.g. "output/known_devices.json". None to disable:
+    known_devices_file=None,
+    # ================== Decoding Settings ======================
+    # Number of raw notifications buffered per connection until they
+    # are decoded. Notifications are dropped if the buffer is full:
+    notif_buffer_size=1024,
+    # Time, in seconds, for which notifications are collected to be
+    # decoded in one batch. Adds up to this much latency:
+    decode_interval=0.02,
     # ================== Consumer Settings ======================
     # Output buffer size in number of sameples:
     buffer_size=1500,
     # Enable/disable logging of data to CSV files:
     output_csv=True,
     # CSV output folder name:
-    output_folder="output"
+    output_folder="output",
+    # Raw capture:
+    # Additionally write every raw notification, with its receive time,
+    # to a binary capture file in the output folder. Captures can be
+    # replayed without hardware: python -m library.replay <file>
+    capture_raw=False,
+    # UDP live stream:
+    # Send the scaled samples of all devices as compact binary frames
+    # to udp_address:udp_port, unicast or multicast (e.g. 239.0.0.1).
+    # Frame format and reference receiver: python -m library.udpstream
+    output_udp=False,
+    udp_address="127.0.0.1",
+    udp_port=5005,
+    # Maximum datagram size, including IP and UDP headers, in bytes:
+    udp_mtu=1500,
+    # Number of router hops for multicast datagrams:
+    udp_multicast_ttl=1,
+    # TCP server:
+    # Serve the scaled samples to subscribers on tcp_host:tcp_port, with
+    # per-subscriber device and channel selection. Protocol and reference
+    # client: python -m library.tcpserver
+    output_tcp=False,
+    tcp_host="127.0.0.1",
+    tcp_port=5006,
+    # Seconds of buffered data sent to new subscribers, limited by buffer_size:
+    tcp_backfill=5.0,
+    # Maximum time, in seconds, data may wait for a subscriber before
+    # tcp_slow_subscriber applies: "drop" its queued data, or "disconnect" it:
+    tcp_max_lag=2.0,
+    tcp_slow_subscriber="drop",
+    # Interval, in seconds, of the status messages with the lag of each subscriber:
+    tcp_status_interval=1.0,
+    # Time, in seconds, new subscribers have to send their subscription:
+    tcp_subscribe_timeout=5.0,
+    # Shared memory export:
+    # Publish the most recent scaled rows of every device as a shared
+    # memory segment, for zero-copy reading by local processes, see
+    # library/sharedbuffer.py. Segment names start with shm_prefix:
+    shm_export=False,
+    shm_prefix="hlimu_",
+    # Rows kept per device:
+    shm_buffer_rows=4096,
+    # ======================== Logging ==========================
+    # Additionally write the log as JSON lines to this file (None to disable):
+    log_json_file=None,
+    # Records passed per call site (file and line) every log_rate_interval
+    # seconds, further records of that call site are suppressed and counted:
+    log_rate_limit=10,
+    log_rate_interval=1.0,
+    # ======================== Tracing ==========================
+    # Record sampled spans of the acquisition stages for every recording,
+    # and export them to trace_<time>.json in the output folder (Chrome
+    # trace format, see library/tracing.py). Tracing can also be switched
+    # on and off while running, from the GUI or with SIGUSR1 (daemon):
+    trace_enabled=False,
+    # Spans kept, the oldest are overwritten:
+    trace_buffer_size=65536,
+    # Record every n-th call of each traced stage:
+    trace_sample_every=10,
+    # ===================== Live Plot ===========================
+    # Channels shown per device, by column header of the data characteristic:
+    plot_channels=["acc_x", "acc_y", "acc_z"],
+    # Time, in seconds, shown in the plot:
+    plot_history=5.0,
+    # Maximum redraws per second:
+    plot_max_fps=30,
+    # ================== Feature Settings =======================
+    # Window lengths, in number of IMU samples, over which running
+    # statistics (mean, variance, RMS, min, max) are kept per device.
+    # Leave empty to disable the feature engine:
+    feature_windows=[50, 200],
 )
 
 conf.validate_and_normalise()
\ No newline at end of file
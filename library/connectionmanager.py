@@ -1,18 +1,27 @@
 import time
+import heapq
+import random
 import logging
 import asyncio
-from typing import Dict, Union, Callable
-from PySide6.QtCore import QObject, Signal
+from typing import Dict, List, Set, Tuple, Union, Callable
 from .activeconnection import ActiveConnection
+from .admission import AdmissionController
+from .blebackend import BLEBackend
+from .capture import CaptureWriter
+from .decodestage import DecodeStage
+from .events import wait_any
+from .observer import Signal
+from .timeouts import TimeoutScheduler
 from .datatypes import Configuration, ManagedConnection, SeenDevice, ConnectionState
 
 
-class ConnectionManager(QObject):
-    # Global state signal
-    connect_state = Signal(str, bool, arguments=['device_name', 'state'])
-    
-    def __init__(self, config: Configuration, halt_event: asyncio.Event, devices: Dict[str, SeenDevice], output_queue: asyncio.Queue, callback: Callable):
-        super().__init__()
+class ConnectionManager:
+    # Global state signal, only emitted when the connection state of a device changes,
+    # with (device_name, state)
+    connect_state = Signal()
+
+    def __init__(self, config: Configuration, halt_event: asyncio.Event, devices: Dict[str, SeenDevice], output_queue: asyncio.Queue, callback: Callable,
+                 capture: CaptureWriter = None, backend: BLEBackend = None):
         self.log = logging.getLogger('log')
         self.config = config
         self.halt_event = halt_event
@@ -20,73 +29,184 @@ class ConnectionManager(QObject):
         self.output_queue = output_queue
         self.callback = callback
         self.connections = {}  # type: Dict[str, ManagedConnection]
+        # Connection attempts scheduled for the future, as (time [monotonic ns], address):
+        self.retry_heap = []  # type: List[Tuple[int, str]]
+        # Devices whose scheduled attempt is due, waiting for a free slot or for the scanner:
+        self.pending = set()  # type: Set[str]
+        self.wakeup = asyncio.Event()
+        self.admission = AdmissionController(config)
+        # Characteristic timeouts of all connections:
+        self.timeouts = TimeoutScheduler()
+        # Decoding of the notifications of all connections:
+        self.decode_stage = DecodeStage(config, halt_event, output_queue, callback)
+        # Optional raw notification capture, and the BLE backend used by the connections:
+        self.capture = capture
+        self.backend = backend
 
     async def run(self):
         self.log.info(f'Connection manager started')
         self.setup_connections()
+        timeout_task = asyncio.create_task(self.timeouts.run(self.halt_event), name='Timeout Scheduler Task')
+        decode_task = asyncio.create_task(self.decode_stage.run(), name='Decode Stage Task')
+        tasks = [timeout_task, decode_task]
+        if self.capture is not None:
+            tasks.append(asyncio.create_task(self.capture.run(self.halt_event), name='Capture Task'))
         try:
             while not self.halt_event.is_set():
                 self.manage_connections()
-                await asyncio.sleep(self.config.manager_interval)
+                await self._wait_for_event(self._next_wakeup())
         except Exception as e:
             self.log.error(f'Connection manager encountered an exception: {e}')
             self.halt_event.set()
         finally:
-            await asyncio.gather(*[c.task for c in self.connections.values() if c.task is not None])
+            await asyncio.gather(*tasks, *[c.task for c in self.connections.values() if c.task is not None])
+            # Decode notifications received while shutting down
+            self.decode_stage.flush()
+            if self.capture is not None:
+                await self.capture.close()
+            for con in self.connections.values():
+                if con.task is not None:
+                    self._record_connection_end(con)
             self.log.info('Connection manager shut down')
 
     def setup_connections(self):
         # Pickup new devices/updates
+        now = time.monotonic_ns()
         for device in self.devices.values():
             if device.adr not in self.connections:
                 con = ManagedConnection(
                     device=device,
                     active_connection=None,
                     last_connection_attempt=None,
-                    task=None)
+                    task=None,
+                    direct_connect=self.config.warm_start,
+                    default_latency=self.config.connect_timeout / 2)
                 self.connections[device.adr] = con
+                self._schedule(con, now)
+
+    async def _wait_for_event(self, timeout: Union[float, None]):
+        # Sleep until a connection changes state, a scheduled attempt is due or the halt event is set
+        await wait_any(self.wakeup, self.halt_event, timeout=timeout)
+        self.wakeup.clear()
+
+    def _next_wakeup(self) -> Union[float, None]:
+        # Devices that are due but not yet seen by the scanner are re-checked periodically.
+        # Devices waiting for a free slot are woken up when a connection changes state or ends,
+        # and everything else by the retry schedule
+        timeouts = []
+        if any(not self.connections[adr].ready_to_connect() for adr in self.pending):
+            timeouts.append(self.config.manager_interval)
+        if self.retry_heap:
+            timeouts.append(max(0, (self.retry_heap[0][0] - time.monotonic_ns()) / 1e9))
+        return min(timeouts) if timeouts else None
+
+    def _on_state_change(self, adr: str, state: ConnectionState):
+        self.wakeup.set()
+
+    def _on_task_done(self, task: asyncio.Task):
+        self.wakeup.set()
+
+    def _schedule(self, con: ManagedConnection, t: int):
+        con.next_attempt = t
+        heapq.heappush(self.retry_heap, (t, con.device.adr))
+
+    def _backoff_ns(self, failures: int) -> int:
+        # Exponential backoff with jitter, so that devices do not retry in lockstep
+        delay = min(self.config.reconnect_backoff_max, self.config.reconnect_backoff_base * 2 ** (failures - 1))
+        delay *= random.uniform(1 - self.config.reconnect_backoff_jitter, 1 + self.config.reconnect_backoff_jitter)
+        return int(delay * 1e9)
+
+    def _record_connection_start(self, con: ManagedConnection):
+        # Connection established: feed connect latency into the device history and admission control
+        latency = (con.active_connection.initial_connection_time - con.last_connection_attempt) / 1e9
+        con.device.stats.record_attempt(True, latency)
+        self.admission.on_success(latency)
+
+    def _record_connection_end(self, con: ManagedConnection):
+        ac = con.active_connection
+        if con.reported_connected is not True:
+            if ac.initial_connection_time is None:
+                # Attempt failed before a connection was established (attempts cut short
+                # by the halt event are not counted)
+                if not self.halt_event.is_set():
+                    con.device.stats.record_attempt(False)
+                    self.admission.on_failure()
+            else:
+                # Connected and lost again before the manager noticed
+                self._record_connection_start(con)
+        if ac.first_notif_time is not None and ac.initial_connection_time is not None:
+            con.device.stats.record_first_notification(max(0, ac.first_notif_time - ac.initial_connection_time) / 1e9)
+
+    def _emit_state(self, con: ManagedConnection, connected: bool):
+        if con.reported_connected != connected:
+            con.reported_connected = connected
+            self.connect_state.emit(con.device.get_id(), connected)
 
     def manage_connections(self):
-        # Count active and connecting connections and manage connection status
+        now = time.monotonic_ns()
+
+        # Handle state transitions and count active and connecting connections
         active_connection_count = 0
         connecting_connection_count = 0
         for con in self.connections.values():
             if con.task is None: continue
             device_name = con.device.get_id()
             if con.task.done():
-                match con.state():
-                    case ConnectionState.DISCONNECTED:
-                        self.log.warning(f"Device {device_name} disconnected, attempting reconnect...")
-                        self.connect_state.emit(device_name, False)
-                    case ConnectionState.TIMEOUT:
-                        self.connect_state.emit(device_name, False)
-                        pass
+                con.task = None
+                con.failures += 1
+                self._record_connection_end(con)
+                if con.direct_connect and con.active_connection.initial_connection_time is None:
+                    # Direct connection attempt failed, only retry once the scanner sees the device
+                    self.log.info(f"Could not connect to {device_name} directly, waiting for it to be scanned...")
+                    con.direct_connect = False
+                delay = self._backoff_ns(con.failures)
+                if con.state() == ConnectionState.DISCONNECTED:
+                    self.log.warning(f"Device {device_name} disconnected, attempting reconnect in {delay / 1e9:.1f}s...")
+                self._emit_state(con, False)
+                self._schedule(con, now + delay)
             else:
                 match con.state():
                     case ConnectionState.CONNECTED:
-                        self.connect_state.emit(device_name, True)
+                        if con.reported_connected is not True:
+                            self._record_connection_start(con)
+                        con.failures = 0
+                        self._emit_state(con, True)
                         active_connection_count += 1
                     case ConnectionState.CONNECTING:
                         active_connection_count += 1
                         connecting_connection_count += 1
 
-        # If there is space for more connections, spawn one
-        if active_connection_count < self.config.max_active_connections:
-            if connecting_connection_count < self.config.max_simultaneous_connection_attempts:
-                # First, find all possible connections
-                possible_connections = [c for c in self.connections.values() if c.ready_to_connect()]
-                if len(possible_connections) > 0:
-                    # Prioritise connections that have never been connected, or whose
-                    # last connection attempt lies further back
-                    possible_connections.sort()
-                    next_con = possible_connections[0]
-
-                    # Attempt to connect to the next device
-                    adr = next_con.device.adr
-                    device_name = next_con.device.get_id()
-                    self.log.info(f'Connecting to {device_name}...')
-                    if next_con.active_connection is None:
-                        next_con.active_connection = ActiveConnection(adr, device_name, self.config, self.halt_event, self.output_queue,self.callback)
-                    next_con.last_connection_attempt = time.monotonic_ns()
-                    task = asyncio.create_task(next_con.active_connection.run(), name=device_name)
-                    next_con.task = task
+        # Move all attempts that are due to the pending set
+        while self.retry_heap and self.retry_heap[0][0] <= now:
+            t, adr = heapq.heappop(self.retry_heap)
+            if self.connections[adr].next_attempt == t:
+                self.pending.add(adr)
+
+        # While there is space for more connections, spawn them
+        if self.pending:
+            # Prioritise connections that have never been connected, or whose
+            # last connection attempt lies further back
+            possible_connections = sorted(
+                self.connections[adr] for adr in self.pending if self.connections[adr].ready_to_connect())
+            for next_con in possible_connections:
+                if active_connection_count >= self.config.max_active_connections:
+                    break
+                if connecting_connection_count >= self.admission.allowed_attempts():
+                    break
+                self._connect(next_con, now)
+                active_connection_count += 1
+                connecting_connection_count += 1
+
+    def _connect(self, con: ManagedConnection, now: int):
+        # Attempt to connect to the next device
+        adr = con.device.adr
+        device_name = con.device.get_id()
+        self.log.info(f'Connecting to {device_name}...')
+        self.pending.discard(adr)
+        con.next_attempt = None
+        if con.active_connection is None:
+            con.active_connection = ActiveConnection(adr, device_name, self.config, self.halt_event, self.decode_stage, self.timeouts, self._on_state_change,
+                                                     self.capture, self.backend)
+        con.last_connection_attempt = now
+        con.task = asyncio.create_task(con.active_connection.run(), name=device_name)
+        con.task.add_done_callback(self._on_task_done)
\ No newline at end of file
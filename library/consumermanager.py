@@ -1,8 +1,12 @@
 import time
 import asyncio
+import functools
 import logging
 from typing import List
 from .datatypes import Configuration, Consumer
+from .tracing import tracer
+
+_DISTRIBUTE = tracer.site('distribute', 'consumers')
 
 
 class ConsumerManager:
@@ -43,19 +47,29 @@ class ConsumerManager:
     def _launch_consumers(self) -> None:
         for consumer in self.consumers:
             task = asyncio.create_task(consumer.run(), name=f'Consumer_{consumer.__class__.__name__}_Task')
+            task.add_done_callback(functools.partial(self._on_consumer_done, consumer))
             self.consumer_tasks.append(task)
             self.log.info(f'Consumer {consumer.__class__.__name__} enabled')
 
+    def _on_consumer_done(self, consumer: Consumer, task: asyncio.Task) -> None:
+        # A consumer that stopped before the halt event (e.g. after a setup error) would never
+        # empty its queue again, stop passing data to it
+        if not self.halt_event.is_set() and consumer in self.consumers:
+            self.log.warning(f'Consumer {type(consumer).__name__} stopped, no longer passing data to it')
+            self.consumers.remove(consumer)
+
     async def _distribute_data(self):
         try:
             # Grab data, distribute to all consumers:
             next_data = await asyncio.wait_for(self.input_queue.get(), timeout=0.5)
+            t0 = _DISTRIBUTE.start()
             for consumer in self.consumers:
                 try:
                     consumer.input_queue.put_nowait(next_data)
                 except asyncio.QueueFull:
                     self.log.warning(f'Consumer {type(consumer).__name__} did not accept data!')
             self.input_queue.task_done()
+            _DISTRIBUTE.end(t0, next_data.device_name_repr)
         except asyncio.TimeoutError:
             pass
 
@@ -63,6 +77,6 @@ class ConsumerManager:
         # Check if any consumers are lagging behind:
         warn_thsh = 300
         for consumer in self.consumers:
-            if consumer.input_queue.qsize() > warn_thsh:
+            if consumer.input_queue.qsize() > warn_thsh and consumer.should_queue_warn():
                 self.log.warning(f'The input queue of consumer {type(consumer).__name__} has more than {consumer.input_queue.qsize()} items, consumers are lagging!')
                 consumer.last_full_queue_warning = time.monotonic_ns()
\ No newline at end of file
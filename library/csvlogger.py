@@ -3,10 +3,12 @@ import csv
 import io
 import logging
 import os
-import aiofiles
 from datetime import datetime
 from typing import List
 from .datatypes import Configuration, Consumer, NotifData
+from .tracing import tracer
+
+_WRITE = tracer.site('write_csv', 'disk', asynchronous=True)
 
 
 class CSVLogger(Consumer):
@@ -65,7 +67,7 @@ class CSVLogger(Consumer):
 
         if file_path not in self.file_outputs:
             # File not yet opened, open:
-            file_output = FileWriter(file_path, next_data.characteristic.column_headers, self.halt_event)
+            file_output = FileWriter(file_path, next_data.characteristic.column_headers, self.halt_event, self.callback)
             self.file_outputs[file_path] = file_output
             file_task = asyncio.create_task(self.file_outputs[file_path].run(), name='File Task')
             self.tasks.append(file_task)
@@ -90,15 +92,18 @@ class CSVLogger(Consumer):
 
 
 class FileWriter:
-    def __init__(self, file_path: str, column_headers: List[str], halt_event: asyncio.Event):
+    def __init__(self, file_path: str, column_headers: List[str], halt_event: asyncio.Event, callback=None):
         self.file_path = file_path
         self.column_headers = column_headers
         self.halt_event = halt_event
+        # Called with each NotifData once it has been written and flushed:
+        self.callback = callback
         self.log = logging.getLogger('log')
         self.input_queue = asyncio.Queue()
         self.active = True
 
     async def run(self):
+        import aiofiles
         f = None
 
         try:
@@ -115,9 +120,13 @@ class FileWriter:
                     next_data = await asyncio.wait_for(
                         self.input_queue.get(), timeout=0.5
                     )  # type: NotifData
+                    t0 = _WRITE.start()
                     for row in next_data.data:
                         await self.write_row(f, row)
                     await f.flush()
+                    _WRITE.end(t0, os.path.basename(self.file_path))
+                    if self.callback is not None:
+                        self.callback(next_data)
                     self.input_queue.task_done()
                 except asyncio.TimeoutError:
                     pass
@@ -0,0 +1,205 @@
+"""
+Headless acquisition, without Qt: records a session from the command line until it is stopped
+with Ctrl+C/SIGTERM or after --duration seconds.
+
+    python -m library.daemon                                # the configured devices
+    python -m library.daemon --scan --duration 600          # the devices found in a scan
+    python -m library.daemon --devices Tracker1,Tracker2 --output /data/session1
+    python -m library.daemon --config recorder.json         # overrides of config.py
+    python -m library.daemon --trace                        # trace the acquisition stages
+
+Without --devices, the first max_active_connections devices that the BLE backend can reach are
+recorded. While running, SIGUSR1 starts tracing, and the next SIGUSR1 saves the trace to the
+output folder (kill -USR1 <pid>), see library/tracing.py.
+
+The configuration file is a JSON object with fields of the Configuration in config.py, e.g.
+{"ble_backend": "simulator", "simulator": {"devices": 4}, "output_udp": true}. Nested settings
+only override the fields that are given.
+"""
+import sys
+import json
+import time
+import signal
+import asyncio
+import logging
+import argparse
+import dataclasses
+from typing import Any, Dict, List
+from .blebackend import backend_config, create_backend
+from .datatypes import Configuration, SeenDevice
+from .log import Log
+from .scanner import Scanner
+from .stream import Stream
+from .tracing import tracer
+
+
+def load_config(config: Configuration, path: str) -> Configuration:
+    with open(path, 'r') as f:
+        overrides = json.load(f)
+    return apply_overrides(config, overrides)
+
+
+def apply_overrides(config, overrides: Dict[str, Any]):
+    fields = {f.name for f in dataclasses.fields(config)}
+    unknown = set(overrides) - fields
+    if unknown:
+        raise ValueError(f'Unknown configuration fields: {sorted(unknown)}')
+    changes = {}
+    for name, value in overrides.items():
+        current = getattr(config, name)
+        if dataclasses.is_dataclass(current) and isinstance(value, dict):
+            value = apply_overrides(current, value)
+        changes[name] = value
+    return dataclasses.replace(config, **changes)
+
+
+class Session:
+    """One recording, from device selection to shutdown"""
+    def __init__(self, config: Configuration, data_path: str = None, status_interval: float = 10.0):
+        self.log = logging.getLogger('log')
+        self.config = config = backend_config(config)
+        self.data_path = data_path
+        self.status_interval = status_interval
+        self.halt_event = asyncio.Event()
+        self.stop_event = asyncio.Event()
+        self.backend = create_backend(config)
+        self.scanner = Scanner(config, self.halt_event, self.backend)
+        self.stream = Stream(config, self.halt_event, {}, self.backend)
+
+    def stop(self) -> None:
+        """Ends the session, safe to call from a signal handler"""
+        self.stop_event.set()
+
+    def toggle_tracing(self) -> None:
+        """Starts tracing, or stops it and saves the trace"""
+        if not tracer.enabled:
+            tracer.start()
+            self.log.info('Tracing started')
+        else:
+            tracer.stop()
+            path = tracer.export_to(self.data_path or self.config.output_folder)
+            self.log.info(f'Trace saved to {path}')
+
+    async def select_devices(self, names: List[str] = None, scan: bool = False) -> Dict[str, SeenDevice]:
+        if scan:
+            await self.scanner.scan_for_devices()
+            candidates = self.scanner.scanned_devices
+        else:
+            candidates = self.scanner.registry.known_devices()
+        # Configured devices that the backend cannot reach, e.g. real trackers with the simulator
+        reachable = self.backend.addresses()
+        if reachable is not None:
+            candidates = [d for d in candidates if d.adr in reachable]
+        devices = {d.get_id(): d for d in candidates}
+        limit = self.config.max_active_connections
+        if names:
+            by_adr = {d.adr: d for d in candidates}
+            missing = [n for n in names if n not in devices and self.config.normalise(n) not in by_adr]
+            if missing:
+                raise ValueError(f'Devices not found: {missing}')
+            if len(names) > limit:
+                raise ValueError(f'Too many devices selected for recording, max connections allowed: {limit}')
+            devices = {n: devices[n] if n in devices else by_adr[self.config.normalise(n)] for n in names}
+        elif len(devices) > limit:
+            self.log.warning(f'Found {len(devices)} devices, recording the first {limit} (max_active_connections)')
+            devices = dict(list(devices.items())[:limit])
+        return devices
+
+    async def run(self, devices: Dict[str, SeenDevice], duration: float = None) -> None:
+        if not devices:
+            raise ValueError('No devices to record')
+        self.log.info(f'Recording {len(devices)} devices: {list(devices)}')
+        deadline = time.monotonic() + duration if duration is not None else None
+        try:
+            self.stream.start({name: (device, None) for name, device in devices.items()}, self.data_path)
+            if self.config.warm_start:
+                await self.scanner.start()
+            while not self.stop_event.is_set():
+                timeout = self.status_interval
+                if deadline is not None:
+                    timeout = min(timeout, deadline - time.monotonic())
+                    if timeout <= 0:
+                        break
+                try:
+                    await asyncio.wait_for(self.stop_event.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    self._log_status()
+                # The stream ends by itself if its managers fail
+                if self.stream.connection_manager_task.done():
+                    self.log.error('Connection manager stopped, ending the session')
+                    break
+        finally:
+            self.halt_event.set()
+            await self.stream.stop()
+            # Save a trace started with SIGUSR1
+            if tracer.enabled:
+                self.toggle_tracing()
+            await self.scanner.stop()
+            self.scanner.registry.save()
+            self.log.info('Session ended')
+
+    def _log_status(self) -> None:
+        counts = ', '.join(f'{name}: {count}' for name, count in self.stream.sample_counts.items())
+        self.log.info(f'Samples received: {counts}')
+
+
+async def run_daemon(config: Configuration, names: List[str] = None, scan: bool = False, duration: float = None,
+                     data_path: str = None) -> None:
+    session = Session(config, data_path)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, session.stop)
+        except NotImplementedError:
+            # Windows: Ctrl+C raises KeyboardInterrupt instead
+            pass
+    if hasattr(signal, 'SIGUSR1'):
+        loop.add_signal_handler(signal.SIGUSR1, session.toggle_tracing)
+    devices = await session.select_devices(names, scan)
+    await session.run(devices, duration)
+
+
+def main() -> int:
+    from .config import conf
+
+    parser = argparse.ArgumentParser(description='Record motion tracker data without a GUI.')
+    parser.add_argument('--config', default=None, help='JSON file with overrides of config.py')
+    parser.add_argument('--devices', default=None, help='Comma separated device names or addresses (default: all, up to max_active_connections)')
+    parser.add_argument('--scan', action='store_true', help='Scan first, and record the devices found')
+    parser.add_argument('--duration', type=float, default=None, help='Stop after this many seconds')
+    parser.add_argument('--output', default=None, help='Output folder (default: output_folder of the configuration)')
+    parser.add_argument('--log-file', default=None, help='Also write the log to this file')
+    parser.add_argument('--log-json', default=None, help='Also write the log as JSON lines to this file')
+    parser.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'])
+    parser.add_argument('--trace', action='store_true', help='Trace the acquisition stages, saved when the session ends')
+    args = parser.parse_args()
+
+    try:
+        config = load_config(conf, args.config) if args.config else conf
+        if args.trace:
+            config = dataclasses.replace(config, trace_enabled=True)
+    except (ValueError, OSError) as e:
+        print(f'Invalid configuration: {e}', file=sys.stderr)
+        return 1
+
+    # Everything the session logs is written on the listener thread, off the acquisition loop
+    level = logging.getLevelName(args.log_level)
+    log_setup = Log(args.log_file, level, json_file=args.log_json or config.log_json_file, stderr_level=level,
+                    rate_limit=config.log_rate_limit, rate_interval=config.log_rate_interval)
+    log = log_setup.logger
+    tracer.configure(config.trace_buffer_size, config.trace_sample_every)
+    try:
+        names = args.devices.split(',') if args.devices else None
+        asyncio.run(run_daemon(config, names, args.scan, args.duration, args.output or config.output_folder))
+    except (ValueError, OSError) as e:
+        log.error(str(e))
+        return 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        log_setup.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,9 @@
 from .characteristic import Characteristic
 from .configuration import Configuration
 from .connectionstate import ConnectionState
+from .connectstats import ConnectStats
 from .consumer import Consumer
 from .notifdata import NotifData
 from .managedconnection import ManagedConnection
-from .seendevice import SeenDevice, SeenDeviceState
\ No newline at end of file
+from .seendevice import SeenDevice, SeenDeviceState
+from .simulatorsettings import SimulatorSettings
\ No newline at end of file
@@ -7,5 +7,7 @@ class Characteristic:
     name: str
     uuid: str
     timeout: Union[None, float]
-    decoder: Callable[[bytearray], List[List[Any]]]
+    # Called with the raw data and, as second positional argument, the receive time of the
+    # notification [s since the epoch]. Returns the decoded rows.
+    decoder: Callable[[bytearray, float], List[List[Any]]]
     column_headers: List[str]
\ No newline at end of file
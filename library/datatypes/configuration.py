@@ -1,7 +1,8 @@
 import logging
 from dataclasses import dataclass
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Tuple, Union
 from .characteristic import Characteristic
+from .simulatorsettings import SimulatorSettings
 
 
 @dataclass
@@ -14,23 +15,77 @@ class Configuration:
     # Configuration commands:
     ctrl_characteristics: List[Tuple[str, bytearray]]
 
+    # BLE backend:
+    ble_backend: str
+    simulator: SimulatorSettings
+
     # Connection parameters:
     max_active_connections: int
     max_simultaneous_connection_attempts: int
+    adaptive_connection_attempts: bool
+    max_connection_attempts_limit: int
+    connect_latency_target: float
     connect_timeout: float
+    warm_start: bool
+    acquisition_shards: int
+    shard_queue_slots: int
+    shard_block_rows: int
+    shard_restart_delay: float
 
     # Scanner parameters:
     scan_duration: float
-    scan_timeout: float
-    scan_cooldown: float
+    background_scan: bool
     seen_timeout: float
+    known_devices_file: Union[str, None]
     initial_characteristic_timeout: float
     manager_interval: float
+    reconnect_backoff_base: float
+    reconnect_backoff_max: float
+    reconnect_backoff_jitter: float
+
+    # Decoding parameters:
+    notif_buffer_size: int
+    decode_interval: float
 
     # Output settings:
     buffer_size: int
     output_csv: bool
     output_folder: str
+    output_udp: bool
+    udp_address: str
+    udp_port: int
+    udp_mtu: int
+    udp_multicast_ttl: int
+    output_tcp: bool
+    tcp_host: str
+    tcp_port: int
+    tcp_backfill: float
+    tcp_max_lag: float
+    tcp_slow_subscriber: str
+    tcp_status_interval: float
+    tcp_subscribe_timeout: float
+    shm_export: bool
+    shm_prefix: str
+    shm_buffer_rows: int
+    capture_raw: bool
+
+    # Feature settings:
+    feature_windows: List[int]
+
+    # Log settings:
+    log_json_file: Optional[str]
+    log_rate_limit: int
+    log_rate_interval: float
+
+    # Tracing settings:
+    trace_enabled: bool
+    trace_buffer_size: int
+    trace_sample_every: int
+
+    # Live plot settings:
+    plot_channels: List[str]
+    plot_history: float
+    plot_max_fps: float
 
     def normalise(self, hex:str):
         """Produce consistent hex formatting to make comparisons easier"""
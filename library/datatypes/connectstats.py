@@ -0,0 +1,37 @@
+from typing import Union
+from dataclasses import dataclass
+
+
+@dataclass
+class ConnectStats:
+    """Connection history of a device, used to order connection attempts"""
+    attempts: int = 0
+    successes: int = 0
+    # Exponentially weighted averages, in seconds:
+    connect_latency: Union[float, None] = None
+    first_notification_latency: Union[float, None] = None
+
+    smoothing = 0.3
+
+    def _ewma(self, old: Union[float, None], new: float) -> float:
+        return new if old is None else (1 - self.smoothing) * old + self.smoothing * new
+
+    def record_attempt(self, success: bool, latency: Union[float, None] = None) -> None:
+        self.attempts += 1
+        if success:
+            self.successes += 1
+            if latency is not None:
+                self.connect_latency = self._ewma(self.connect_latency, latency)
+
+    def record_first_notification(self, latency: float) -> None:
+        self.first_notification_latency = self._ewma(self.first_notification_latency, latency)
+
+    def success_rate(self) -> float:
+        # Laplace-smoothed, so that unknown devices start at 0.5
+        return (self.successes + 1) / (self.attempts + 2)
+
+    def expected_time_to_data(self, default_latency: float) -> float:
+        """Expected time in seconds until the device delivers data, including failed attempts"""
+        connect = self.connect_latency if self.connect_latency is not None else default_latency
+        first_notif = self.first_notification_latency if self.first_notification_latency is not None else 0
+        return (connect + first_notif) / self.success_rate()
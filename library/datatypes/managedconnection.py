@@ -1,17 +1,30 @@
 import asyncio
-from typing import Union
+from typing import TYPE_CHECKING, Union
 from dataclasses import dataclass
-from ..activeconnection import ActiveConnection
 from .connectionstate import ConnectionState
 from .seendevice import SeenDevice, SeenDeviceState
 
+if TYPE_CHECKING:
+    from ..activeconnection import ActiveConnection
+
 
 @dataclass
 class ManagedConnection:
     device: SeenDevice
-    active_connection: Union[None, ActiveConnection]
+    active_connection: Union[None, 'ActiveConnection']
     last_connection_attempt: Union[int, None]
     task: Union[None, asyncio.Task]
+    # Connect by address without waiting for the scanner to see the device.
+    # Cleared after a failed attempt, falling back to scanning:
+    direct_connect: bool = False
+    # Consecutive failed connection attempts, used for the reconnect backoff:
+    failures: int = 0
+    # Earliest time (monotonic ns) of the next connection attempt:
+    next_attempt: Union[int, None] = None
+    # Last connection state emitted to listeners:
+    reported_connected: Union[bool, None] = None
+    # Expected time to data [s] of devices without connection history, see priority():
+    default_latency: float = 5.0
 
     def state(self) -> ConnectionState:
         if self.active_connection is None:
@@ -20,18 +33,24 @@ class ManagedConnection:
             return self.active_connection.state
 
     def ready_to_connect(self) -> bool:
+        if self.task is not None and not self.task.done():
+            return False
         if self.state() == ConnectionState.DISCONNECTED or self.state() == ConnectionState.TIMEOUT:
-            if self.device.state == SeenDeviceState.RECENTLY_SEEN:
+            if self.device.state == SeenDeviceState.RECENTLY_SEEN or self.direct_connect:
                 return True
         return False
 
+    def priority(self):
+        # Devices not yet attempted in this session come first, then devices that are
+        # expected to deliver data soonest given their connection history, then devices
+        # whose last connection attempt lies further back.
+        return (
+            self.last_connection_attempt is not None,
+            self.device.stats.expected_time_to_data(self.default_latency),
+            self.last_connection_attempt or 0,
+        )
+
     # 'Less than' comparison for managed connections.
-    # Used to find connection that has not attempted to connect for
-    # the longest time.
+    # Used to find the connection that should be attempted next.
     def __lt__(self, other):
-        if self.last_connection_attempt is None:
-            return True
-        elif other.last_connection_attempt is None:
-            return False
-        else:
-            return self.last_connection_attempt < other.last_connection_attempt
\ No newline at end of file
+        return self.priority() < other.priority()
\ No newline at end of file
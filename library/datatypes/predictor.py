@@ -1,5 +1,5 @@
 import numpy as np
-from typing import Tuple
+from typing import Dict, Tuple
 from abc import ABC, abstractmethod
 
 class Predictor(ABC):
@@ -22,7 +22,15 @@ class Predictor(ABC):
         Returns:
             prediction:         Boolean value if prediction confidence exceeds threshold (bool)
             confidence:         Normalized prediction confidence level in the range [0–1] (float)
+
+    classify_signals(signals: Dict[str, np.ndarray]) -> Tuple[bool, float]
+        Classify the derived signals listed in `required_signals`, as computed (and shared 
+        between predictors) by a `FeatureGraph`. By default this forwards the timestamp, 
+        acceleration, gyroscope and quaternion signals to `classify`. Predictors that need other 
+        signals (e.g. 'euler', 'acc_smooth' or 'gyro_global') override both.
     """
+    required_signals = ('timestamps', 'acc', 'gyro', 'quat')
+
     @abstractmethod
     def classify(
         self, 
@@ -30,4 +38,7 @@ class Predictor(ABC):
         acc: np.ndarray, 
         gyro: np.ndarray, 
         quat: np.ndarray
-    ) -> Tuple[bool, float]: ... # prediction, confidence
\ No newline at end of file
+    ) -> Tuple[bool, float]: ... # prediction, confidence
+
+    def classify_signals(self, signals: Dict[str, np.ndarray]) -> Tuple[bool, float]:
+        return self.classify(signals['timestamps'], signals['acc'], signals['gyro'], signals['quat'])
\ No newline at end of file
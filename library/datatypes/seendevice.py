@@ -1,6 +1,8 @@
 import enum
-from typing import Union
-from dataclasses import dataclass
+from collections import deque
+from typing import Deque, Tuple, Union
+from dataclasses import dataclass, field
+from .connectstats import ConnectStats
 
 
 @enum.unique
@@ -20,6 +22,10 @@ class SeenDevice:
     name: Union[str, None]
     last_seen: Union[int, None]
     rssi: Union[int, None]
+    # Recent (time [ns], RSSI) samples:
+    rssi_history: Deque[Tuple[int, int]] = field(default_factory=lambda: deque(maxlen=100), repr=False, compare=False)
+    # Connection history, persisted across sessions:
+    stats: ConnectStats = field(default_factory=ConnectStats, repr=False, compare=False)
 
     def get_id(self) -> str:
         if self.alias is not None:
@@ -0,0 +1,28 @@
+from dataclasses import dataclass
+from typing import Union
+
+
+@dataclass
+class SimulatorSettings:
+    # Number of simulated trackers and their advertised name:
+    devices: int = 10
+    name: str = 'SmartVNS'
+    # IMU sample rate in Hz. Quaternion and magnetometer samples are sent
+    # with every n-th IMU sample:
+    sample_rate: float = 100
+    quat_divider: int = 1
+    mag_divider: int = 4
+    # Number of IMU samples packed into one notification:
+    samples_per_notification: int = 1
+    # Fraction of notifications that are lost:
+    packet_loss: float = 0.0
+    # Notification latency and its random variation, in seconds:
+    latency: float = 0.01
+    latency_jitter: float = 0.005
+    # Time in seconds a connection attempt takes, and the fraction of attempts that fail:
+    connect_latency: float = 0.5
+    connect_failure_rate: float = 0.0
+    # Mean time in seconds between random disconnects of a device (None to disable):
+    mean_time_between_disconnects: Union[float, None] = None
+    # Interval in seconds between advertisements of unconnected devices:
+    advertising_interval: float = 0.1
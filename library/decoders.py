@@ -5,6 +5,9 @@ from characteristic notifications into actual data.
 Should return a list of data rows.
 Data rows in turn a list of data, usually numbers.
 
+Decoders are called with the raw bytearray and the wall-clock time
+(as from time.time()) at which the notification was received.
+
 Each data row should be of the same length as the column_headers
 set for the characteristic in config.py where this decoder is used.
 
@@ -22,12 +25,32 @@ the readings are [10, 20, 30], will return the following list:
      [1, 30]]
 """
 from typing import Any, List
+import math
 import time
 import struct
+import numpy as np
+
+# Conversion of the raw 'data' characteristic columns to SI units:
+ACC_FS = 4
+GYRO_FS = 1000
+GYRO_SCALING = 2**-15 * 1.13 * math.pi / 180 * GYRO_FS
+ACC_SCALING = 2**-15 * 9.81 * ACC_FS
+SCALING_FACTORS = np.array([
+    1,                  # System timestamp [s]
+    1e-3,               # IMU timestamp [s]
+    GYRO_SCALING,       # gyro_x [rad/s]
+    GYRO_SCALING,       # gyro_y [rad/s]
+    GYRO_SCALING,       # gyro_z [rad/s]
+    ACC_SCALING,        # acc_x [m/s^2]
+    ACC_SCALING,        # acc_y [m/s^2]
+    ACC_SCALING,        # acc_z [m/s^2]
+    1, 1, 1, 1,         # q_x, q_y, q_z, q_w
+    1, 1, 1             # mag_x, mag_y, mag_z
+])
 
-def decode_data(data:bytearray) -> List[List[Any]]:
+def decode_data(data:bytearray, receive_time:float=None) -> List[List[Any]]:
     # Decode
-    local_time = time.time()
+    local_time = receive_time if receive_time is not None else time.time()
     parser_imu = struct.Struct('<I6h')
     parser_mag = struct.Struct('<I3h')
     parser_quat = struct.Struct('<I4e')
@@ -0,0 +1,139 @@
+import time
+import asyncio
+import logging
+from typing import Callable, List, Tuple, Union
+from .datatypes import Characteristic, Configuration, NotifData
+from .events import wait_any
+from .tracing import tracer
+
+_DECODE = tracer.site('decode_data', 'decode')
+
+# Interval [s] at which the conversion from monotonic receive times to wall-clock time is
+# resynchronised, so that timestamps follow adjustments of the system clock
+WALL_CLOCK_SYNC_INTERVAL = 10.0
+
+
+class NotifBuffer:
+    """
+    Preallocated ring buffer of raw notifications of a single connection.
+
+    Written from the BLE notification callback, which only stores the receive time,
+    characteristic and raw bytes of each notification. Drained by the DecodeStage.
+    """
+    __slots__ = ('capacity', 'times', 'chars', 'data', 'head', 'tail', 'dropped')
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.times = [0] * capacity
+        self.chars = [None] * capacity  # type: List[Union[Characteristic, None]]
+        self.data = [None] * capacity  # type: List[Union[bytearray, None]]
+        self.head = 0       # Total number of notifications written
+        self.tail = 0       # Total number of notifications read
+        self.dropped = 0
+
+    def put(self, t: int, char: Characteristic, data: bytearray) -> bool:
+        """Store a notification. Returns True if the buffer was empty before."""
+        n = self.head - self.tail
+        if n >= self.capacity:
+            self.dropped += 1
+            return False
+        i = self.head % self.capacity
+        self.times[i] = t
+        self.chars[i] = char
+        self.data[i] = data
+        self.head += 1
+        return n == 0
+
+    def drain(self) -> List[Tuple[int, Characteristic, bytearray]]:
+        out = []
+        while self.tail < self.head:
+            i = self.tail % self.capacity
+            out.append((self.times[i], self.chars[i], self.data[i]))
+            self.chars[i] = None
+            self.data[i] = None
+            self.tail += 1
+        return out
+
+
+class DecodeStage:
+    """
+    Decodes buffered raw notifications of all connections in batches, off the BLE callback path.
+
+    Connections schedule themselves when their buffer goes from empty to non-empty. Every
+    'decode_interval' seconds at most, all scheduled buffers are drained; the notifications of
+    each connection and characteristic are decoded into a single block of rows, which is passed
+    to the data callback (Stream) and the consumer queue in one go.
+    """
+    def __init__(self, config: Configuration, halt_event: asyncio.Event, output_queue: asyncio.Queue, callback: Callable):
+        self.log = logging.getLogger('log')
+        self.config = config
+        self.halt_event = halt_event
+        self.output_queue = output_queue
+        self.data_received_callback = callback
+        self.ready = []
+        self.event = asyncio.Event()
+        # Offset to convert monotonic receive times to wall-clock time
+        self.wall_offset = 0.0
+        self.wall_synced = None
+        self._sync_wall_clock()
+
+    def _sync_wall_clock(self) -> None:
+        now = time.monotonic_ns()
+        self.wall_offset = time.time() - now / 1e9
+        self.wall_synced = now
+
+    def schedule(self, connection) -> None:
+        self.ready.append(connection)
+        self.event.set()
+
+    async def run(self) -> None:
+        try:
+            while not self.halt_event.is_set():
+                await wait_any(self.event, self.halt_event)
+                # Let notifications accumulate to decode them in larger batches
+                if self.config.decode_interval:
+                    await asyncio.sleep(self.config.decode_interval)
+                self.event.clear()
+                self.flush()
+        except Exception as e:
+            self.log.error(f'Decode stage encountered an exception: {e}')
+            self.halt_event.set()
+
+    def flush(self) -> None:
+        """Decode everything that is currently buffered."""
+        ready, self.ready = self.ready, []
+        if time.monotonic_ns() - self.wall_synced > WALL_CLOCK_SYNC_INTERVAL * 1e9:
+            self._sync_wall_clock()
+        for connection in ready:
+            self._decode(connection)
+
+    def _decode(self, connection) -> None:
+        buf = connection.notif_buffer
+        if buf.dropped:
+            self.log.warning(f'{connection.name}: Notification buffer full, dropped {buf.dropped} notifications')
+            buf.dropped = 0
+
+        rows = {}
+        for t, char, data in buf.drain():
+            t0 = _DECODE.start()
+            try:
+                rows.setdefault(char.uuid, (char, []))[1].extend(
+                    char.decoder(data, self.wall_offset + t / 1e9))
+                _DECODE.end(t0, connection.name)
+            except Exception as e:
+                self.log.error(f"Decoder for {char.name} raised an exception: {e}")
+
+        for char, data in rows.values():
+            if not data:
+                continue
+            result = NotifData(connection.adr, connection.name, char, data)
+
+            # Notify Stream class if callback function is set
+            if self.data_received_callback:
+                self.data_received_callback(connection.adr, connection.name, result.data)
+
+            # Put data into file output queue
+            try:
+                self.output_queue.put_nowait(result)
+            except asyncio.QueueFull:
+                self.log.error(f"{connection.name} failed to put data into queue")
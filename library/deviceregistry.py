@@ -0,0 +1,148 @@
+import os
+import re
+import json
+import heapq
+import logging
+from collections import OrderedDict
+from dataclasses import asdict
+from typing import Dict, List, Tuple, Union
+from .datatypes import Configuration, ConnectStats, SeenDevice, SeenDeviceState
+
+
+class DeviceRegistry:
+    """
+    Index of all devices that matched the configured name regexes.
+
+    - Advertisers that did not match are kept in a bounded negative cache, so their names are only
+      checked again if they change.
+    - 'Recently seen' expiry is ordered by last_seen in a heap holding at most one entry per device,
+      so a sweep only touches devices that actually expire.
+    - If 'known_devices_file' is set, matched devices are persisted to it and recognised right away
+      in the next session, without waiting for their name to be advertised. Addresses listed in
+      device_aliases are known from the start.
+    """
+    max_rejected = 4096
+
+    def __init__(self, config: Configuration):
+        self.config = config
+        self.log = logging.getLogger('log')
+        self.name_regexes = [re.compile(r) for r in config.name_regexes]
+        self.devices = {}  # type: Dict[str, SeenDevice]
+        self.rejected = OrderedDict()  # type: OrderedDict[str, Union[str, None]]
+        self.expiry_heap = []  # type: List[Tuple[int, str]]
+        self.persisted = set()
+        for adr in config.device_aliases:
+            self.devices[adr] = self._new_device(adr, None, None)
+        self.load()
+
+    def _new_device(self, adr: str, name: Union[str, None], rssi: Union[int, None]) -> SeenDevice:
+        return SeenDevice(
+            adr=adr,
+            alias=self.config.device_aliases.get(adr, None),
+            state=SeenDeviceState.NOT_SEEN,
+            name=name,
+            last_seen=None,
+            rssi=rssi,
+        )
+
+    def known_devices(self) -> List[SeenDevice]:
+        """All configured and previously persisted devices, sorted by their ID"""
+        return sorted(self.devices.values(), key=lambda d: d.get_id())
+
+    def observe(self, adr: str, name: Union[str, None], rssi: Union[int, None], t: int) -> Tuple[Union[SeenDevice, None], bool]:
+        """
+        Record an advertisement. Returns the matching device (or None if the advertiser is not a
+        tracker) and whether this is the first time the device was seen in this session.
+        """
+        dev = self.devices.get(adr)
+        if dev is not None:
+            # Known device, update information:
+            first_seen = dev.last_seen is None
+            if name is not None:
+                dev.name = name
+            self._mark_seen(dev, rssi, t)
+            return dev, first_seen
+
+        # Unknown device, check if name matches (unless it was already rejected under this name):
+        if name is None or self.rejected.get(adr, False) == name:
+            return None, False
+        if not any(regex.match(name) for regex in self.name_regexes):
+            self.rejected[adr] = name
+            self.rejected.move_to_end(adr)
+            if len(self.rejected) > self.max_rejected:
+                self.rejected.popitem(last=False)
+            return None, False
+
+        # It does, add the new device:
+        self.rejected.pop(adr, None)
+        dev = self._new_device(adr, name, None)
+        self.devices[adr] = dev
+        self._mark_seen(dev, rssi, t)
+        return dev, True
+
+    def _mark_seen(self, dev: SeenDevice, rssi: Union[int, None], t: int) -> None:
+        if dev.state != SeenDeviceState.RECENTLY_SEEN or dev.last_seen is None:
+            heapq.heappush(self.expiry_heap, (t, dev.adr))
+        dev.state = SeenDeviceState.RECENTLY_SEEN
+        dev.last_seen = t
+        dev.rssi = rssi
+        if rssi is not None:
+            dev.rssi_history.append((t, rssi))
+
+    def expire(self, t: int) -> None:
+        """Mark every device not seen within 'seen_timeout' before t as not seen."""
+        timeout_ns = self.config.seen_timeout * 1e9
+        while self.expiry_heap and t - self.expiry_heap[0][0] > timeout_ns:
+            _, adr = heapq.heappop(self.expiry_heap)
+            dev = self.devices[adr]
+            if dev.state != SeenDeviceState.RECENTLY_SEEN:
+                continue
+            if t - dev.last_seen > timeout_ns:
+                dev.state = SeenDeviceState.NOT_SEEN
+            else:
+                # Seen again since this entry was pushed, reschedule:
+                heapq.heappush(self.expiry_heap, (dev.last_seen, adr))
+
+    def load(self) -> None:
+        path = self.config.known_devices_file
+        if path is None or not os.path.exists(path):
+            return
+        try:
+            with open(path, 'r') as f:
+                known = json.load(f)
+        except (OSError, ValueError) as e:
+            self.log.warning(f'Could not load known devices from {path}: {e}')
+            return
+        if not isinstance(known, list):
+            self.log.warning(f'Could not load known devices from {path}: expected a list of devices')
+            return
+        loaded = 0
+        for entry in known:
+            try:
+                adr = self.config.normalise(entry['adr'])
+                stats = ConnectStats(**entry['stats']) if 'stats' in entry else None
+                device = self._new_device(adr, entry.get('name'), entry.get('rssi'))
+            except (KeyError, TypeError, AttributeError) as e:
+                self.log.warning(f'Skipping invalid known device entry in {path}: {entry!r} ({e})')
+                continue
+            if stats is not None:
+                device.stats = stats
+            self.devices[adr] = device
+            self.persisted.add(adr)
+            loaded += 1
+        self.log.debug(f'Loaded {loaded} known devices from {path}')
+
+    def save(self) -> None:
+        path = self.config.known_devices_file
+        if path is None:
+            return
+        # Only persist devices that were actually seen at some point
+        known = [
+            {'adr': d.adr, 'name': d.name, 'rssi': d.rssi, 'stats': asdict(d.stats)} for d in self.devices.values()
+            if d.last_seen is not None or d.adr in self.persisted or d.stats.attempts > 0
+        ]
+        try:
+            with open(path, 'w') as f:
+                json.dump(known, f, indent=2)
+        except OSError as e:
+            self.log.warning(f'Could not save known devices to {path}: {e}')
@@ -0,0 +1,220 @@
+"""
+Offline evaluation of Predictor implementations on recorded datasets.
+
+Recordings are raw CSV files as written by the CSVLogger. Each is decoded and converted to SI
+units once and stored as a .npy file in a cache directory, so re-running an evaluation after
+changing a predictor only has to replay the cached arrays. Recordings and parameter sets are
+evaluated in parallel in a process pool, and the results are aggregated into a report of
+confusion matrices, detection latencies and per-window classification times.
+
+An example:
+
+    recordings = [Recording('p01_natural', 'data/p01_natural.csv', 'data/p01_natural_labels.csv')]
+    evaluator = Evaluator(window_size=200, step=20)
+    report = evaluator.evaluate(MyPredictor, [{'threshold': 0.3}, {'threshold': 0.5}], recordings)
+    print(report.summary())
+"""
+import os
+import time
+import hashlib
+import logging
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, asdict
+from itertools import product
+from typing import Any, Dict, List, Optional, Type
+from .decoders import SCALING_FACTORS
+from .datatypes.predictor import Predictor
+from .featuregraph import FeatureGraph
+from .features import TIMESTAMP_COL, imu_mask
+
+
+@dataclass
+class Recording:
+    name: str
+    data_path: str
+    # Optional CSV with a header row and columns (timestamp [s], label), where the timestamp
+    # refers to the IMU timestamp column. Labels hold until the next row.
+    labels_path: Optional[str] = None
+
+
+@dataclass
+class EvaluationResult:
+    recording: str
+    params: Dict[str, Any]
+    true_positives: int = 0
+    false_positives: int = 0
+    true_negatives: int = 0
+    false_negatives: int = 0
+    # Time (s) from the onset of each labelled positive segment to the first positive prediction
+    detection_latencies: List[float] = field(default_factory=list)
+    missed_detections: int = 0
+    # Duration (s) of every classify call
+    classify_times: List[float] = field(default_factory=list)
+
+    def confusion_matrix(self) -> np.ndarray:
+        """[[TN, FP], [FN, TP]]"""
+        return np.array([[self.true_negatives, self.false_positives],
+                         [self.false_negatives, self.true_positives]])
+
+
+class DecodedCache:
+    """
+    Cache of recordings converted to scaled NumPy arrays, keyed by path, size and modification time.
+    """
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def cache_path(self, data_path: str) -> str:
+        stat = os.stat(data_path)
+        key = f'{os.path.abspath(data_path)}:{stat.st_size}:{stat.st_mtime_ns}'
+        digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+        name = os.path.splitext(os.path.basename(data_path))[0]
+        return os.path.join(self.cache_dir, f'{name}_{digest}.npy')
+
+    def prepare(self, data_path: str) -> str:
+        """Decode a recording into the cache if not already present, and return its cache path."""
+        path = self.cache_path(data_path)
+        if not os.path.exists(path):
+            data = np.loadtxt(data_path, delimiter=',', skiprows=1, ndmin=2) * SCALING_FACTORS
+            tmp_path = f'{path}.{os.getpid()}.tmp.npy'
+            np.save(tmp_path, data)
+            os.replace(tmp_path, path)
+        return path
+
+    def load(self, data_path: str) -> np.ndarray:
+        return np.load(self.prepare(data_path), mmap_mode='r')
+
+
+class Evaluator:
+    def __init__(self, window_size: int, step: int, cache_dir: str = '.eval_cache', max_workers: Optional[int] = None):
+        self.window_size = window_size
+        self.step = step
+        self.cache = DecodedCache(cache_dir)
+        self.max_workers = max_workers
+        self.log = logging.getLogger('log')
+
+    def evaluate(self, predictor_cls: Type[Predictor], param_sets: List[Dict[str, Any]],
+                 recordings: List[Recording]) -> 'EvaluationReport':
+        """
+        Evaluate predictor_cls(**params) for every parameter set on every recording.
+        The predictor class and parameters must be picklable.
+        """
+        # Decode everything up front so that the workers only ever read from the cache
+        cached = {r.name: self.cache.prepare(r.data_path) for r in recordings}
+        jobs = [
+            (predictor_cls, params, r.name, cached[r.name], r.labels_path, self.window_size, self.step)
+            for r, params in product(recordings, param_sets)
+        ]
+        self.log.info(f'Evaluating {predictor_cls.__name__} on {len(recordings)} recordings '
+                      f'with {len(param_sets)} parameter sets')
+        t = time.perf_counter()
+        if self.max_workers == 1:
+            results = [_evaluate_recording(*job) for job in jobs]
+        else:
+            with ProcessPoolExecutor(max_workers=self.max_workers) as pool:
+                results = list(pool.map(_evaluate_recording, *zip(*jobs)))
+        self.log.info(f'Evaluation finished in {time.perf_counter() - t:.1f}s')
+        return EvaluationReport(results)
+
+
+def _load_labels(labels_path: Optional[str], timestamps: np.ndarray) -> Optional[np.ndarray]:
+    if labels_path is None:
+        return None
+    labels = np.loadtxt(labels_path, delimiter=',', skiprows=1, ndmin=2)
+    idx = np.searchsorted(labels[:, 0], timestamps, side='right') - 1
+    return np.where(idx >= 0, labels[np.clip(idx, 0, None), 1] != 0, False)
+
+
+def _evaluate_recording(predictor_cls, params, recording, cache_path, labels_path, window_size, step) -> EvaluationResult:
+    predictor = predictor_cls(**params)
+    result = EvaluationResult(recording=recording, params=params)
+    graph = FeatureGraph(max_cached_batches=1)
+
+    # Windows are counted in IMU samples, but span the interleaved quaternion/magnetometer
+    # rows as well so that the FeatureGraph can derive orientation signals
+    data = np.load(cache_path, mmap_mode='r')
+    row_index = np.flatnonzero(imu_mask(data))
+    timestamps = np.asarray(data[row_index, TIMESTAMP_COL])
+    labels = _load_labels(labels_path, timestamps)
+    onset = None
+    detected = False
+
+    for end in range(window_size, len(row_index) + 1, step):
+        first, last = row_index[end - window_size], row_index[end - 1]
+        batch = np.asarray(data[first:last + 1])
+        t = time.perf_counter()
+        prediction, _ = graph.classify(recording, int(first), batch, [predictor])[0]
+        result.classify_times.append(time.perf_counter() - t)
+
+        if labels is None:
+            continue
+        truth = labels[end - 1]
+        if truth and prediction:
+            result.true_positives += 1
+        elif truth:
+            result.false_negatives += 1
+        elif prediction:
+            result.false_positives += 1
+        else:
+            result.true_negatives += 1
+
+        # Detection latency per labelled positive segment
+        if truth and onset is None:
+            onset_idx = end - 1
+            while onset_idx > 0 and labels[onset_idx - 1]:
+                onset_idx -= 1
+            onset = timestamps[onset_idx]
+            detected = False
+        if truth and prediction and not detected:
+            result.detection_latencies.append(float(timestamps[end - 1] - onset))
+            detected = True
+        if not truth and onset is not None:
+            if not detected:
+                result.missed_detections += 1
+            onset = None
+    if onset is not None and not detected:
+        result.missed_detections += 1
+    return result
+
+
+class EvaluationReport:
+    def __init__(self, results: List[EvaluationResult]):
+        self.results = results
+
+    def by_params(self) -> Dict[str, List[EvaluationResult]]:
+        groups = {}
+        for r in self.results:
+            groups.setdefault(repr(sorted(r.params.items())), []).append(r)
+        return groups
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """One aggregated row per parameter set, over all recordings."""
+        rows = []
+        for results in self.by_params().values():
+            tp = sum(r.true_positives for r in results)
+            fp = sum(r.false_positives for r in results)
+            tn = sum(r.true_negatives for r in results)
+            fn = sum(r.false_negatives for r in results)
+            latencies = np.array([l for r in results for l in r.detection_latencies])
+            times = np.array([t for r in results for t in r.classify_times])
+            rows.append({
+                'params': results[0].params,
+                'recordings': len(results),
+                'confusion_matrix': [[tn, fp], [fn, tp]],
+                'accuracy': (tp + tn) / max(tp + tn + fp + fn, 1),
+                'precision': tp / max(tp + fp, 1),
+                'recall': tp / max(tp + fn, 1),
+                'f1': 2 * tp / max(2 * tp + fp + fn, 1),
+                'detection_latency_mean_s': float(latencies.mean()) if len(latencies) else None,
+                'missed_detections': sum(r.missed_detections for r in results),
+                'windows': len(times),
+                'classify_time_p50_ms': float(np.percentile(times, 50) * 1e3) if len(times) else None,
+                'classify_time_p99_ms': float(np.percentile(times, 99) * 1e3) if len(times) else None,
+            })
+        return rows
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'summary': self.summary(), 'results': [asdict(r) for r in self.results]}
@@ -0,0 +1,17 @@
+import asyncio
+from typing import Union
+
+
+async def wait_any(*events: asyncio.Event, timeout: Union[float, None] = None) -> bool:
+    """
+    Wait until one of the events is set or the timeout [s] passes.
+
+    Returns True if an event is set. The events are not cleared.
+    """
+    waiters = [asyncio.create_task(e.wait()) for e in events]
+    try:
+        done, _ = await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for w in waiters:
+            w.cancel()
+    return bool(done)
@@ -0,0 +1,163 @@
+import time
+import numpy as np
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+from .features import ACC_COLS, GYRO_COLS, QUAT_COLS, imu_rows, quat_rows
+from .quaternion import Quaternion, QuaternionArray
+
+
+@dataclass
+class FeatureNode:
+    name: str
+    inputs: Tuple[str, ...]
+    func: Callable[..., np.ndarray]
+
+
+@dataclass
+class NodeTiming:
+    calls: int = 0
+    cache_hits: int = 0
+    total_ns: int = 0
+
+    def mean_ms(self) -> float:
+        return self.total_ns / self.calls / 1e6 if self.calls else 0.0
+
+
+class FeatureGraph:
+    """
+    Declarative graph of derived signals shared between predictors.
+
+    Every node computes one signal from the outputs of its input nodes. The source node 'data' is
+    the block of scaled sample rows of one device. Results are memoised per device and sample range,
+    so predictors that request the same signal for the same batch share a single computation.
+    Only nodes reachable from the requested signals are evaluated, and the time spent in each
+    node is accumulated in 'timings'.
+    """
+    SOURCE = 'data'
+
+    def __init__(self, smoothing_window: int = 5, max_cached_batches: int = 64):
+        self.smoothing_window = smoothing_window
+        self.max_cached_batches = max_cached_batches
+        self.nodes = {}     # type: Dict[str, FeatureNode]
+        self.timings = {}   # type: Dict[str, NodeTiming]
+        self.cache = OrderedDict()  # type: OrderedDict[Tuple[str, int, int], Dict[str, np.ndarray]]
+        self._register_default_nodes()
+
+    def add_node(self, name: str, func: Callable[..., np.ndarray], inputs: Sequence[str] = ()) -> None:
+        """Register a derived signal computed as func(*[outputs of inputs])."""
+        if name == self.SOURCE or name in self.nodes:
+            raise ValueError(f'Feature node "{name}" is already defined')
+        for i in inputs:
+            if i != self.SOURCE and i not in self.nodes:
+                raise KeyError(f'Unknown input "{i}" for feature node "{name}"')
+        self.nodes[name] = FeatureNode(name, tuple(inputs), func)
+        self.timings[name] = NodeTiming()
+
+    def node(self, name: str, inputs: Sequence[str] = ()):
+        """Decorator form of 'add_node'."""
+        def decorator(func):
+            self.add_node(name, func, inputs)
+            return func
+        return decorator
+
+    def plan(self, names: Iterable[str]) -> List[str]:
+        """Topologically ordered list of the nodes required to compute 'names'."""
+        order = []
+        visited = set()
+
+        def visit(name):
+            if name in visited or name == self.SOURCE:
+                return
+            if name not in self.nodes:
+                raise KeyError(f'Unknown feature node "{name}"')
+            visited.add(name)
+            for i in self.nodes[name].inputs:
+                visit(i)
+            order.append(name)
+
+        for name in names:
+            visit(name)
+        return order
+
+    def compute(self, device: str, start: int, data: np.ndarray, names: Iterable[str]) -> Dict[str, np.ndarray]:
+        """
+        Compute the requested signals for the rows data[0:N], which are samples start..start+N of 'device'.
+        """
+        names = list(names)
+        key = (device, start, start + len(data))
+        if key in self.cache:
+            values = self.cache[key]
+            self.cache.move_to_end(key)
+        else:
+            values = {self.SOURCE: data}
+            self.cache[key] = values
+            while len(self.cache) > self.max_cached_batches:
+                self.cache.popitem(last=False)
+
+        for name in self.plan(names):
+            timing = self.timings[name]
+            if name in values:
+                timing.cache_hits += 1
+                continue
+            node = self.nodes[name]
+            t = time.perf_counter_ns()
+            values[name] = node.func(*[values[i] for i in node.inputs])
+            timing.total_ns += time.perf_counter_ns() - t
+            timing.calls += 1
+        return {name: values[name] for name in names}
+
+    def classify(self, device: str, start: int, data: np.ndarray, predictors) -> List[Tuple[bool, float]]:
+        """Run several predictors on one batch, sharing every signal they have in common."""
+        names = set()
+        for p in predictors:
+            names.update(p.required_signals)
+        signals = self.compute(device, start, data, names)
+        return [p.classify_signals(signals) for p in predictors]
+
+    def clear_cache(self) -> None:
+        self.cache.clear()
+
+    def timing_report(self) -> Dict[str, Dict[str, float]]:
+        return {
+            name: {'calls': t.calls, 'cache_hits': t.cache_hits, 'total_ms': t.total_ns / 1e6, 'mean_ms': t.mean_ms()}
+            for name, t in self.timings.items()
+        }
+
+    def _register_default_nodes(self) -> None:
+        self.add_node('imu', imu_rows, [self.SOURCE])
+        self.add_node('timestamps', lambda imu: imu[:, 0:2], ['imu'])
+        self.add_node('acc', lambda imu: imu[:, ACC_COLS], ['imu'])
+        self.add_node('gyro', lambda imu: imu[:, GYRO_COLS], ['imu'])
+        self.add_node('quat', _hold_quaternions, [self.SOURCE, 'timestamps'])
+        self.add_node('euler', Quaternion.quat_to_euler, ['quat'])
+        self.add_node('acc_smooth', lambda acc: _moving_average(acc, self.smoothing_window), ['acc'])
+        self.add_node('acc_global', lambda acc, quat: QuaternionArray(quat).rotate(acc), ['acc', 'quat'])
+        self.add_node('gyro_global', lambda gyro, quat: QuaternionArray(quat).rotate(gyro), ['gyro', 'quat'])
+
+
+def _hold_quaternions(data: np.ndarray, timestamps: np.ndarray) -> np.ndarray:
+    """
+    Scalar-first orientation at each IMU sample: the latest quaternion sample received at or before
+    the IMU timestamp (or the first one, for IMU samples preceding all quaternions in the batch).
+    """
+    quats = quat_rows(data)
+    if len(quats) == 0:
+        out = np.zeros((len(timestamps), 4))
+        out[:, 0] = 1
+        return out
+    # Reorder (q_x, q_y, q_z, q_w) to (q_w, q_x, q_y, q_z)
+    q = quats[:, QUAT_COLS][:, [3, 0, 1, 2]]
+    idx = np.searchsorted(quats[:, 1], timestamps[:, 1], side='right') - 1
+    return q[np.clip(idx, 0, len(q) - 1)]
+
+
+def _moving_average(x: np.ndarray, n: int) -> np.ndarray:
+    """Causal moving average over n samples (shorter at the start of the batch)."""
+    if len(x) == 0 or n <= 1:
+        return x
+    c = np.cumsum(x, axis=0)
+    out = c.copy()
+    out[n:] -= c[:-n]
+    counts = np.minimum(np.arange(1, len(x) + 1), n)[:, np.newaxis]
+    return out / counts
@@ -0,0 +1,177 @@
+import math
+import numpy as np
+from collections import deque
+from typing import Dict, List
+
+# Column layout of the scaled 'data' characteristic rows (see config.py and Stream.scaling_factors)
+TIMESTAMP_COL = 1
+GYRO_COLS = slice(2, 5)
+ACC_COLS = slice(5, 8)
+IMU_COLS = slice(2, 8)      # Gyroscope and accelerometer
+QUAT_COLS = slice(8, 12)    # (q_x, q_y, q_z, q_w)
+MAG_COLS = slice(12, 15)
+QUAT_MAG_COLS = slice(8, 15)
+
+
+def imu_mask(data: np.ndarray) -> np.ndarray:
+    """
+    Boolean mask of the accelerometer/gyroscope rows of a block of decoded samples.
+
+    The decoder packs IMU, quaternion and magnetometer samples into rows of the same layout and leaves
+    the columns of the other sample types zeroed, so IMU rows are those with gyroscope/accelerometer data
+    and without quaternion/magnetometer data. Text packets decode to rows that are zeroed entirely.
+    """
+    return np.any(data[:, IMU_COLS], axis=1) & ~np.any(data[:, QUAT_MAG_COLS], axis=1)
+
+
+def imu_rows(data: np.ndarray) -> np.ndarray:
+    """Select the accelerometer/gyroscope rows of a block of decoded samples, see imu_mask."""
+    return data[imu_mask(data)]
+
+
+def quat_rows(data: np.ndarray) -> np.ndarray:
+    """Select the quaternion rows of a block of decoded samples."""
+    return data[np.any(data[:, QUAT_COLS], axis=1)]
+
+
+def mag_rows(data: np.ndarray) -> np.ndarray:
+    """Select the magnetometer rows of a block of decoded samples."""
+    return data[np.any(data[:, MAG_COLS], axis=1)]
+
+
+class RunningWindow:
+    """
+    Sliding-window statistics over the last 'length' samples of a set of channels.
+
+    Sums and sums of squares are updated incrementally and min/max are tracked with monotonic
+    deques, so every sample costs O(1) (amortised) regardless of the window length. The running
+    sums are recomputed from the ring buffer once per window length to prevent drift.
+    """
+    def __init__(self, length: int, n_channels: int):
+        if length < 1:
+            raise ValueError("Window length must be at least one sample")
+        self.length = length
+        self.n_channels = n_channels
+        self.buffer = np.zeros((length, n_channels))
+        self.sum = np.zeros(n_channels)
+        self.sum_sq = np.zeros(n_channels)
+        self.min_deques = [deque() for _ in range(n_channels)]
+        self.max_deques = [deque() for _ in range(n_channels)]
+        self.count = 0      # Number of samples currently in the window
+        self.index = 0      # Total number of samples pushed
+
+    def push(self, x: np.ndarray) -> None:
+        pos = self.index % self.length
+        if self.count == self.length:
+            old = self.buffer[pos]
+            self.sum -= old
+            self.sum_sq -= old * old
+        else:
+            self.count += 1
+        self.buffer[pos] = x
+        self.sum += x
+        self.sum_sq += x * x
+
+        # Monotonic deques hold (index, value) pairs; the front is the current extremum
+        expired = self.index - self.length
+        for c in range(self.n_channels):
+            v = x[c]
+            dq = self.min_deques[c]
+            while dq and dq[-1][1] >= v:
+                dq.pop()
+            dq.append((self.index, v))
+            if dq[0][0] <= expired:
+                dq.popleft()
+            dq = self.max_deques[c]
+            while dq and dq[-1][1] <= v:
+                dq.pop()
+            dq.append((self.index, v))
+            if dq[0][0] <= expired:
+                dq.popleft()
+
+        self.index += 1
+        if pos == self.length - 1:
+            self.sum = self.buffer.sum(axis=0)
+            self.sum_sq = np.square(self.buffer).sum(axis=0)
+
+    def mean(self) -> np.ndarray:
+        return self.sum / max(self.count, 1)
+
+    def var(self) -> np.ndarray:
+        mean = self.mean()
+        return np.maximum(self.sum_sq / max(self.count, 1) - mean * mean, 0)
+
+    def rms(self) -> np.ndarray:
+        return np.sqrt(self.sum_sq / max(self.count, 1))
+
+    def min(self) -> np.ndarray:
+        return np.array([dq[0][1] if dq else 0.0 for dq in self.min_deques])
+
+    def max(self) -> np.ndarray:
+        return np.array([dq[0][1] if dq else 0.0 for dq in self.max_deques])
+
+
+class FeatureEngine:
+    """
+    Maintains windowed statistics of a single device's IMU stream.
+
+    For every configured window length (in IMU samples) the mean, variance, RMS, minimum and
+    maximum of each channel are kept up to date as samples arrive. Predictors can then use
+    'feature_vector' or 'features' instead of recomputing the statistics from raw windows.
+    """
+    CHANNELS = ['acc_x', 'acc_y', 'acc_z', 'gyro_x', 'gyro_y', 'gyro_z', 'acc_norm', 'gyro_norm', 'jerk', 'tilt']
+    STATS = ['mean', 'var', 'rms', 'min', 'max']
+
+    def __init__(self, windows: List[int]):
+        self.windows = {w: RunningWindow(w, len(self.CHANNELS)) for w in windows}
+        self.sample = np.zeros(len(self.CHANNELS))
+        self.last_acc = None
+        self.last_ts = None
+        self.samples_seen = 0
+
+    def update(self, data: np.ndarray) -> None:
+        """Feed a block of scaled data rows (N, 15) into all windows."""
+        if not self.windows:
+            return
+        for row in imu_rows(data):
+            self._push(row)
+
+    def _push(self, row: np.ndarray) -> None:
+        acc = row[ACC_COLS]
+        gyro = row[GYRO_COLS]
+        ts = row[TIMESTAMP_COL]
+        acc_norm = math.sqrt(acc[0] * acc[0] + acc[1] * acc[1] + acc[2] * acc[2])
+
+        jerk = 0.0
+        if self.last_acc is not None and ts > self.last_ts:
+            d = acc - self.last_acc
+            jerk = math.sqrt(d[0] * d[0] + d[1] * d[1] + d[2] * d[2]) / (ts - self.last_ts)
+        self.last_acc = acc.copy()
+        self.last_ts = ts
+
+        s = self.sample
+        s[0:3] = acc
+        s[3:6] = gyro
+        s[6] = acc_norm
+        s[7] = math.sqrt(gyro[0] * gyro[0] + gyro[1] * gyro[1] + gyro[2] * gyro[2])
+        s[8] = jerk
+        # Tilt: angle between the sensor z-axis and the measured gravity vector
+        s[9] = math.acos(max(-1.0, min(1.0, acc[2] / acc_norm))) if acc_norm > 0 else 0.0
+
+        for window in self.windows.values():
+            window.push(s)
+        self.samples_seen += 1
+
+    def feature_names(self) -> List[str]:
+        return [f'{c}_{stat}_{w}' for w in self.windows for stat in self.STATS for c in self.CHANNELS]
+
+    def feature_vector(self) -> np.ndarray:
+        """Current features, ordered as 'feature_names'."""
+        if not self.windows:
+            return np.zeros(0)
+        return np.concatenate([
+            np.concatenate((w.mean(), w.var(), w.rms(), w.min(), w.max())) for w in self.windows.values()
+        ])
+
+    def features(self) -> Dict[str, float]:
+        return dict(zip(self.feature_names(), self.feature_vector()))
@@ -1,5 +1,12 @@
 import sys
+import json
+import atexit
 import logging
+import threading
+import logging.handlers
+from queue import SimpleQueue
+from collections import OrderedDict
+from typing import List
 
 
 class LogReroute(logging.Handler):
@@ -13,34 +20,150 @@ class LogReroute(logging.Handler):
         return True
 
 
-class Log(logging.Logger):
-    '''This class sets up the logging system for the application. It creates a logger object that logs 
-    to a file and to the GUI. It also reroutes warnings to the log and prints ERROR messages to stderr. 
-    The log level is set by the user in the settings file.
+class JSONFormatter(logging.Formatter):
+    '''One JSON object per line, for machine parsing of the log:
+    {"time": 1712345678.123, "level": "WARNING", "message": "...", "module": "stream", "line": 42, "thread": "..."}
     '''
-    def __init__(self, log_file: str, log_level: int, gui_logger):
-        # Setup logger object
-        super().__init__(name='log', level=log_level)
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': record.created,
+            'level': record.levelname,
+            'message': record.getMessage(),
+            'module': record.module,
+            'line': record.lineno,
+            'thread': record.threadName,
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+class RateLimitFilter(logging.Filter):
+    '''Passes at most 'burst' identical records per call site (file and line) every 'interval' seconds.
+
+    A message logged in a loop then shows up a few times per interval instead of once per
+    iteration, while different messages of one call site (e.g. one per device) all pass. The
+    number of suppressed records is appended to the next record of that message that passes,
+    or logged by report_suppressed(). At most 'max_sites' messages are tracked, the least
+    recently logged one is forgotten first.
+    '''
+    max_sites = 1000
+
+    def __init__(self, burst: int = 10, interval: float = 1.0):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.lock = threading.Lock()
+        # (call site, message) -> [start of the current interval, records passed, records suppressed],
+        # least recently logged first
+        self.sites = OrderedDict()  # type: OrderedDict[tuple, List]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = (record.pathname, record.lineno, record.getMessage())
+        with self.lock:
+            site = self.sites.get(key)
+            if site is not None:
+                self.sites.move_to_end(key)
+            if site is None or record.created - site[0] >= self.interval:
+                suppressed = site[2] if site is not None else 0
+                if site is None and len(self.sites) >= self.max_sites:
+                    self.sites.popitem(last=False)
+                self.sites[key] = [record.created, 1, 0]
+            elif site[1] < self.burst:
+                site[1] += 1
+                return True
+            else:
+                site[2] += 1
+                return False
+        if suppressed:
+            record.msg = f'{record.getMessage()} ({suppressed} repeats suppressed)'
+            record.args = ()
+        return True
+
+    def report_suppressed(self, logger: logging.Logger) -> None:
+        with self.lock:
+            pending = [(key, site[2]) for key, site in self.sites.items() if site[2]]
+            self.sites = OrderedDict()
+        for (path, line, message), count in pending:
+            logger.info(f'{count} repeats suppressed of "{message}" ({path}:{line})')
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    '''Queues the record as is: formatting is left to the handlers on the listener thread.'''
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class Log:
+    '''This class sets up the logging system for the application. It configures the 'log' logger,
+    used by all modules, to log to a file, optionally to a JSON-lines file, and to the GUI. It
+    also reroutes warnings to the log and prints ERROR messages to stderr. The log level is set
+    by the user in the settings file.
+
+    The logger itself only has a QueueHandler: records are put on a queue, and written by the
+    handlers on a background thread (QueueListener), so logging from the acquisition loop never
+    waits for file or terminal I/O. Repeated records are rate limited per call site before being
+    queued, see RateLimitFilter.
+    '''
+    def __init__(self, log_file: str, log_level: int, gui_logger=None, json_file: str = None,
+                 stderr_level: int = logging.ERROR, rate_limit: int = 10, rate_interval: float = 1.0):
+        self.logger = logging.getLogger('log')
+        self.logger.setLevel(log_level)
+        self.logger.propagate = False
+        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+        handlers = []
 
         # Setup status log file output
         if log_file is not None:
             file_handler = logging.FileHandler(log_file)
             file_handler.setLevel(log_level)
-            file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-            self.addHandler(file_handler)
-        
+            file_handler.setFormatter(formatter)
+            handlers.append(file_handler)
+
+        # Setup JSON-lines log file output
+        if json_file is not None:
+            json_handler = logging.FileHandler(json_file)
+            json_handler.setLevel(log_level)
+            json_handler.setFormatter(JSONFormatter())
+            handlers.append(json_handler)
+
         # Set up logging to GUI
-        gui_logger.setLevel(log_level)
-        gui_logger.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-        self.addHandler(gui_logger)
-        
+        if gui_logger is not None:
+            gui_logger.setLevel(log_level)
+            gui_logger.setFormatter(formatter)
+            handlers.append(gui_logger)
+
         # Reroute warnings to log
         logging.captureWarnings(True)
         warn_logger = logging.getLogger('py.warnings')
         warn_logger.setLevel(logging.WARNING)
-        warn_logger.addHandler(LogReroute('log'))
+        warn_logger.handlers = [LogReroute('log')]
 
         # Add stream handler to print ERROR messages to stderr
         err_handler = logging.StreamHandler(sys.stderr)
-        err_handler.setLevel(logging.ERROR)
-        self.addHandler(err_handler)
+        err_handler.setLevel(stderr_level)
+        err_handler.setFormatter(formatter)
+        handlers.append(err_handler)
+
+        # Only the queue handler runs on the logging thread, the others on the listener thread
+        self.handlers = handlers
+        self.rate_limiter = RateLimitFilter(rate_limit, rate_interval)
+        self.queue = SimpleQueue()
+        queue_handler = _DeferredQueueHandler(self.queue)
+        queue_handler.addFilter(self.rate_limiter)
+        self.logger.handlers = [queue_handler]
+        self.listener = logging.handlers.QueueListener(self.queue, *handlers, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.close)
+
+    def close(self) -> None:
+        '''Write the queued records and stop the listener thread'''
+        if self.listener is None:
+            return
+        self.rate_limiter.report_suppressed(self.logger)
+        self.listener.stop()
+        self.listener = None
+        for handler in self.handlers:
+            handler.flush()
+            if isinstance(handler, logging.FileHandler):
+                handler.close()
@@ -0,0 +1,53 @@
+import logging
+from typing import Callable, List
+
+
+class Signal:
+    """
+    Plain observer, with the connect/disconnect/emit interface of a Qt signal, so that the core
+    library does not depend on Qt. Declared as a class attribute, every instance gets its own
+    list of callbacks:
+
+        class Stream:
+            new_data = Signal()
+
+        stream.new_data.connect(callback)
+        stream.new_data.emit(device_name)
+
+    Callbacks run synchronously, in the thread that emits. Exceptions are logged and do not stop
+    the other callbacks. To handle emits on another thread (e.g. the Qt GUI thread), connect a
+    callback that forwards them, see gui/adapters.py.
+    """
+    def __set_name__(self, owner, name: str):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        bound = instance.__dict__.get(self.name)
+        if bound is None:
+            bound = instance.__dict__[self.name] = BoundSignal(self.name)
+        return bound
+
+
+class BoundSignal:
+    def __init__(self, name: str):
+        self.name = name
+        self.callbacks = []  # type: List[Callable]
+
+    def connect(self, callback: Callable) -> None:
+        self.callbacks.append(callback)
+
+    def disconnect(self, callback: Callable = None) -> None:
+        """Disconnect a callback, or all of them"""
+        if callback is None:
+            self.callbacks = []
+        else:
+            self.callbacks.remove(callback)
+
+    def emit(self, *args) -> None:
+        for callback in self.callbacks:
+            try:
+                callback(*args)
+            except Exception as e:
+                logging.getLogger('log').error(f'Callback of {self.name} failed: {e}')
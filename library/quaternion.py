@@ -1,8 +1,194 @@
 import numpy as np
-from vqf import VQF
 import math
 
 
+def _quat_product(q, r, out):
+    """
+    Hamilton product of two broadcastable quaternion arrays of shape (..., 4),
+    written component-wise into 'out'. Inputs that alias 'out' are copied first.
+    """
+    if np.shares_memory(out, q):
+        q = q.copy()
+    if np.shares_memory(out, r):
+        r = r.copy()
+    q0, q1, q2, q3 = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+    r0, r1, r2, r3 = r[..., 0], r[..., 1], r[..., 2], r[..., 3]
+    tmp = np.empty(out.shape[:-1])
+
+    o = out[..., 0]
+    np.multiply(q0, r0, out=o)
+    o -= np.multiply(q1, r1, out=tmp)
+    o -= np.multiply(q2, r2, out=tmp)
+    o -= np.multiply(q3, r3, out=tmp)
+
+    o = out[..., 1]
+    np.multiply(q1, r0, out=o)
+    o += np.multiply(q0, r1, out=tmp)
+    o -= np.multiply(q3, r2, out=tmp)
+    o += np.multiply(q2, r3, out=tmp)
+
+    o = out[..., 2]
+    np.multiply(q2, r0, out=o)
+    o += np.multiply(q3, r1, out=tmp)
+    o += np.multiply(q0, r2, out=tmp)
+    o -= np.multiply(q1, r3, out=tmp)
+
+    o = out[..., 3]
+    np.multiply(q3, r0, out=o)
+    o -= np.multiply(q2, r1, out=tmp)
+    o += np.multiply(q1, r2, out=tmp)
+    o += np.multiply(q0, r3, out=tmp)
+    return out
+
+
+def _quat_conjugate(q, out):
+    """Conjugate of a quaternion array of shape (..., 4), written into 'out'."""
+    if out is not q:
+        np.copyto(out, q)
+    np.negative(out[..., 1:], out=out[..., 1:])
+    return out
+
+
+def _quat_inverse(q, out):
+    """Inverse of a quaternion array of shape (..., 4), written into 'out'."""
+    norm_sq = np.einsum('...i,...i->...', q, q)
+    _quat_conjugate(q, out)
+    out /= norm_sq[..., np.newaxis]
+    return out
+
+
+def _rotate_vectors(v, q, out):
+    """
+    Rotate broadcastable vectors (..., 3) by quaternions (..., 4), i.e. q * v * q^-1 for unit
+    quaternions, using the closed form
+
+        v' = (w^2 - u.u) v + 2 (u.v) u + 2 w (u x v)
+
+    with q = (w, u). This is exactly the vector part of q * (0, v) * conj(q) for any q, without
+    building the two intermediate quaternion products.
+    """
+    if np.shares_memory(out, v):
+        v = v.copy()
+    w = q[..., 0:1]
+    u = q[..., 1:]
+    # Scalar factors, kept with a trailing axis so that they broadcast against (..., 3)
+    uv2 = 2 * np.einsum('...i,...i->...', u, v)[..., np.newaxis]
+    s = w * w - np.einsum('...i,...i->...', u, u)[..., np.newaxis]
+    w2 = 2 * w
+
+    cross = np.cross(u, v)
+    np.multiply(s, v, out=out)
+    out += uv2 * u
+    out += w2 * cross
+    return out
+
+
+def _as_quat_data(q):
+    if isinstance(q, QuaternionArray):
+        return q.data
+    return np.asarray(q, dtype=np.float64)
+
+
+def _out_data(out, shape):
+    if out is None:
+        return np.empty(shape)
+    if isinstance(out, QuaternionArray):
+        out = out.data
+    if out.shape != shape:
+        raise ValueError(f"Output array has shape {out.shape}, expected {shape}")
+    return out
+
+
+class QuaternionArray:
+    """
+    Contiguous array of N scalar-first quaternions (w, x, y, z), backed by a (N, 4) float array.
+
+    All operations broadcast: a single quaternion (shape (1, 4) or (4,)) can be combined with a
+    batch of N without tiling. Every operation accepts an 'out' argument to write into an existing
+    array, and 'inplace=True' to overwrite this array's data.
+    """
+    __slots__ = ('data',)
+
+    def __init__(self, data, copy: bool = False):
+        data = np.array(data, dtype=np.float64, copy=True) if copy else np.ascontiguousarray(data, dtype=np.float64)
+        if data.ndim == 1:
+            data = data.reshape(1, 4)
+        if data.ndim != 2 or data.shape[1] != 4:
+            raise ValueError("Quaternion must either have the shape (4,) or (N, 4)")
+        self.data = data
+
+    @classmethod
+    def empty(cls, n: int) -> 'QuaternionArray':
+        return cls(np.empty((n, 4)))
+
+    @classmethod
+    def identity(cls, n: int = 1) -> 'QuaternionArray':
+        data = np.zeros((n, 4))
+        data[:, 0] = 1
+        return cls(data)
+
+    def __len__(self) -> int:
+        return self.data.shape[0]
+
+    def __getitem__(self, idx) -> 'QuaternionArray':
+        return QuaternionArray(self.data[idx])
+
+    def __array__(self, dtype=None, copy=None):
+        return self.data if dtype is None else self.data.astype(dtype)
+
+    def __repr__(self) -> str:
+        return f"QuaternionArray({self.data!r})"
+
+    def __mul__(self, other) -> 'QuaternionArray':
+        return self.multiply(other)
+
+    def _target(self, out, shape, inplace):
+        if inplace:
+            if out is not None:
+                raise ValueError("Cannot use 'out' together with 'inplace'")
+            if shape != self.data.shape:
+                raise ValueError(f"Result of shape {shape} does not fit in place into {self.data.shape}")
+            return self.data
+        return _out_data(out, shape)
+
+    def _wrap(self, result, inplace):
+        return self if inplace else QuaternionArray(result)
+
+    def multiply(self, other, out=None, inplace: bool = False) -> 'QuaternionArray':
+        """Hamilton product self * other, i.e. the rotation 'other' expressed in the frame of 'self'."""
+        r = _as_quat_data(other)
+        shape = np.broadcast_shapes(self.data.shape, r.shape)
+        return self._wrap(_quat_product(self.data, r, self._target(out, shape, inplace)), inplace)
+
+    def conjugate(self, out=None, inplace: bool = False) -> 'QuaternionArray':
+        return self._wrap(_quat_conjugate(self.data, self._target(out, self.data.shape, inplace)), inplace)
+
+    def inverse(self, out=None, inplace: bool = False) -> 'QuaternionArray':
+        return self._wrap(_quat_inverse(self.data, self._target(out, self.data.shape, inplace)), inplace)
+
+    def norm(self) -> np.ndarray:
+        return np.sqrt(np.einsum('ij,ij->i', self.data, self.data))
+
+    def normalize(self, out=None, inplace: bool = False) -> 'QuaternionArray':
+        target = self._target(out, self.data.shape, inplace)
+        np.divide(self.data, self.norm()[:, np.newaxis], out=target)
+        return self._wrap(target, inplace)
+
+    def rotate(self, vectors, out=None) -> np.ndarray:
+        """
+        Rotate (3,) or (N, 3) vectors by the quaternion(s) of this array.
+
+        Returns an (N, 3) array, written into 'out' if given.
+        """
+        v = np.asarray(vectors, dtype=np.float64)
+        shape = np.broadcast_shapes(v.shape, self.data.shape[:-1] + (3,))
+        if out is None:
+            out = np.empty(shape)
+        elif out.shape != shape:
+            raise ValueError(f"Output array has shape {out.shape}, expected {shape}")
+        return _rotate_vectors(v, self.data, out)
+
+
 class Quaternion:
     @staticmethod
     def quat_multiply(q, r):
@@ -24,23 +210,11 @@ class Quaternion:
           - If both 'q' and 'r' are 2D arrays (shape: (N, 4)),
             returns an array of resulting quaternions as a 2D array (shape: (N, 4))
         """
-        q = np.array(q)
-        r = np.array(r)
-
-        if q.ndim == 2 and r.ndim == 2 and q.shape[1] == 4 and r.shape[1] == 4:
-            return Quaternion.quat_product(q, r)
-        elif q.ndim == 1 and r.ndim == 2 and q.shape[0] == 4 and r.shape[1] == 4:
-            q_extended = np.tile(q, (len(r), 1))
-            return Quaternion.quat_product(q_extended, r)
-        elif q.ndim == 2 and r.ndim == 1 and q.shape[1] == 4 and r.shape[0] == 4:
-            r_extended = np.tile(r, (len(q), 1))
-            return Quaternion.quat_product(q, r_extended)
-        elif q.ndim == 1 and r.ndim == 1 and q.shape[0] == 4 and r.shape[0] == 4:
-            q_extended = np.reshape(q, (1, 4))
-            r_extended = np.reshape(r, (1, 4))
-            return Quaternion.quat_product(q_extended, r_extended)[0]
-        else:
+        q = np.asarray(q, dtype=np.float64)
+        r = np.asarray(r, dtype=np.float64)
+        if q.ndim not in (1, 2) or r.ndim not in (1, 2) or q.shape[-1] != 4 or r.shape[-1] != 4:
             raise ValueError("Quaternion must either have the shape (4,) or (N, 4)")
+        return _quat_product(q, r, np.empty(np.broadcast_shapes(q.shape, r.shape)))
 
     @staticmethod
     def quat_product(q, r):
@@ -54,12 +228,9 @@ class Quaternion:
         Returns:
         - An array containing the resulting quaternions of shape (N,4)
         """
-        q0 = q[:, 0] * r[:, 0] - q[:, 1] * r[:, 1] - q[:, 2] * r[:, 2] - q[:, 3] * r[:, 3]
-        q1 = q[:, 1] * r[:, 0] + q[:, 0] * r[:, 1] - q[:, 3] * r[:, 2] + q[:, 2] * r[:, 3]
-        q2 = q[:, 2] * r[:, 0] + q[:, 3] * r[:, 1] + q[:, 0] * r[:, 2] - q[:, 1] * r[:, 3]
-        q3 = q[:, 3] * r[:, 0] - q[:, 2] * r[:, 1] + q[:, 1] * r[:, 2] + q[:, 0] * r[:, 3]
-
-        return np.column_stack((q0, q1, q2, q3))
+        q = np.asarray(q, dtype=np.float64)
+        r = np.asarray(r, dtype=np.float64)
+        return _quat_product(q, r, np.empty(np.broadcast_shapes(q.shape, r.shape)))
 
     @staticmethod
     def quat_conjugate(q):
@@ -72,7 +243,16 @@ class Quaternion:
         Returns:
         - An array containing the four elements of the resulting quaternion or a conjugated time series
         """
-        return q * np.array([1, -1, -1, -1])
+        q = np.asarray(q, dtype=np.float64)
+        return _quat_conjugate(q, np.empty(q.shape))
+
+    @staticmethod
+    def quat_inverse(q):
+        """
+        Calculate the inverse of a quaternion or a quaternion time series.
+        """
+        q = np.asarray(q, dtype=np.float64)
+        return _quat_inverse(q, np.empty(q.shape))
 
     @staticmethod
     def rotate_coordinate_frame(target_initial_quat, quats):
@@ -110,27 +290,16 @@ class Quaternion:
           - If both 'vector' and 'q' are arrays with shape (N,3) and (N,4) respectively, returns an array
             containing the rotated vectors with shape (N,3)
           - If 'vector' is a single vector (shape: (3,)) and 'q' is a single quaternion (shape: (4,)),
-            returns a single rotated vector as a list (shape: (3,))
-          - If either 'vector' or 'q' is an array and the other is a single vector/quaternion, it extends the
-            single vector/quaternion to match the shape of the array and performs batch rotation
+            returns a single rotated vector (shape: (3,))
+          - If either 'vector' or 'q' is an array and the other is a single vector/quaternion, the
+            single vector/quaternion is broadcast against the array
         """
-        vector = np.array(vector)
-        q = np.array(q)
-        if vector.ndim == 2 and q.ndim == 2 and vector.shape[1] == 3 and q.shape[1] == 4:
-            return Quaternion.rotate_vectors(vector, q)
-        elif vector.ndim == 2 and q.ndim == 1 and vector.shape[1] == 3 and q.shape[0] == 4:
-            q_extended = np.tile(q, (len(vector), 1))
-            return Quaternion.rotate_vectors(vector, q_extended)
-        elif vector.ndim == 1 and q.ndim == 2 and vector.shape[0] == 3 and q.shape[1] == 4:
-            vector_extended = np.tile(vector, (len(q), 1))
-            return Quaternion.rotate_vectors(vector_extended, q)
-        elif vector.ndim == 1 and q.ndim == 1 and vector.shape[0] == 3 and q.shape[0] == 4:
-            q_extended = np.reshape(q, (1, 4))
-            vector_extended = np.reshape(vector, (1, 3))
-            return Quaternion.rotate_vectors(vector_extended, q_extended)[0]
-        else:
+        vector = np.asarray(vector, dtype=np.float64)
+        q = np.asarray(q, dtype=np.float64)
+        if vector.ndim not in (1, 2) or q.ndim not in (1, 2) or vector.shape[-1] != 3 or q.shape[-1] != 4:
             raise ValueError("Quaternion must either have the shape (4,) or (N, 4) and vector must have the shape "
                              "(3,) or (N, 3)")
+        return Quaternion.rotate_vectors(vector, q)
 
     @staticmethod
     def rotate_vectors(vectors, quats):
@@ -144,23 +313,13 @@ class Quaternion:
         Returns:
         - Array of shape (N,3) containing the rotated 3D vectors after applying quaternion rotation
 
-        The function performs batch quaternion rotation on a batch of 3D vectors using corresponding quaternions.
-        It first calculates the conjugate of the input quaternions, then represents the input vectors as quaternions
-        with zero scalar parts. After performing quaternion multiplication, it extracts and returns the vector parts
-        of the resulting rotated quaternions.
+        Computes the vector part of q * (0, v) * conj(q) in closed form, without forming the two
+        intermediate quaternion products.
         """
-        quats_conj = Quaternion.quat_conjugate(quats)
-
-        # Represent vectors as quaternions with zero scalar parts
-        vectors_extended = np.hstack((np.zeros((len(quats), 1)), vectors))
-
-        temp = Quaternion.quat_multiply(quats, vectors_extended)
-        rotated_vectors = Quaternion.quat_multiply(temp, quats_conj)
-
-        # Extract and return the vector parts of the rotated quaternions
-        rotated_vectors = rotated_vectors[:, 1:]
-
-        return rotated_vectors
+        vectors = np.asarray(vectors, dtype=np.float64)
+        quats = np.asarray(quats, dtype=np.float64)
+        shape = np.broadcast_shapes(vectors.shape, quats.shape[:-1] + (3,))
+        return _rotate_vectors(vectors, quats, np.empty(shape))
     
     @staticmethod
     def offline_vqf(dt, acc, gyr, mag=None):
@@ -178,6 +337,8 @@ class Quaternion:
         - rest    (N,) array of rest detection state
         - (dist)  (N,) array of magnetic disturbance state
         '''
+        # Imported on first use, most users of this module only need the quaternion math
+        from vqf import VQF
         return Quaternion.update_vqf(VQF(dt), acc, gyr, mag)
     
     @staticmethod
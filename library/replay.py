@@ -0,0 +1,204 @@
+"""
+Replay of raw notification captures (see library.capture) without any Bluetooth hardware.
+
+The ReplayBackend is a BLE backend (see blebackend.py) without a scanner: every recorded device
+'connects' immediately and delivers its recorded notifications to the notification callback of
+its ActiveConnection, so the data takes the same path as live data (NotifBuffer -> DecodeStage -> ConsumerManager/Stream).
+Notifications are replayed at their recorded pace divided by 'speed', or as fast as the pipeline
+accepts them if 'speed' is None. The 'sys_time' column reflects the time of the replay, the
+device timestamps and sample data are reproduced exactly.
+
+Usage, to measure the throughput of the pipeline:
+
+    python -m library.replay output/capture_20240101_120000.hlcap --speed 0
+"""
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import dataclasses
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Set
+from bleak.exc import BleakError
+from .blebackend import BLEBackend
+from .capture import read_capture
+from .datatypes import Configuration, SeenDevice, SeenDeviceState
+
+
+@dataclass
+class ReplayResult:
+    devices: int
+    notifications: int
+    samples: int
+    dropped: int
+    elapsed: float
+
+    def samples_per_s(self) -> float:
+        return self.samples / self.elapsed if self.elapsed > 0 else 0.0
+
+    def notifications_per_s(self) -> float:
+        return self.notifications / self.elapsed if self.elapsed > 0 else 0.0
+
+
+class ReplayBackend(BLEBackend):
+    def __init__(self, config: Configuration, path: str, speed: Optional[float] = 1.0):
+        self.log = logging.getLogger('log')
+        self.config = config
+        self.path = path
+        self.speed = speed if speed else None
+        self.records = {config.normalise(adr): r for adr, r in read_capture(path).items()}
+        self.position = {adr: 0 for adr in self.records}  # type: Dict[str, int]
+        self.t0 = min((r[0][0] for r in self.records.values() if r), default=0)
+        self.start_ns = None
+        self.remaining = set(self.records)
+        self.finished = asyncio.Event()
+        if not self.remaining:
+            self.finished.set()
+
+    def devices(self) -> List[SeenDevice]:
+        """The recorded devices, ready to be connected to."""
+        now = time.monotonic_ns()
+        return [
+            SeenDevice(
+                adr=adr,
+                alias=self.config.device_aliases.get(adr, None),
+                state=SeenDeviceState.RECENTLY_SEEN,
+                name=None,
+                last_seen=now,
+                rssi=None,
+            ) for adr in self.records
+        ]
+
+    def addresses(self) -> Set[str]:
+        return set(self.records)
+
+    def create_scanner(self, detection_callback: Callable):
+        raise NotImplementedError('A replay does not scan, its devices are listed by devices()')
+
+    def create_client(self, adr: str, timeout: float = None, disconnected_callback: Callable = None, **kwargs) -> 'ReplayClient':
+        return ReplayClient(self, self.config.normalise(adr), timeout, disconnected_callback)
+
+    def total_notifications(self) -> int:
+        return sum(len(r) for r in self.records.values())
+
+    def _device_done(self, adr: str) -> None:
+        self.remaining.discard(adr)
+        if not self.remaining:
+            self.finished.set()
+
+
+class ReplayClient:
+    def __init__(self, backend: ReplayBackend, adr: str, timeout: float = None, disconnected_callback: Callable = None, **kwargs):
+        self.backend = backend
+        self.adr = adr
+        self.disconnected_callback = disconnected_callback
+        self.callbacks = {}  # type: Dict[str, Callable]
+        self.is_connected = False
+        self.task = None
+
+    async def connect(self) -> bool:
+        if self.adr not in self.backend.records:
+            raise BleakError(f'Device {self.adr} is not part of the capture')
+        self.is_connected = True
+        return True
+
+    async def write_gatt_char(self, char, data) -> None:
+        pass
+
+    async def start_notify(self, uuid: str, callback: Callable) -> None:
+        self.callbacks[self.backend.config.normalise(uuid)] = callback
+        # Playback starts once the connection waits for notifications, i.e. after
+        # all characteristics have been subscribed
+        if self.task is None:
+            self.task = asyncio.create_task(self._play(), name=f'Replay {self.adr}')
+
+    async def disconnect(self) -> bool:
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        self.is_connected = False
+        return True
+
+    async def _play(self) -> None:
+        backend = self.backend
+        records = backend.records[self.adr]
+        speed = backend.speed
+        # Yield at least once per chunk, so that the decode stage drains the notification
+        # buffer before it fills up
+        chunk = max(1, backend.config.notif_buffer_size // 2)
+        if backend.start_ns is None:
+            backend.start_ns = time.monotonic_ns()
+
+        sent = 0
+        while backend.position[self.adr] < len(records):
+            t, uuid, data = records[backend.position[self.adr]]
+            if speed is not None:
+                due = backend.start_ns + (t - backend.t0) / speed
+                delay = (due - time.monotonic_ns()) / 1e9
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    sent = 0
+            callback = self.callbacks.get(uuid)
+            if callback is not None:
+                callback(0, bytearray(data))
+            backend.position[self.adr] += 1
+            sent += 1
+            if sent >= chunk:
+                await asyncio.sleep(backend.config.decode_interval)
+                sent = 0
+        backend._device_done(self.adr)
+
+
+async def run_replay(config: Configuration, path: str, speed: Optional[float] = 1.0, data_path=None) -> ReplayResult:
+    """Replay a capture through a Stream and report the achieved throughput."""
+    from .stream import Stream
+
+    backend = ReplayBackend(config, path, speed)
+    # Replayed devices connect directly and all at once, in this process (the replay backend
+    # cannot be shared with workers), and a replay is never captured again
+    config = dataclasses.replace(config, warm_start=True, capture_raw=False, acquisition_shards=0,
+                                 max_active_connections=max(config.max_active_connections, len(backend.records)))
+    backend.config = config
+    halt_event = asyncio.Event()
+    stream = Stream(config, halt_event, {}, backend=backend)
+    stream.start({d.get_id(): (d, None) for d in backend.devices()}, data_path=data_path)
+    sample_counts = stream.sample_counts
+    connections = stream.connection_manager.connections
+
+    t = time.perf_counter()
+    waiters = [asyncio.create_task(backend.finished.wait()), stream.connection_manager_task]
+    await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+    waiters[0].cancel()
+    halt_event.set()
+    await stream.stop()
+    elapsed = time.perf_counter() - t
+
+    return ReplayResult(
+        devices=len(backend.records),
+        notifications=sum(backend.position.values()),
+        samples=sum(sample_counts.values()),
+        dropped=sum(c.active_connection.notif_buffer.dropped for c in connections.values() if c.active_connection is not None),
+        elapsed=elapsed,
+    )
+
+
+def main():
+    from .config import conf
+
+    parser = argparse.ArgumentParser(description='Replay a raw notification capture through the data pipeline.')
+    parser.add_argument('capture', help='Capture file (.hlcap)')
+    parser.add_argument('--speed', type=float, default=1.0, help='Replay speed factor, 0 for as fast as possible (default: 1)')
+    parser.add_argument('--csv', metavar='FOLDER', default=None, help='Write the decoded data to CSV files in this folder')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    config = dataclasses.replace(conf, output_csv=args.csv is not None)
+    result = asyncio.run(run_replay(config, args.capture, args.speed, data_path=args.csv))
+    print(f'Replayed {result.notifications} notifications ({result.samples} samples) of {result.devices} devices '
+          f'in {result.elapsed:.2f}s: {result.samples_per_s():.0f} samples/s, '
+          f'{result.notifications_per_s():.0f} notifications/s, {result.dropped} dropped')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
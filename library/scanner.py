@@ -1,82 +1,120 @@
-import re
 import time
 import asyncio
 import logging
-from typing import Dict
-from bleak import BleakScanner
+from typing import Callable, Dict, Iterable, List, Union
+from .blebackend import BLEBackend, create_backend
 from .datatypes import Configuration, SeenDevice, SeenDeviceState
+from .deviceregistry import DeviceRegistry
+from .events import wait_any
 
 
 class Scanner:
-    def __init__(self, config: Configuration, halt_event: asyncio.Event):
+    """
+    Long-lived BLE scanner driven by advertisement callbacks.
+
+    Devices are reported as soon as their first matching advertisement arrives. A scan finishes
+    once all wanted devices were seen or after 'scan_duration'. If 'background_scan' is enabled,
+    the scanner keeps running afterwards to keep the 'last_seen' state of all devices fresh.
+    """
+    def __init__(self, config: Configuration, halt_event: asyncio.Event, backend: BLEBackend = None):
         self.config = config
         self.halt_event = halt_event
         self.log= logging.getLogger('log')
-        self.name_regexes = [re.compile(r) for r in config.name_regexes]
-        self.seen_devices = {}  # type: Dict[str, SeenDevice]
+        self.backend = backend if backend is not None else create_backend(config)
+        self.registry = DeviceRegistry(config)
+        self.seen_devices = self.registry.devices  # type: Dict[str, SeenDevice]
+        self.scanned_devices = []  # type: List[SeenDevice]
+        self.reported = set()
+        self.scanning = False
+        self.wanted = set()
+        self.on_device = None  # type: Union[None, Callable[[SeenDevice], None]]
+        self.all_found = asyncio.Event()
+        self.stop_event = asyncio.Event()
+        self.scanner_task = None
 
-    async def scan_for_devices(self):
-        # Start scan and wait for it to finish
+    async def scan_for_devices(self, wanted: Iterable[str] = None, on_device: Callable[[SeenDevice], None] = None):
+        """
+        Scan until every address in 'wanted' (default: all addresses in device_aliases) has been seen,
+        'scan_duration' passed or the halt event is set. 'on_device' is called for every matching device
+        when it is first seen during this scan.
+        """
         self.log.info("Scanning nearby motion trackers...")
-        await self.run()
-        # Update scanned devices
-        self.scanned_devices = [device for device in self.seen_devices.values() if device.state==SeenDeviceState.RECENTLY_SEEN]
+        self.scanned_devices = []
+        self.reported = set()
+        self.scanning = True
+        self.on_device = on_device
+        self.wanted = {self.config.normalise(a) for a in (wanted if wanted is not None else self.config.device_aliases)}
+        self.all_found.clear()
+
+        # Report devices that are still known from a previous (background) scan right away
+        self.registry.expire(time.monotonic_ns())
+        for dev in list(self.seen_devices.values()):
+            if dev.state == SeenDeviceState.RECENTLY_SEEN:
+                self._report_device(dev)
+
+        await self.start()
+        await self._wait_for_scan_end()
+        self.scanning = False
+        self.on_device = None
+        if not self.config.background_scan:
+            await self.stop()
+        self.registry.save()
+
         self.log.info(f"Scanned motion trackers: {[f'{d.get_id()}({d.adr})' for d in self.scanned_devices]}")
-        
+
+    async def _wait_for_scan_end(self):
+        await wait_any(self.all_found, self.halt_event, timeout=self.config.scan_duration)
+        if self.all_found.is_set():
+            self.log.info("All wanted motion trackers found, finishing scan early")
+
+    async def start(self):
+        """Start the background scanner, if it is not running already."""
+        if self.scanner_task is None or self.scanner_task.done():
+            self.stop_event.clear()
+            self.scanner_task = asyncio.create_task(self.run(), name='Scanner Task')
+
+    async def stop(self):
+        """Stop the background scanner and wait for it to shut down."""
+        self.stop_event.set()
+        if self.scanner_task is not None:
+            await self.scanner_task
+            self.scanner_task = None
+
     async def run(self):
-        time_start = time.time()
         try:
-            while not self.halt_event.is_set() and (time.time()-time_start < self.config.scan_duration):
-                try:
-                    # Discover devices
-                    devices_and_adv_data = await BleakScanner.discover(timeout=self.config.scan_timeout, return_adv=True)
-                    # Update list of seen devices:
-                    t = time.monotonic_ns()
-                    self._update_seen_devices(devices_and_adv_data, t)
-                    # Cooldown
-                    await asyncio.sleep(self.config.scan_cooldown)
-                except asyncio.TimeoutError:
-                    self.log.warning('Scanner timed out')
-                except RuntimeError as e:
-                    self.log.warning(f'Scanner did not complete scan')
-                    break
+            scanner = self.backend.create_scanner(self._detection_callback)
+            await scanner.start()
+            try:
+                # Advertisements are handled by the callback, this loop only expires stale devices
+                sweep_interval = self.config.seen_timeout / 2
+                while not self.halt_event.is_set() and not self.stop_event.is_set():
+                    try:
+                        await asyncio.wait_for(self.stop_event.wait(), timeout=sweep_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    self.registry.expire(time.monotonic_ns())
+            finally:
+                await scanner.stop()
         except Exception as e:
             self.log.error(f'Scanner encountered an exception: {e}')
 
-    def _update_seen_devices(self, devices_and_adv_data: dict, t: int):
-        for address in devices_and_adv_data:
-            adr = self.config.normalise(address)
-            scanned_dev = devices_and_adv_data[address][0]
-            scanned_adv = devices_and_adv_data[address][1]
-            if adr in self.seen_devices:
-                # Known device, update information:
-                dev = self.seen_devices[adr]
-                dev.last_seen = t
-                dev.name = scanned_dev.name
-                dev.rssi = scanned_adv.rssi
-                dev.state = SeenDeviceState.RECENTLY_SEEN
-            else:
-                # Unknown device, check if name matches:
-                for regex in self.name_regexes:
-                    if(scanned_dev.name is None):
-                        continue
-                    if re.match(regex, scanned_dev.name):
-                        # It does, add the new device:
-                        new_dev = SeenDevice(
-                            adr=adr,
-                            alias=self.config.device_aliases.get(adr, None),
-                            state=SeenDeviceState.RECENTLY_SEEN,
-                            name=scanned_dev.name,
-                            last_seen=t,
-                            rssi=scanned_adv.rssi,
-                        )
-                        self.seen_devices[adr] = new_dev
-                        self.log.info(f"New device found: {new_dev.get_id()}({new_dev.adr})")
-            # Check for seen-recently timeouts:
-            for dev in self.seen_devices.values():
-                if dev.state == SeenDeviceState.RECENTLY_SEEN:
-                    if dev.last_seen is not None:
-                        has_been = (time.monotonic_ns() - dev.last_seen)/1e9
-                        if has_been > self.config.seen_timeout:
-                            dev.state = SeenDeviceState.NOT_SEEN
-        
\ No newline at end of file
+    def _detection_callback(self, device, advertisement_data):
+        t = time.monotonic_ns()
+        adr = self.config.normalise(device.address)
+        dev, is_new = self.registry.observe(adr, device.name, advertisement_data.rssi, t)
+        if dev is not None:
+            if is_new:
+                self.log.info(f"New device found: {dev.get_id()}({dev.adr})")
+            self._report_device(dev)
+
+    def _report_device(self, dev: SeenDevice):
+        if not self.scanning or dev.adr in self.reported:
+            return
+        self.reported.add(dev.adr)
+        self.scanned_devices.append(dev)
+        if self.on_device is not None:
+            self.on_device(dev)
+        if dev.adr in self.wanted:
+            self.wanted.discard(dev.adr)
+            if not self.wanted:
+                self.all_found.set()
@@ -0,0 +1,352 @@
+"""
+Sharded acquisition: the devices of a recording are split across worker processes.
+
+Every worker runs its own asyncio loop with a ConnectionManager (and with it, the connections and
+decode stage) for its share of the devices. Decoded sample blocks are passed to the main process
+through a SharedBlockQueue per worker, connection state changes and log records through a
+multiprocessing queue. In the main process, the ShardManager takes the place of the
+ConnectionManager: it hands the blocks to the Stream and the consumers as if they had been
+decoded locally, and restarts workers that exit unexpectedly, without ending the session.
+
+Enabled with 'acquisition_shards' in config.py. Workers create their own BLE backend from the
+configuration, and keep the connection history of their devices to themselves.
+"""
+import math
+import time
+import asyncio
+import logging
+import logging.handlers
+import dataclasses
+import multiprocessing
+import numpy as np
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Dict, List, Tuple, Union
+from .datatypes import Configuration, NotifData, SeenDevice
+from .observer import Signal
+
+HEADER_BYTES = 64
+META_FIELDS = 4     # device index, characteristic index, rows, columns
+
+
+class SharedBlockQueue:
+    """
+    Single-producer, single-consumer ring of sample blocks in shared memory.
+
+    The header holds the number of blocks written (head) and read (tail). Every slot holds the
+    block metadata, and up to 'max_rows' rows of 'columns' float64 values with an int64 bitmask
+    per row of the columns that were ints before, see int_columns(). The writer fills a slot
+    before advancing head, the reader copies a slot before advancing tail, so neither side ever
+    sees a partially written block.
+    """
+    def __init__(self, shm: SharedMemory, slots: int, max_rows: int, columns: int, owner: bool):
+        self.shm = shm
+        self.slots = slots
+        self.max_rows = max_rows
+        self.columns = columns
+        self.owner = owner
+        self.dropped = 0
+        self.counters = np.ndarray((2,), dtype=np.int64, buffer=shm.buf)
+        slot_bytes = META_FIELDS * 8 + max_rows * (columns + 1) * 8
+        self.meta = np.ndarray((slots, META_FIELDS), dtype=np.int64, buffer=shm.buf, offset=HEADER_BYTES,
+                               strides=(slot_bytes, 8))
+        self.int_masks = np.ndarray((slots, max_rows), dtype=np.int64, buffer=shm.buf,
+                                    offset=HEADER_BYTES + META_FIELDS * 8, strides=(slot_bytes, 8))
+        self.data = np.ndarray((slots, max_rows, columns), dtype=np.float64, buffer=shm.buf,
+                               offset=HEADER_BYTES + META_FIELDS * 8 + max_rows * 8, strides=(slot_bytes, columns * 8, 8))
+
+    @staticmethod
+    def size(slots: int, max_rows: int, columns: int) -> int:
+        return HEADER_BYTES + slots * (META_FIELDS * 8 + max_rows * (columns + 1) * 8)
+
+    @classmethod
+    def create(cls, slots: int, max_rows: int, columns: int) -> 'SharedBlockQueue':
+        shm = SharedMemory(create=True, size=cls.size(slots, max_rows, columns))
+        queue = cls(shm, slots, max_rows, columns, owner=True)
+        queue.counters[:] = 0
+        return queue
+
+    @classmethod
+    def attach(cls, name: str, slots: int, max_rows: int, columns: int) -> 'SharedBlockQueue':
+        # Workers are spawned and share the resource tracker of the main process, which
+        # unlinks the segment when the main process closes the queue
+        shm = SharedMemory(name=name)
+        return cls(shm, slots, max_rows, columns, owner=False)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def layout(self) -> Tuple[int, int, int]:
+        return self.slots, self.max_rows, self.columns
+
+    def put(self, device: int, char: int, rows: np.ndarray, int_masks: np.ndarray) -> bool:
+        """Write a block, split across several slots if needed. Returns False if (part of) it was dropped."""
+        for start in range(0, len(rows), self.max_rows):
+            head, tail = int(self.counters[0]), int(self.counters[1])
+            if head - tail >= self.slots:
+                self.dropped += 1
+                return False
+            part = rows[start:start + self.max_rows]
+            i = head % self.slots
+            self.data[i, :len(part), :part.shape[1]] = part
+            self.int_masks[i, :len(part)] = int_masks[start:start + self.max_rows]
+            self.meta[i] = (device, char, len(part), part.shape[1])
+            self.counters[0] = head + 1
+        return True
+
+    def get_all(self) -> List[Tuple[int, int, np.ndarray, np.ndarray]]:
+        """Read all blocks that are currently available, as (device index, characteristic index, rows, int masks)."""
+        head, tail = int(self.counters[0]), int(self.counters[1])
+        blocks = []
+        while tail < head:
+            i = tail % self.slots
+            device, char, n_rows, n_cols = (int(x) for x in self.meta[i])
+            blocks.append((device, char, self.data[i, :n_rows, :n_cols].copy(), self.int_masks[i, :n_rows].copy()))
+            tail += 1
+        self.counters[1] = tail
+        return blocks
+
+    def close(self) -> None:
+        # Drop the views before closing the mapping
+        self.counters = self.meta = self.int_masks = self.data = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def int_columns(rows: List[List[Any]]) -> np.ndarray:
+    """Bitmask per decoded row of the columns holding ints (bit j for column j)"""
+    masks = np.empty(len(rows), dtype=np.int64)
+    known = {}  # type: Dict[tuple, int]
+    for k, row in enumerate(rows):
+        types = tuple(map(type, row))
+        mask = known.get(types)
+        if mask is None:
+            mask = known[types] = sum(1 << j for j, t in enumerate(types) if t is int)
+        masks[k] = mask
+    return masks
+
+
+def restore_ints(rows: np.ndarray, int_masks: np.ndarray) -> List[List[Any]]:
+    """Decoded rows as lists, with the columns that were ints (see int_columns) converted back"""
+    data = rows.astype(object)
+    for mask in np.unique(int_masks):
+        if not mask:
+            continue
+        selected = np.ix_(int_masks == mask, [j for j in range(rows.shape[1]) if int(mask) >> j & 1])
+        data[selected] = rows[selected].astype(np.int64)
+    return data.tolist()
+
+
+class _ControlQueueHandler(logging.handlers.QueueHandler):
+    """Forwards the log records of a worker to the main process through its control queue."""
+    def enqueue(self, record: logging.LogRecord) -> None:
+        self.queue.put_nowait(('log', record))
+
+
+def _run_worker(config: Configuration, index: int, devices: List[SeenDevice], ring_name: str,
+                ring_layout: Tuple[int, int, int], control_queue, stop_event, data_path, log_level: int) -> None:
+    """Entry point of a worker process."""
+    log = logging.getLogger('log')
+    log.handlers = [_ControlQueueHandler(control_queue)]
+    log.setLevel(log_level)
+    log.propagate = False
+    asyncio.run(_worker_main(config, index, devices, ring_name, ring_layout, control_queue, stop_event, data_path))
+
+
+async def _worker_main(config: Configuration, index: int, devices: List[SeenDevice], ring_name: str,
+                       ring_layout: Tuple[int, int, int], control_queue, stop_event, data_path) -> None:
+    from .blebackend import create_backend
+    from .capture import CaptureWriter
+    from .connectionmanager import ConnectionManager
+
+    log = logging.getLogger('log')
+    halt_event = asyncio.Event()
+    ring = SharedBlockQueue.attach(ring_name, *ring_layout)
+    device_index = {d.adr: i for i, d in enumerate(devices)}
+    char_index = {c.uuid: i for i, c in enumerate(config.characteristics)}
+    output_queue = asyncio.Queue()
+
+    capture = None
+    if config.capture_raw:
+        capture = CaptureWriter(config, data_path=data_path, tag=f'shard{index}')
+    manager = ConnectionManager(config, halt_event, {d.get_id(): d for d in devices}, output_queue, None,
+                                capture=capture, backend=create_backend(config))
+    manager.connect_state.connect(lambda name, state: control_queue.put_nowait(('state', name, state)))
+
+    async def watch_stop_event():
+        while not halt_event.is_set():
+            if stop_event.is_set():
+                halt_event.set()
+            try:
+                await asyncio.wait_for(halt_event.wait(), timeout=0.1)
+            except asyncio.TimeoutError:
+                pass
+
+    async def forward_blocks():
+        reported_drops = 0
+        while not halt_event.is_set() or not output_queue.empty():
+            try:
+                data = await asyncio.wait_for(output_queue.get(), timeout=0.5)  # type: NotifData
+            except asyncio.TimeoutError:
+                continue
+            ring.put(device_index[data.device_adr], char_index[data.characteristic.uuid],
+                     np.asarray(data.data, dtype=np.float64), int_columns(data.data))
+            if ring.dropped > reported_drops:
+                log.warning(f'Shard {index}: Shared block queue full, dropped {ring.dropped - reported_drops} blocks')
+                reported_drops = ring.dropped
+
+    tasks = [asyncio.create_task(watch_stop_event()), asyncio.create_task(forward_blocks())]
+    try:
+        await manager.run()
+    finally:
+        halt_event.set()
+        await asyncio.gather(*tasks)
+        ring.close()
+
+
+class _Shard:
+    def __init__(self, index: int, devices: List[SeenDevice], ring: SharedBlockQueue):
+        self.index = index
+        self.devices = devices
+        self.ring = ring
+        self.process = None  # type: Union[multiprocessing.Process, None]
+        self.control_queue = None
+        self.stop_event = None
+        self.connected = set()
+        self.restarts = 0
+        self.restart_at = None  # type: Union[float, None]
+
+
+class ShardManager:
+    """Runs the connections of a recording in 'acquisition_shards' worker processes."""
+    # Global state signal, only emitted when the connection state of a device changes,
+    # with (device_name, state)
+    connect_state = Signal()
+
+    def __init__(self, config: Configuration, halt_event: asyncio.Event, devices: Dict[str, SeenDevice], output_queue: asyncio.Queue,
+                 callback: Callable, data_path=None):
+        self.log = logging.getLogger('log')
+        self.config = config
+        self.halt_event = halt_event
+        self.devices = devices
+        self.output_queue = output_queue
+        self.callback = callback
+        self.data_path = data_path
+        self.context = multiprocessing.get_context('spawn')
+        self.shards = []  # type: List[_Shard]
+        # Connections are divided evenly between the workers
+        n = max(1, min(config.acquisition_shards, len(devices)))
+        self.worker_config = dataclasses.replace(
+            config,
+            max_active_connections=math.ceil(config.max_active_connections / n),
+            max_simultaneous_connection_attempts=math.ceil(config.max_simultaneous_connection_attempts / n))
+        self.columns = max(len(c.column_headers) for c in config.characteristics)
+
+    async def run(self):
+        self.log.info(f'Shard manager started')
+        devices = sorted(self.devices.values(), key=lambda d: d.get_id())
+        n = max(1, min(self.config.acquisition_shards, len(devices)))
+        for i in range(n):
+            ring = SharedBlockQueue.create(self.config.shard_queue_slots, self.config.shard_block_rows, self.columns)
+            shard = _Shard(i, devices[i::n], ring)
+            self.shards.append(shard)
+            self._start(shard)
+
+        try:
+            while not self.halt_event.is_set():
+                self._poll()
+                self._supervise()
+                try:
+                    await asyncio.wait_for(self.halt_event.wait(), timeout=self.config.decode_interval)
+                except asyncio.TimeoutError:
+                    pass
+        except Exception as e:
+            self.log.error(f'Shard manager encountered an exception: {e}')
+            self.halt_event.set()
+        finally:
+            for shard in self.shards:
+                shard.stop_event.set()
+            await asyncio.gather(*[asyncio.to_thread(self._join, shard) for shard in self.shards])
+            # Pass on the blocks decoded while shutting down
+            self._poll()
+            for shard in self.shards:
+                for name in list(shard.connected):
+                    self._set_connected(shard, name, False)
+                shard.ring.close()
+            self.shards = []
+            self.log.info('Shard manager shut down')
+
+    def _start(self, shard: _Shard) -> None:
+        shard.control_queue = self.context.Queue()
+        shard.stop_event = self.context.Event()
+        shard.process = self.context.Process(
+            target=_run_worker,
+            args=(self.worker_config, shard.index, shard.devices, shard.ring.name, shard.ring.layout(),
+                  shard.control_queue, shard.stop_event, self.data_path, self.log.getEffectiveLevel()),
+            name=f'Acquisition Shard {shard.index}',
+            daemon=True)
+        shard.process.start()
+        shard.restart_at = None
+        self.log.info(f'Started shard {shard.index} for {[d.get_id() for d in shard.devices]}')
+
+    def _join(self, shard: _Shard) -> None:
+        shard.process.join(timeout=self.config.connect_timeout + 10)
+        if shard.process.is_alive():
+            self.log.warning(f'Shard {shard.index} did not shut down, terminating it')
+            shard.process.terminate()
+            shard.process.join()
+
+    def _supervise(self) -> None:
+        # Restart workers that exited on their own, e.g. after a crash
+        now = time.monotonic()
+        for shard in self.shards:
+            if shard.process.is_alive():
+                continue
+            if shard.restart_at is None:
+                self._drain_control_queue(shard)
+                for name in list(shard.connected):
+                    self._set_connected(shard, name, False)
+                shard.restarts += 1
+                shard.restart_at = now + self.config.shard_restart_delay
+                self.log.error(f'Shard {shard.index} exited unexpectedly (exit code {shard.process.exitcode}), '
+                               f'restarting in {self.config.shard_restart_delay}s...')
+            elif now >= shard.restart_at:
+                self._start(shard)
+
+    def _poll(self) -> None:
+        for shard in self.shards:
+            self._drain_control_queue(shard)
+            for device, char_index, rows, int_masks in shard.ring.get_all():
+                dev = shard.devices[device]
+                name = dev.get_id()
+                char = self.config.characteristics[char_index]
+                # Rows are passed as floats, write the integer columns to the CSV as ints again
+                data = restore_ints(rows, int_masks)
+                if self.callback:
+                    self.callback(dev.adr, name, rows)
+                try:
+                    self.output_queue.put_nowait(NotifData(dev.adr, name, char, data))
+                except asyncio.QueueFull:
+                    self.log.error(f"{name} failed to put data into queue")
+
+    def _drain_control_queue(self, shard: _Shard) -> None:
+        while True:
+            try:
+                message = shard.control_queue.get_nowait()
+            except Exception:
+                # Empty, or unreadable after the worker crashed
+                return
+            if message[0] == 'log':
+                self.log.handle(message[1])
+            elif message[0] == 'state':
+                self._set_connected(shard, message[1], message[2])
+
+    def _set_connected(self, shard: _Shard, name: str, connected: bool) -> None:
+        if connected == (name in shard.connected):
+            return
+        if connected:
+            shard.connected.add(name)
+        else:
+            shard.connected.discard(name)
+        self.connect_state.emit(name, connected)
@@ -0,0 +1,239 @@
+"""
+Export of the per-device sample buffers of a Stream as shared memory, for local processes.
+
+With 'shm_export' enabled, every streamed device gets a named shared memory segment holding a
+ring of its most recent scaled rows, and an index segment ('<shm_prefix>index') lists the devices
+and their segments. Each device segment starts with a header of int64 fields:
+
+    seq             seqlock counter, odd while the writer is updating the ring
+    write_index     total number of rows written; row i is at ring position i % capacity
+    reserve_index   write_index plus the rows currently being written
+    capacity        rows in the ring
+    columns         values per row
+    layout_bytes    length of the column layout
+
+followed by the column layout (JSON list of column names) and the float64 ring. There is only
+one writer (the Stream); any number of readers can attach without affecting it.
+
+Readers use SharedBufferReader:
+
+    reader = SharedBufferReader.attach('Sim00')
+    start, rows = reader.read(500, out)     # consistent copy of the last 500 rows into 'out'
+    start, views = reader.window(500)       # zero-copy views of the ring (one or two parts)
+    ...                                     # use the views
+    if reader.valid(start): ...             # the rows were not overwritten in the meantime
+
+A view taken with window() stays valid until the writer has written 'capacity' more rows, so
+windows much smaller than the ring can be processed in place and validated afterwards. Both
+raise TimeoutError if the writer stopped in the middle of an update (seq stays odd).
+"""
+import re
+import json
+import time
+import logging
+import numpy as np
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, List, Tuple, Union
+from .datatypes import Configuration
+
+MAGIC = b'HLSHM\x00\x01\x00'
+HEADER_FIELDS = 6
+SEQ, WRITE_INDEX, RESERVE_INDEX, CAPACITY, COLUMNS, LAYOUT_BYTES = range(HEADER_FIELDS)
+HEADER_BYTES = 64
+DEFAULT_PREFIX = 'hlimu_'
+# Time, in seconds, a reader waits for the writer to finish an update:
+WRITER_TIMEOUT = 1.0
+
+# Segments created by this process, registered with the resource tracker to be unlinked on exit
+_created = set()
+
+
+def segment_name(prefix: str, device_name: str) -> str:
+    return prefix + re.sub(r'[^A-Za-z0-9_]', '_', device_name)
+
+
+def _create(name: str, size: int) -> SharedMemory:
+    try:
+        shm = SharedMemory(name=name, create=True, size=size)
+    except FileExistsError:
+        # Left over from a session that did not shut down cleanly
+        stale = SharedMemory(name=name)
+        stale.close()
+        stale.unlink()
+        shm = SharedMemory(name=name, create=True, size=size)
+    _created.add(shm._name)
+    return shm
+
+
+def _attach(name: str) -> SharedMemory:
+    # Readers must not unlink the segments of the writer when they exit
+    try:
+        return SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13, every attach is registered with the resource tracker. The
+        # registration of a segment created by this process is the writer's own, and kept.
+        shm = SharedMemory(name=name)
+        if shm._name not in _created:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class SharedDeviceBuffer:
+    """Ring of the rows of one device in a shared memory segment, see the module documentation"""
+    def __init__(self, shm: SharedMemory, owner: bool):
+        self.shm = shm
+        self.owner = owner
+        if bytes(shm.buf[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f'{shm.name} is not a shared device buffer')
+        self.header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf, offset=len(MAGIC))
+        self.capacity = int(self.header[CAPACITY])
+        self.columns = int(self.header[COLUMNS])
+        layout_bytes = int(self.header[LAYOUT_BYTES])
+        self.column_names = json.loads(bytes(shm.buf[HEADER_BYTES:HEADER_BYTES + layout_bytes]))  # type: List[str]
+        self.data = np.ndarray((self.capacity, self.columns), dtype=np.float64, buffer=shm.buf,
+                               offset=self._data_offset(layout_bytes))
+
+    @staticmethod
+    def _data_offset(layout_bytes: int) -> int:
+        return HEADER_BYTES + (layout_bytes + 7) // 8 * 8
+
+    @classmethod
+    def create(cls, name: str, capacity: int, column_names: List[str]) -> 'SharedDeviceBuffer':
+        layout = json.dumps(column_names).encode()
+        size = cls._data_offset(len(layout)) + capacity * len(column_names) * 8
+        shm = _create(name, size)
+        shm.buf[HEADER_BYTES:HEADER_BYTES + len(layout)] = layout
+        header = np.ndarray((HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf, offset=len(MAGIC))
+        header[:] = (0, 0, 0, capacity, len(column_names), len(layout))
+        del header
+        # Written last, readers do not accept the segment before it is initialised
+        shm.buf[:len(MAGIC)] = MAGIC
+        return cls(shm, owner=True)
+
+    def write(self, rows: np.ndarray) -> None:
+        n = len(rows)
+        w = int(self.header[WRITE_INDEX])
+        self.header[SEQ] += 1
+        self.header[RESERVE_INDEX] = w + n
+        rows = rows[-self.capacity:]
+        start = (w + n - len(rows)) % self.capacity
+        first = min(len(rows), self.capacity - start)
+        self.data[start:start + first] = rows[:first]
+        self.data[:len(rows) - first] = rows[first:]
+        self.header[WRITE_INDEX] = w + n
+        self.header[SEQ] += 1
+
+    def close(self) -> None:
+        # Drop the views before closing the mapping
+        self.header = self.data = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+            _created.discard(self.shm._name)
+
+
+class SharedBufferReader(SharedDeviceBuffer):
+    """Read side of a SharedDeviceBuffer, for use in other processes"""
+    @classmethod
+    def attach(cls, device_name: str, prefix: str = DEFAULT_PREFIX) -> 'SharedBufferReader':
+        return cls(_attach(segment_name(prefix, device_name)), owner=False)
+
+    @property
+    def write_index(self) -> int:
+        return int(self.header[WRITE_INDEX])
+
+    def _stable_seq(self) -> int:
+        deadline = None
+        while True:
+            seq = int(self.header[SEQ])
+            if seq % 2 == 0:
+                return seq
+            # A write takes microseconds, an update that does not finish was left by a dead writer
+            if deadline is None:
+                deadline = time.monotonic() + WRITER_TIMEOUT
+            elif time.monotonic() > deadline:
+                raise TimeoutError(f'{self.shm.name}: the writer did not finish its update')
+            time.sleep(0)
+
+    def window(self, n: int) -> Tuple[int, List[np.ndarray]]:
+        """
+        Zero-copy views of the last n rows (at most capacity), as the stream index of the first
+        row and one or two views of the ring, in order. Check valid(start) after using them.
+        """
+        while True:
+            seq = self._stable_seq()
+            end = int(self.header[WRITE_INDEX])
+            if int(self.header[SEQ]) == seq:
+                break
+        n = min(n, end, self.capacity)
+        start = end - n
+        i = start % self.capacity
+        if i + n <= self.capacity:
+            return start, [self.data[i:i + n]]
+        return start, [self.data[i:], self.data[:i + n - self.capacity]]
+
+    def valid(self, start: int) -> bool:
+        """True if the rows from stream index 'start' on have not been overwritten"""
+        return int(self.header[RESERVE_INDEX]) - self.capacity <= start
+
+    def read(self, n: int, out: np.ndarray = None) -> Tuple[int, np.ndarray]:
+        """
+        Consistent copy of the last n rows, into 'out' if given (shape [n, columns] or larger),
+        as the stream index of the first row and the rows.
+        """
+        if out is None:
+            out = np.empty((min(n, self.capacity), self.columns))
+        while True:
+            start, views = self.window(min(n, len(out)))
+            i = 0
+            for v in views:
+                out[i:i + len(v)] = v
+                i += len(v)
+            if self.valid(start):
+                return start, out[:i]
+
+
+class SharedBufferExport:
+    """Writer side, owned by the Stream: one SharedDeviceBuffer per device, plus the index"""
+    def __init__(self, config: Configuration, device_names: List[str], column_names: List[str]):
+        self.log = logging.getLogger('log')
+        self.prefix = config.shm_prefix
+        self.buffers = {}  # type: Dict[str, SharedDeviceBuffer]
+        self.index = None  # type: Union[SharedMemory, None]
+        try:
+            for name in device_names:
+                self.buffers[name] = SharedDeviceBuffer.create(segment_name(self.prefix, name), config.shm_buffer_rows, column_names)
+            index = json.dumps({name: b.shm.name for name, b in self.buffers.items()}).encode()
+            self.index = _create(self.prefix + 'index', len(index) + 8)
+            self.index.buf[:8] = len(index).to_bytes(8, 'little')
+            self.index.buf[8:8 + len(index)] = index
+        except Exception:
+            self.close()
+            raise
+        self.log.info(f'Exporting {len(self.buffers)} device buffers to shared memory ({self.prefix}*)')
+
+    def write(self, name: str, data: np.ndarray) -> None:
+        """Block listener of the Stream"""
+        buffer = self.buffers.get(name)
+        if buffer is not None:
+            buffer.write(data)
+
+    def close(self) -> None:
+        for buffer in self.buffers.values():
+            buffer.close()
+        self.buffers = {}
+        if self.index is not None:
+            self.index.close()
+            self.index.unlink()
+            self.index = None
+
+
+def list_devices(prefix: str = DEFAULT_PREFIX) -> Dict[str, str]:
+    """Device names of the running export, with their segment names"""
+    shm = _attach(prefix + 'index')
+    try:
+        length = int.from_bytes(shm.buf[:8], 'little')
+        return json.loads(bytes(shm.buf[8:8 + length]))
+    finally:
+        shm.close()
@@ -0,0 +1,227 @@
+"""
+In-process simulation of motion trackers, to test the acquisition pipeline with many devices
+and without any Bluetooth hardware. Select it with ble_backend='simulator' in config.py.
+
+Every simulated tracker advertises 'SimulatorSettings.name' while it is not connected, accepts the
+writes to the ctrl_characteristics and, once notifications are enabled, sends IMU (type 0),
+quaternion (type 1) and magnetometer (type 2) packets in the format expected by decode_data.
+The tracker slowly rotates about the vertical axis, with noise on the IMU readings. Notification
+loss and latency, failing connection attempts and random disconnects are configurable.
+
+As all trackers advertise the same name, every simulated address gets an alias (Sim00, Sim01, ...).
+with_simulated_aliases() returns a copy of the configuration with these aliases added, which
+backend_config() in blebackend.py applies for ble_backend='simulator'.
+"""
+import math
+import random
+import struct
+import asyncio
+import logging
+import dataclasses
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Set, Union
+from bleak.exc import BleakDeviceNotFoundError, BleakError
+from .blebackend import BLEBackend
+from .datatypes import Configuration, SimulatorSettings
+from .decoders import ACC_SCALING, GYRO_SCALING
+
+IMU_PACKET = struct.Struct('<BI6h')
+QUAT_PACKET = struct.Struct('<BI4e')
+MAG_PACKET = struct.Struct('<BI3h')
+
+
+@dataclass
+class SimulatedBLEDevice:
+    """Stand-in for bleak's BLEDevice, as passed to the detection callback."""
+    address: str
+    name: str
+
+
+@dataclass
+class SimulatedAdvertisement:
+    rssi: int
+
+
+@dataclass
+class SimulatedTracker:
+    adr: str
+    name: str
+    rssi: int
+    # Rotation rate about the vertical axis [rad/s] and initial heading [rad]:
+    rotation_rate: float
+    heading: float
+    connected: bool = False
+    ctrl_writes: List[bytes] = field(default_factory=list)
+    # Number of samples sent since power on, determines the device timestamp:
+    sample_index: int = 0
+
+    def next_sample(self, s: SimulatorSettings) -> bytearray:
+        """Packets of the next IMU sample, followed by quaternion and magnetometer packets if due."""
+        i = self.sample_index
+        self.sample_index += 1
+        t = i / s.sample_rate
+        timestamp = int(t * 1000) & 0xFFFFFFFF
+        heading = self.heading + self.rotation_rate * t
+
+        # Gravity on z and the rotation about z, plus sensor noise
+        gyro = [random.gauss(0, 0.01), random.gauss(0, 0.01), self.rotation_rate + random.gauss(0, 0.01)]
+        acc = [random.gauss(0, 0.05), random.gauss(0, 0.05), 9.81 + random.gauss(0, 0.05)]
+        packet = bytearray(IMU_PACKET.pack(0, timestamp,
+                                           *[_clip(g / GYRO_SCALING) for g in gyro],
+                                           *[_clip(a / ACC_SCALING) for a in acc]))
+        if i % s.quat_divider == 0:
+            packet += QUAT_PACKET.pack(1, timestamp, 0.0, 0.0, math.sin(heading / 2), math.cos(heading / 2))
+        if i % s.mag_divider == 0:
+            # Horizontal field component pointing north, seen from the rotated sensor
+            packet += MAG_PACKET.pack(2, timestamp, _clip(400 * math.cos(heading)), _clip(-400 * math.sin(heading)), _clip(-300))
+        return packet
+
+
+def simulated_address(i: int) -> str:
+    return f'5E:00:00:00:{i >> 8:02X}:{i & 0xFF:02X}'
+
+
+def with_simulated_aliases(config: Configuration) -> Configuration:
+    """Copy of the configuration with an alias for every simulated tracker, configured aliases take precedence"""
+    aliases = {simulated_address(i): f'Sim{i:02d}' for i in range(config.simulator.devices)}
+    return dataclasses.replace(config, device_aliases={**aliases, **config.device_aliases})
+
+
+class Simulator(BLEBackend):
+    def __init__(self, config: Configuration):
+        self.log = logging.getLogger('log')
+        self.config = config
+        self.settings = config.simulator
+        self.trackers = {}  # type: Dict[str, SimulatedTracker]
+        for i in range(self.settings.devices):
+            adr = simulated_address(i)
+            self.trackers[adr] = SimulatedTracker(
+                adr=adr,
+                name=self.settings.name,
+                rssi=random.randint(-90, -40),
+                rotation_rate=random.uniform(-1, 1),
+                heading=random.uniform(-math.pi, math.pi),
+            )
+
+    def addresses(self) -> Set[str]:
+        return set(self.trackers)
+
+    def create_scanner(self, detection_callback: Callable) -> 'SimulatedScanner':
+        return SimulatedScanner(self, detection_callback)
+
+    def create_client(self, adr: str, timeout: float = None, disconnected_callback: Callable = None, **kwargs) -> 'SimulatedClient':
+        return SimulatedClient(self, self.config.normalise(adr), disconnected_callback)
+
+
+class SimulatedScanner:
+    def __init__(self, simulator: Simulator, detection_callback: Callable):
+        self.simulator = simulator
+        self.detection_callback = detection_callback
+        self.task = None
+
+    async def start(self) -> None:
+        self.task = asyncio.create_task(self._advertise(), name='Simulated Scanner Task')
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def _advertise(self) -> None:
+        # Connected trackers do not advertise
+        while True:
+            for tracker in self.simulator.trackers.values():
+                if not tracker.connected:
+                    rssi = tracker.rssi + random.randint(-5, 5)
+                    self.detection_callback(SimulatedBLEDevice(tracker.adr, tracker.name), SimulatedAdvertisement(rssi))
+            await asyncio.sleep(self.simulator.settings.advertising_interval)
+
+
+class SimulatedClient:
+    def __init__(self, simulator: Simulator, adr: str, disconnected_callback: Union[Callable, None]):
+        self.simulator = simulator
+        self.settings = simulator.settings
+        self.adr = adr
+        self.tracker = simulator.trackers.get(adr)
+        self.disconnected_callback = disconnected_callback
+        self.callbacks = {}  # type: Dict[str, Callable]
+        self.tasks = []  # type: List[asyncio.Task]
+        self.is_connected = False
+        # Delivery time [monotonic s] of the last notification, to keep notifications in order
+        self.last_delivery = 0.0
+
+    async def connect(self) -> bool:
+        if self.tracker is None:
+            raise BleakDeviceNotFoundError(self.adr)
+        await asyncio.sleep(self.settings.connect_latency * random.uniform(0.5, 1.5))
+        if self.tracker.connected:
+            raise BleakError(f'{self.adr} is already connected')
+        if random.random() < self.settings.connect_failure_rate:
+            raise BleakError(f'Simulated connection failure for {self.adr}')
+        self.tracker.connected = True
+        self.is_connected = True
+        if self.settings.mean_time_between_disconnects is not None:
+            self.tasks.append(asyncio.create_task(self._random_disconnect()))
+        return True
+
+    async def write_gatt_char(self, uuid: str, data: bytes) -> None:
+        self._check_connected()
+        uuid = self.simulator.config.normalise(uuid)
+        if uuid not in [c for c, _ in self.simulator.config.ctrl_characteristics]:
+            raise BleakError(f'Characteristic {uuid} not found')
+        self.tracker.ctrl_writes.append(bytes(data))
+
+    async def start_notify(self, uuid: str, callback: Callable) -> None:
+        self._check_connected()
+        uuid = self.simulator.config.normalise(uuid)
+        self.simulator.config.get_characteristic(uuid)
+        self.callbacks[uuid] = callback
+        self.tasks.append(asyncio.create_task(self._stream(callback)))
+
+    async def disconnect(self) -> bool:
+        self._drop_connection()
+        return True
+
+    def _check_connected(self) -> None:
+        if not self.is_connected:
+            raise BleakError(f'Not connected to {self.adr}')
+
+    def _drop_connection(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+        if self.is_connected:
+            self.is_connected = False
+            self.tracker.connected = False
+
+    async def _random_disconnect(self) -> None:
+        await asyncio.sleep(random.expovariate(1 / self.settings.mean_time_between_disconnects))
+        self._drop_connection()
+        if self.disconnected_callback is not None:
+            self.disconnected_callback(self)
+
+    async def _stream(self, callback: Callable) -> None:
+        loop = asyncio.get_running_loop()
+        s = self.settings
+        interval = s.samples_per_notification / s.sample_rate
+        next_time = loop.time()
+        while True:
+            payload = bytearray()
+            for _ in range(s.samples_per_notification):
+                payload += self.tracker.next_sample(s)
+            if random.random() >= s.packet_loss:
+                # Deliver after the simulated latency, but never overtake an earlier notification
+                delivery = max(self.last_delivery, loop.time() + s.latency + random.uniform(-1, 1) * s.latency_jitter)
+                self.last_delivery = delivery
+                loop.call_at(delivery, self._deliver, callback, payload)
+            # Sleep until the next notification is due, without accumulating drift
+            next_time += interval
+            await asyncio.sleep(max(0.0, next_time - loop.time()))
+
+    def _deliver(self, callback: Callable, payload: bytearray) -> None:
+        if self.is_connected:
+            callback(0, payload)
+
+
+def _clip(x: float) -> int:
+    return max(-32768, min(32767, int(round(x))))
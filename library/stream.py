@@ -1,105 +1,187 @@
-import math
 import asyncio
 import logging
 import numpy as np
-from typing import Dict
-from bleak import BLEDevice
+from typing import Callable, Dict, List, Tuple
 from collections import deque
-from PySide6.QtCore import QObject, Signal
 from .consumermanager import ConsumerManager
 from .connectionmanager import ConnectionManager
-from .csvlogger import CSVLogger
-from .datatypes import Configuration
+from .blebackend import BLEBackend, create_backend
+from .decoders import SCALING_FACTORS
+from .features import FeatureEngine
+from .observer import Signal
+from .tracing import tracer
+from .datatypes import Configuration, SeenDevice
 
+_HANDLE = tracer.site('handle_new_data', 'stream')
 
-class Stream(QObject):
+
+class Stream:
     """This class is used to handle the data stream from the IMU devices"""
-    new_data = Signal(str, arguments=['device_name'])
+    # Emitted with the device_name for every new block of data
+    new_data = Signal()
     
-    def __init__(self, config: Configuration, halt_event: asyncio.Event, output_queues: Dict[str, deque]): 
-        super().__init__()
+    def __init__(self, config: Configuration, halt_event: asyncio.Event, output_queues: Dict[str, deque], backend: BLEBackend = None): 
         self.log = logging.getLogger('log')
         
         self.config = config
         self.halt_event = halt_event
         self.output_queues = output_queues
+        # BLE backend used to connect to the devices, see blebackend.py:
+        self.backend = backend if backend is not None else create_backend(config)
         
-        self.devices = {}   # type: Dict[str, BLEDevice]
+        self.devices = {}   # type: Dict[str, SeenDevice]
+        self.feature_engines = {}   # type: Dict[str, FeatureEngine]
+        self.sample_counts = {}     # type: Dict[str, int]
         self.consumer_manager = None
         self.connection_manager = None
         self.consumer_manager_task = None
         self.connection_manager_task = None
+        self.server = None
+        self.server_task = None
+        self.shared_export = None
+        # Called with (device name, scaled data) for every new block, see handle_new_data:
+        self.block_listeners = []  # type: List[Callable[[str, np.ndarray], None]]
         
-        acc_fs = 4
-        gyro_fs = 1000
-        gyro_scaling = 2**-15 * 1.13 * math.pi / 180 * gyro_fs
-        acc_scaling = 2**-15 * 9.81 * acc_fs
-        self.scaling_factors = np.array([
-            1,                  # System timestamp [s]
-            1e-3,               # IMU timestamp [s]
-            gyro_scaling,       # gyro_x [rad/s]
-            gyro_scaling,       # gyro_y [rad/s]
-            gyro_scaling,       # gyro_z [rad/s]
-            acc_scaling,        # acc_x [m/s^2]
-            acc_scaling,        # acc_y [m/s^2]
-            acc_scaling,        # acc_z [m/s^2]
-            1, 1, 1, 1,         # q_x, q_y, q_z, q_w
-            1, 1, 1             # mag_x, mag_y, mag_z
-        ])
+        # Unit conversions of the data columns, see decoders.py
+        self.scaling_factors = SCALING_FACTORS
+        self.data_path = None
 
     def setup_stream(self, checked_devices, data_path=None):
         self.log.info("Setting up IMU data stream")
         self.consumer_manager = ConsumerManager(self.config, self.halt_event)
         
+        # Optional outputs are imported when they are enabled, to keep imports of the library fast
         if self.config.output_csv:
+            from .csvlogger import CSVLogger
             self.log.info("Streaming data to CSV")
             consumer = CSVLogger(self.config, self.halt_event, data_path=data_path)
             self.consumer_manager.add_consumer(consumer)
+        if self.config.output_udp:
+            from .udpstream import UDPStreamer
+            self.log.info(f"Streaming data to udp://{self.config.udp_address}:{self.config.udp_port}")
+            self.consumer_manager.add_consumer(UDPStreamer(self.config, self.halt_event))
+
             
         for device_name in checked_devices:          
             # Set up device and add to list
             device = checked_devices[device_name][0]
             self.output_queues[device_name] = deque(maxlen=self.config.buffer_size)
+            self.sample_counts[device_name] = 0
+            if self.config.feature_windows:
+                self.feature_engines[device_name] = FeatureEngine(self.config.feature_windows)
             self.devices[device_name] = device
             self.log.info(f"Added device to stream: {device_name}")
         
-        # Create connection manager object to handle all active connections
-        self.connection_manager = ConnectionManager(self.config, self.halt_event, self.devices, self.consumer_manager.input_queue, self.handle_new_data)
-        self.connection_manager.connect_state.connect(lambda d, s: checked_devices[d][1].on() if s else checked_devices[d][1].off())
+        if self.config.acquisition_shards > 1:
+            # Connections run in worker processes, which create their own backend and captures
+            from .sharding import ShardManager
+            self.log.info(f"Running connections in {self.config.acquisition_shards} worker processes")
+            self.connection_manager = ShardManager(self.config, self.halt_event, self.devices, self.consumer_manager.input_queue, self.handle_new_data,
+                                                   data_path=data_path)
+        else:
+            capture = None
+            if self.config.capture_raw:
+                from .capture import CaptureWriter
+                capture = CaptureWriter(self.config, data_path=data_path)
+
+            # Create connection manager object to handle all active connections
+            self.connection_manager = ConnectionManager(self.config, self.halt_event, self.devices, self.consumer_manager.input_queue, self.handle_new_data,
+                                                        capture=capture, backend=self.backend)
+        self.connection_manager.connect_state.connect(lambda d, s: self._set_indicator(checked_devices[d][1], s))
+
+        if self.config.output_tcp:
+            from .tcpserver import StreamServer
+            self.server = StreamServer(self.config, self, self.halt_event)
+        if self.config.shm_export:
+            from .sharedbuffer import SharedBufferExport
+            self.shared_export = SharedBufferExport(self.config, list(self.output_queues), self.config.characteristics[0].column_headers)
+            self.block_listeners.append(self.shared_export.write)
+
+    def _set_indicator(self, indicator, state):
+        # Devices streamed without GUI (e.g. replays) have no indicator
+        if indicator is None:
+            return
+        if state:
+            indicator.on()
+        else:
+            indicator.off()
 
     def start(self, checked_devices, data_path=None):
         # Setup the stream object with consumers and devices
+        self.data_path = data_path
         self.setup_stream(checked_devices, data_path=data_path)
+        if self.config.trace_enabled:
+            tracer.start()
         
         # Start the connection and consumer manager tasks
         self.consumer_manager_task = asyncio.create_task(self.consumer_manager.run(), name='Consumer Manager Task')
         self.connection_manager_task = asyncio.create_task(self.connection_manager.run(), name='Connection Manager Task')
+        if self.server is not None:
+            self.server_task = asyncio.create_task(self.server.run(), name='Stream Server Task')
 
     async def stop(self):
         # Wait for all running tasks
         if self.consumer_manager_task or self.connection_manager_task:
             await asyncio.gather(self.consumer_manager_task, self.connection_manager_task)
             self.log.info("IMU data stream stopped")
+        if self.server_task:
+            await self.server_task
         self.consumer_manager_task = None
         self.connection_manager_task = None
+        self.server = None
+        self.server_task = None
+        if self.shared_export is not None:
+            self.block_listeners.remove(self.shared_export.write)
+            self.shared_export.close()
+            self.shared_export = None
+        if self.config.trace_enabled and tracer.enabled:
+            tracer.stop()
+            path = tracer.export_to(self.data_path or self.config.output_folder)
+            self.log.info(f"Trace saved to {path}")
         
         # Reset attributes
         self.devices = {}
+        self.feature_engines = {}
+        self.sample_counts = {}
         self.consumer_manager = None
         self.connection_manager = None
 
+    def features(self, name) -> np.ndarray:
+        """Current feature vector of a device, see FeatureEngine.feature_vector"""
+        return self.feature_engines[name].feature_vector()
+
+    def window(self, name) -> Tuple[int, np.ndarray]:
+        """
+        Rows currently buffered for a device, together with the stream index of the first row,
+        e.g. for use as a FeatureGraph batch.
+        """
+        blocks = list(self.output_queues[name])
+        if not blocks:
+            return self.sample_counts.get(name, 0), np.zeros((0, len(self.scaling_factors)))
+        data = np.vstack(blocks)
+        return self.sample_counts[name] - len(data), data
+
     def handle_new_data(self, adr, name, data):
         # Pass new data to the data processor
         if name in self.output_queues:
+            t0 = _HANDLE.start()
             try:
                 # Apply unit conversions to the elements in each tuple
                 data = np.asarray(data) * self.scaling_factors
                 
                 # Place data in the appropriate output queue
                 self.output_queues[name].append(data)
+                self.sample_counts[name] = self.sample_counts.get(name, 0) + len(data)
+                
+                # Update windowed features
+                if name in self.feature_engines:
+                    self.feature_engines[name].update(data)
+                for listener in self.block_listeners:
+                    listener(name, data)
                 self.new_data.emit(name)
                 
             except Exception as e:
                 self.log.error(f"Error handling incoming data: {e}")
+            _HANDLE.end(t0, name)
         else:
             logging.warning(f"No buffer initialized for device {name} ({adr})")
@@ -0,0 +1,312 @@
+"""
+TCP publish/subscribe server for the scaled samples of a running Stream.
+
+A subscriber connects to tcp_host:tcp_port and sends one JSON line with its subscription, all
+fields optional:
+
+    {"devices": ["Sim00", "Sim01"], "channels": ["acc_x", "acc_y", "acc_z"], "backfill": 5.0}
+
+Devices and channels default to all of them, backfill (in seconds of data, from the per-device
+buffers of the Stream) defaults to tcp_backfill. Every server message is a header (little
+endian u8 type, u32 payload length) followed by the payload:
+
+    type 0  JSON    'hello' with the device IDs and channels, 'backfill_done', periodic 'status'
+                    with the lag of the subscriber, and 'dropped' when data was dropped
+    type 1  samples u16 device_id, u16 rows, u8 columns, then rows x columns f64, row-major
+
+After the backfill, every new block of a subscribed device is queued for the subscriber, and
+written in batches as fast as the subscriber reads them. A subscriber whose oldest queued block
+waits for longer than tcp_max_lag is handled according to tcp_slow_subscriber: 'drop' discards
+its queued blocks and tells it how many samples it lost, 'disconnect' closes the connection.
+A write that does not drain within tcp_max_lag also counts as lagging, so a subscriber that
+stopped reading is disconnected even when no new block arrives. Either way, acquisition and
+other subscribers are not affected.
+
+Reference client, printing the rates per device:
+
+    python -m library.tcpserver --port 5006 [--devices Sim00,Sim01] [--channels acc_x,acc_y]
+"""
+import sys
+import json
+import time
+import struct
+import asyncio
+import argparse
+import logging
+import numpy as np
+from collections import deque
+from typing import Any, Deque, Dict, List, Tuple, Union
+from .datatypes import Configuration
+
+MESSAGE = struct.Struct('<BI')
+SAMPLES = struct.Struct('<HHB')
+TYPE_JSON = 0
+TYPE_SAMPLES = 1
+
+
+def _json_message(obj: Dict[str, Any]) -> bytes:
+    payload = json.dumps(obj).encode()
+    return MESSAGE.pack(TYPE_JSON, len(payload)) + payload
+
+
+def _samples_message(device_id: int, rows: np.ndarray) -> bytes:
+    payload = SAMPLES.pack(device_id, len(rows), rows.shape[1]) + np.ascontiguousarray(rows, dtype='<f8').tobytes()
+    return MESSAGE.pack(TYPE_SAMPLES, len(payload)) + payload
+
+
+class Subscriber:
+    def __init__(self, server: 'StreamServer', reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.server = server
+        self.reader = reader
+        self.writer = writer
+        self.peer = writer.get_extra_info('peername')
+        self.devices = {}  # type: Dict[str, int]
+        self.columns = None  # type: Union[np.ndarray, None]
+        # Queued messages with their queue time [monotonic s], and the number of samples in them
+        self.pending = deque()  # type: Deque[Tuple[float, int, bytes]]
+        self.wakeup = asyncio.Event()
+        self.closed = False
+        self.samples_sent = 0
+        self.samples_dropped = 0
+        self.bytes_sent = 0
+
+    @property
+    def lag(self) -> float:
+        """Time [s] the oldest queued block has been waiting"""
+        return time.monotonic() - self.pending[0][0] if self.pending else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'peer': f'{self.peer[0]}:{self.peer[1]}' if self.peer else None,
+            'devices': list(self.devices),
+            'lag': round(self.lag, 3),
+            'queued_blocks': len(self.pending),
+            'samples_sent': self.samples_sent,
+            'samples_dropped': self.samples_dropped,
+            'bytes_sent': self.bytes_sent,
+        }
+
+    def queue(self, message: bytes, samples: int = 0) -> None:
+        if self.closed:
+            return
+        self.pending.append((time.monotonic(), samples, message))
+        self.wakeup.set()
+
+    def publish(self, name: str, data: np.ndarray) -> None:
+        if name not in self.devices:
+            return
+        if self.lag > self.server.config.tcp_max_lag:
+            self._handle_slow(self.lag)
+            if self.closed:
+                return
+        self.queue(_samples_message(self.devices[name], data[:, self.columns]), len(data))
+
+    def _handle_slow(self, lag: float) -> None:
+        if self.server.config.tcp_slow_subscriber == 'disconnect':
+            self.server.log.warning(f'Disconnecting slow subscriber {self.peer}, lagging {lag:.1f}s behind')
+            self.close()
+            return
+        dropped = sum(n for _, n, _ in self.pending)
+        if not self.samples_dropped:
+            self.server.log.warning(f'Subscriber {self.peer} is lagging {lag:.1f}s behind, dropping its queued data')
+        self.samples_dropped += dropped
+        self.pending.clear()
+        self.queue(_json_message({'type': 'dropped', 'samples': dropped, 'total_dropped': self.samples_dropped}))
+
+    def close(self) -> None:
+        if not self.closed:
+            self.closed = True
+            self.pending.clear()
+            self.wakeup.set()
+            # writer.close() waits for the send buffer to flush, which never happens if the
+            # subscriber stopped reading. Aborting also fails a pending drain() in write_loop.
+            self.writer.transport.abort()
+
+    async def subscribe(self) -> None:
+        """Reads the subscription, and queues the hello message and the backfill"""
+        config = self.server.config
+        line = await asyncio.wait_for(self.reader.readline(), timeout=config.tcp_subscribe_timeout)
+        request = json.loads(line) if line.strip() else {}
+        stream = self.server.stream
+        all_devices = self.server.device_ids()
+        names = request.get('devices') or list(all_devices)
+        unknown = [n for n in names if n not in all_devices]
+        channels = request.get('channels') or self.server.channels
+        unknown += [c for c in channels if c not in self.server.channels]
+        if unknown:
+            raise ValueError(f'Unknown devices or channels: {unknown}')
+        self.devices = {n: all_devices[n] for n in names}
+        self.columns = np.array([self.server.channels.index(c) for c in channels])
+        self.queue(_json_message({'type': 'hello', 'devices': self.devices, 'channels': channels}))
+
+        backfill = float(request.get('backfill', config.tcp_backfill))
+        for name, device_id in self.devices.items():
+            _, data = stream.window(name)
+            if backfill > 0 and len(data):
+                data = data[data[:, 0] >= data[-1, 0] - backfill]
+                self.queue(_samples_message(device_id, data[:, self.columns]), len(data))
+        self.queue(_json_message({'type': 'backfill_done'}))
+
+    async def write_loop(self) -> None:
+        config = self.server.config
+        while not self.closed:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            # Write everything queued so far in one batch
+            batch = []
+            samples = 0
+            while self.pending:
+                _, n, message = self.pending.popleft()
+                batch.append(message)
+                samples += n
+            if batch:
+                data = b''.join(batch)
+                self.writer.write(data)
+                while not self.closed:
+                    try:
+                        await asyncio.wait_for(self.writer.drain(), timeout=config.tcp_max_lag)
+                        break
+                    except asyncio.TimeoutError:
+                        # Stalled write. With 'drop', publish() drops the blocks queued meanwhile
+                        if config.tcp_slow_subscriber == 'disconnect':
+                            self._handle_slow(config.tcp_max_lag)
+                self.samples_sent += samples
+                self.bytes_sent += len(data)
+
+
+class StreamServer:
+    """Serves the data of a Stream to TCP subscribers, see the module documentation"""
+    def __init__(self, config: Configuration, stream, halt_event: asyncio.Event):
+        self.log = logging.getLogger('log')
+        self.config = config
+        self.stream = stream
+        self.halt_event = halt_event
+        self.channels = list(config.characteristics[0].column_headers)
+        self.subscribers = []  # type: List[Subscriber]
+        self._device_ids = {}  # type: Dict[str, int]
+
+    def device_ids(self) -> Dict[str, int]:
+        for name in self.stream.output_queues:
+            self._device_ids.setdefault(name, len(self._device_ids))
+        return dict(self._device_ids)
+
+    def publish(self, name: str, data: np.ndarray) -> None:
+        """Block listener of the Stream, queues new data for the subscribers"""
+        for s in self.subscribers:
+            s.publish(name, data)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [s.stats() for s in self.subscribers]
+
+    async def run(self) -> None:
+        server = None
+        self.stream.block_listeners.append(self.publish)
+        try:
+            server = await asyncio.start_server(self._handle, self.config.tcp_host, self.config.tcp_port)
+            self.log.info(f'Serving data on tcp://{self.config.tcp_host}:{self.config.tcp_port}')
+            while not self.halt_event.is_set():
+                try:
+                    await asyncio.wait_for(self.halt_event.wait(), timeout=self.config.tcp_status_interval)
+                except asyncio.TimeoutError:
+                    for s in self.subscribers:
+                        s.queue(_json_message({'type': 'status', **s.stats()}))
+        except Exception as e:
+            self.log.error(f'StreamServer encountered an exception: {e}')
+        finally:
+            self.stream.block_listeners.remove(self.publish)
+            for s in self.subscribers:
+                s.close()
+            if server is not None:
+                server.close()
+                await server.wait_closed()
+            self.log.info('StreamServer shut down')
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        s = Subscriber(self, reader, writer)
+        try:
+            await s.subscribe()
+        except Exception as e:
+            self.log.warning(f'Rejected subscriber {s.peer}: {e}')
+            s.closed = True
+            writer.write(_json_message({'type': 'error', 'message': str(e)}))
+            writer.close()
+            try:
+                await asyncio.wait_for(writer.wait_closed(), timeout=self.config.tcp_max_lag)
+            except (asyncio.TimeoutError, ConnectionError, OSError):
+                writer.transport.abort()
+            return
+        self.log.info(f'Subscriber {s.peer} connected for {len(s.devices)} devices')
+        self.subscribers.append(s)
+        try:
+            await s.write_loop()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            s.close()
+            self.subscribers.remove(s)
+            self.log.info(f'Subscriber {s.peer} disconnected after {s.samples_sent} samples, {s.samples_dropped} dropped')
+
+
+async def read_message(reader: asyncio.StreamReader) -> Tuple[int, Union[Dict[str, Any], Tuple[int, np.ndarray]]]:
+    """Reads one server message: (TYPE_JSON, dict) or (TYPE_SAMPLES, (device_id, rows))"""
+    message_type, length = MESSAGE.unpack(await reader.readexactly(MESSAGE.size))
+    payload = await reader.readexactly(length)
+    if message_type == TYPE_JSON:
+        return message_type, json.loads(payload)
+    device_id, rows, columns = SAMPLES.unpack_from(payload)
+    return message_type, (device_id, np.frombuffer(payload, dtype='<f8', offset=SAMPLES.size).reshape(rows, columns))
+
+
+async def _print_rates(host: str, port: int, subscription: Dict[str, Any], interval: float) -> None:
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(json.dumps(subscription).encode() + b'\n')
+    names = {}
+    samples = {}
+    next_print = time.monotonic() + interval
+    try:
+        while True:
+            message_type, message = await read_message(reader)
+            if message_type == TYPE_JSON:
+                if message['type'] == 'hello':
+                    names = {i: n for n, i in message['devices'].items()}
+                    print(f"Subscribed to {', '.join(names.values())}, channels {', '.join(message['channels'])}")
+                elif message['type'] != 'status':
+                    print(message)
+            else:
+                device_id, rows = message
+                samples[device_id] = samples.get(device_id, 0) + len(rows)
+            if time.monotonic() >= next_print:
+                for device_id, n in sorted(samples.items()):
+                    print(f'{names.get(device_id, device_id)}: {n / interval:.0f} samples/s')
+                samples = {}
+                next_print += interval
+    except asyncio.IncompleteReadError:
+        print('Server closed the connection')
+    finally:
+        writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Subscribe to a stream server and print the sample rates.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5006)
+    parser.add_argument('--devices', default=None, help='Comma separated device names (default: all)')
+    parser.add_argument('--channels', default=None, help='Comma separated channel names (default: all)')
+    parser.add_argument('--backfill', type=float, default=None, help='Seconds of buffered data to receive first')
+    parser.add_argument('--interval', type=float, default=1.0, help='Statistics interval in seconds')
+    args = parser.parse_args()
+    subscription = {}
+    if args.devices:
+        subscription['devices'] = args.devices.split(',')
+    if args.channels:
+        subscription['channels'] = args.channels.split(',')
+    if args.backfill is not None:
+        subscription['backfill'] = args.backfill
+    try:
+        asyncio.run(_print_rates(args.host, args.port, subscription, args.interval))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,77 @@
+import time
+import heapq
+import asyncio
+import logging
+from typing import Any, Callable, Dict, Hashable, List, Tuple
+from .events import wait_any
+
+
+class TimeoutScheduler:
+    """
+    Shared deadline scheduler for characteristic timeouts of all connections.
+
+    Deadlines live in a dict; the heap holds at most one entry per key. Re-arming a key with a
+    later deadline (the common case: a notification arrived) only updates the dict, in O(1).
+    When a heap entry comes due and its key was re-armed meanwhile, it is pushed again with the
+    current deadline. A single task sleeps until the earliest deadline, so idle cost does not
+    grow with the number of connections, and callbacks fire only when a deadline really passes.
+    """
+    def __init__(self):
+        self.log = logging.getLogger('log')
+        self.deadlines = {}  # type: Dict[Hashable, int]
+        self.callbacks = {}  # type: Dict[Hashable, Callable[[Any], None]]
+        self.scheduled = {}  # type: Dict[Hashable, int]
+        self.heap = []  # type: List[Tuple[int, int, Hashable]]
+        self.counter = 0
+        self.wakeup = asyncio.Event()
+
+    def arm(self, key: Hashable, deadline_ns: int, callback: Callable[[Any], None] = None) -> None:
+        """(Re-)set the deadline of 'key'. 'callback(key)' is called once the deadline passes."""
+        self.deadlines[key] = deadline_ns
+        if callback is not None:
+            self.callbacks[key] = callback
+        scheduled = self.scheduled.get(key)
+        if scheduled is None or deadline_ns < scheduled:
+            self._push(key, deadline_ns)
+            if self.heap[0][2] == key:
+                self.wakeup.set()
+
+    def cancel(self, key: Hashable) -> None:
+        # The heap entry is dropped lazily once it comes due
+        self.deadlines.pop(key, None)
+        self.callbacks.pop(key, None)
+
+    def _push(self, key: Hashable, deadline_ns: int) -> None:
+        self.scheduled[key] = deadline_ns
+        self.counter += 1
+        heapq.heappush(self.heap, (deadline_ns, self.counter, key))
+
+    async def run(self, halt_event: asyncio.Event) -> None:
+        while not halt_event.is_set():
+            timeout = None
+            if self.heap:
+                timeout = max(0, (self.heap[0][0] - time.monotonic_ns()) / 1e9)
+            await wait_any(self.wakeup, halt_event, timeout=timeout)
+            self.wakeup.clear()
+            self._expire(time.monotonic_ns())
+
+    def _expire(self, now: int) -> None:
+        while self.heap and self.heap[0][0] <= now:
+            t, _, key = heapq.heappop(self.heap)
+            if self.scheduled.get(key) != t:
+                continue
+            del self.scheduled[key]
+            deadline = self.deadlines.get(key)
+            if deadline is None:
+                continue
+            if deadline > now:
+                # Re-armed since this entry was pushed
+                self._push(key, deadline)
+                continue
+            del self.deadlines[key]
+            callback = self.callbacks.pop(key, None)
+            if callback is not None:
+                try:
+                    callback(key)
+                except Exception as e:
+                    self.log.error(f'Timeout callback for {key} raised an exception: {e}')
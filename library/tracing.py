@@ -0,0 +1,212 @@
+"""
+Sampled tracing of the acquisition hot path, exported as Chrome Trace Event JSON.
+
+Every traced stage has a SpanSite, created once at import time. A span is measured with a
+start/end pair around the stage:
+
+    _DECODE = tracer.site('decode_data', 'decode')
+
+    t0 = _DECODE.start()
+    rows = decode_data(data)
+    _DECODE.end(t0, connection.name)
+
+start() returns 0 while tracing is disabled, or when the call is not sampled (only every
+trace_sample_every-th call of a site is recorded), and end() ignores it, so disabled tracing
+costs one attribute check per span. Recorded spans go into preallocated ring storage of
+trace_buffer_size spans, the oldest are overwritten. The ring is shared by all threads (the
+acquisition loop and the GUI), writes and exports take a lock. Its size and the sample rate are
+set once at startup, by the GUI or the daemon, with tracer.configure().
+
+Traced stages (category: name):
+
+    ble         notification        ActiveConnection._notif_callback
+    ble         connect             connection setup, from connect to enabled notifications
+    decode      decode_data         decoding of one notification
+    stream      handle_new_data     Stream.handle_new_data, incl. features and block listeners
+    consumers   distribute          ConsumerManager._distribute_data fan-out
+    disk        write_csv           FileWriter, writing and flushing one block
+    gui         plot_refresh        LivePlot.refresh
+
+Spans that wait (connect, write_csv) are exported as async events, on their own track.
+Tracing is started and stopped at runtime from the GUI (Trace button), with SIGUSR1 or
+--trace in the daemon, or for every recording with trace_enabled. The exported files open in
+https://ui.perfetto.dev (offline) or chrome://tracing. A summary per stage is printed by:
+
+    python -m library.tracing output/trace_20240101_120000.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import numpy as np
+from typing import Any, Dict, List
+
+
+class SpanSite:
+    __slots__ = ('tracer', 'index', 'name', 'category', 'sampled', 'asynchronous', 'calls')
+
+    def __init__(self, tracer: 'Tracer', index: int, name: str, category: str, sampled: bool, asynchronous: bool):
+        self.tracer = tracer
+        self.index = index
+        self.name = name
+        self.category = category
+        # Unsampled sites record every call, e.g. for rare events such as connection setup
+        self.sampled = sampled
+        # Spans with awaits interleave with others on the same thread
+        self.asynchronous = asynchronous
+        self.calls = 0
+
+    def start(self) -> int:
+        """Start time [ns] of a recorded span, or 0"""
+        if not self.tracer.enabled:
+            return 0
+        self.calls += 1
+        if self.sampled and self.calls % self.tracer.sample_every:
+            return 0
+        return time.perf_counter_ns()
+
+    def end(self, t0: int, arg: Any = None) -> None:
+        if t0:
+            self.tracer.record(self.index, t0, time.perf_counter_ns() - t0, arg)
+
+
+class Tracer:
+    def __init__(self, capacity: int = 65536, sample_every: int = 10):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.sites = []  # type: List[SpanSite]
+        self.thread_names = {}  # type: Dict[int, str]
+        self.configure(capacity, sample_every)
+
+    def configure(self, capacity: int, sample_every: int) -> None:
+        """Set the ring size and sample rate, this clears the recorded spans"""
+        self.sample_every = max(1, sample_every)
+        self.clear(capacity)
+
+    def clear(self, capacity: int = None) -> None:
+        with self.lock:
+            if capacity is not None:
+                self.capacity = capacity
+            self.site_ids = [0] * self.capacity
+            self.threads = [0] * self.capacity
+            self.starts = [0] * self.capacity
+            self.durations = [0] * self.capacity
+            self.args = [None] * self.capacity  # type: List[Any]
+            self.head = 0  # Total number of spans recorded
+
+    def site(self, name: str, category: str, sampled: bool = True, asynchronous: bool = False) -> SpanSite:
+        site = SpanSite(self, len(self.sites), name, category, sampled, asynchronous)
+        self.sites.append(site)
+        return site
+
+    def start(self) -> None:
+        """Clear the recorded spans and start recording"""
+        self.clear()
+        self.enabled = True
+
+    def stop(self) -> None:
+        self.enabled = False
+
+    def record(self, site: int, start: int, duration: int, arg: Any) -> None:
+        tid = threading.get_ident()
+        with self.lock:
+            if tid not in self.thread_names:
+                self.thread_names[tid] = threading.current_thread().name
+            i = self.head % self.capacity
+            self.site_ids[i] = site
+            self.threads[i] = tid
+            self.starts[i] = start
+            self.durations[i] = duration
+            self.args[i] = arg
+            self.head += 1
+
+    def events(self) -> List[Dict[str, Any]]:
+        """Recorded spans as Chrome trace events, oldest first"""
+        pid = os.getpid()
+        # Snapshot of the ring, recording may continue meanwhile
+        with self.lock:
+            head = self.head
+            thread_names = dict(self.thread_names)
+            site_ids, threads, starts = list(self.site_ids), list(self.threads), list(self.starts)
+            durations, args = list(self.durations), list(self.args)
+        events = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0, 'args': {'name': 'hlimu acquisition'}}]
+        events += [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+                   for tid, name in thread_names.items()]
+        n = min(head, self.capacity)
+        for k in range(head - n, head):
+            i = k % self.capacity
+            site = self.sites[site_ids[i]]
+            # Timestamps in microseconds
+            event = {'name': site.name, 'cat': site.category, 'pid': pid, 'tid': threads[i], 'ts': starts[i] / 1e3}
+            if args[i] is not None:
+                event['args'] = {'arg': str(args[i])}
+            if site.asynchronous:
+                end = dict(event, ph='e', ts=(starts[i] + durations[i]) / 1e3, id=k)
+                events += [dict(event, ph='b', id=k), end]
+            else:
+                events.append(dict(event, ph='X', dur=durations[i] / 1e3))
+        return events
+
+    def export(self, path: str) -> int:
+        """Write the recorded spans to a Chrome trace JSON file, returns the number of spans"""
+        trace = {
+            'traceEvents': self.events(),
+            'displayTimeUnit': 'ms',
+            'otherData': {
+                'sample_every': self.sample_every,
+                'overwritten': max(0, self.head - self.capacity),
+            },
+        }
+        with open(path, 'w') as f:
+            json.dump(trace, f)
+        return sum(1 for e in trace['traceEvents'] if e['ph'] in ('X', 'b'))
+
+    def export_to(self, folder: str) -> str:
+        """Export to a time-stamped file in 'folder', returns its path"""
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f'trace_{time.strftime("%Y%m%d_%H%M%S")}.json')
+        self.export(path)
+        return path
+
+
+# Shared by all traced stages
+tracer = Tracer()
+
+
+def summarize(events: List[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    """Count and duration statistics [ms] per span name, of exported trace events"""
+    durations = {}  # type: Dict[str, List[float]]
+    begins = {}
+    for e in events:
+        if e['ph'] == 'X':
+            durations.setdefault(e['name'], []).append(e['dur'] / 1e3)
+        elif e['ph'] == 'b':
+            begins[e['id']] = e['ts']
+        elif e['ph'] == 'e' and e['id'] in begins:
+            durations.setdefault(e['name'], []).append((e['ts'] - begins.pop(e['id'])) / 1e3)
+    summary = {}
+    for name, d in durations.items():
+        d = np.asarray(d)
+        summary[name] = {'count': len(d), 'mean': d.mean(), 'p50': np.percentile(d, 50),
+                         'p99': np.percentile(d, 99), 'max': d.max()}
+    return summary
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Summarize an exported trace per stage.')
+    parser.add_argument('file', help='Chrome trace JSON file, as written by Tracer.export')
+    args = parser.parse_args()
+    with open(args.file, 'r') as f:
+        trace = json.load(f)
+    other = trace.get('otherData', {})
+    print(f'Sampled 1/{other.get("sample_every", 1)}, {other.get("overwritten", 0)} spans overwritten')
+    print(f'{"span":<20}{"count":>8}{"mean":>10}{"p50":>10}{"p99":>10}{"max":>10}  [ms]')
+    for name, s in sorted(summarize(trace['traceEvents']).items(), key=lambda kv: -kv[1]['p99']):
+        print(f'{name:<20}{s["count"]:>8}{s["mean"]:>10.3f}{s["p50"]:>10.3f}{s["p99"]:>10.3f}{s["max"]:>10.3f}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
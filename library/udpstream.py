@@ -0,0 +1,299 @@
+"""
+Live streaming of decoded and scaled samples over UDP, unicast or multicast.
+
+Every datagram starts with a fixed header (little endian):
+
+    magic       2s      b'HL'
+    version     u8      1
+    type        u8      0 = samples, 1 = device announcement
+    columns     u8      number of columns per sample
+    device_id   u16     ID of the device, assigned by the sender
+    seq         u32     per-device sequence number of sample frames
+    count       u16     number of samples in the frame
+    send_time   f64     wall-clock time (time.time()) the frame was sent
+
+Sample frames are followed by 'count' samples, each with the first two columns (system time and
+device timestamp, in seconds) as f64 and the remaining columns as f32, in SI units (see
+decoders.SCALING_FACTORS). Announcement frames carry the UTF-8 device name instead, and are sent
+when a device first appears and every 'announce_interval' seconds, so receivers can join anytime.
+Receivers detect lost frames from gaps in the sequence numbers.
+
+Reference receiver, printing rates, loss and latency per device:
+
+    python -m library.udpstream --port 5005 [--group 239.0.0.1]
+"""
+import sys
+import time
+import socket
+import struct
+import asyncio
+import argparse
+import logging
+import ipaddress
+import numpy as np
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, List, Tuple, Union
+from .datatypes import Configuration, Consumer, NotifData
+from .decoders import SCALING_FACTORS
+
+MAGIC = b'HL'
+VERSION = 1
+TYPE_SAMPLES = 0
+TYPE_ANNOUNCE = 1
+HEADER = struct.Struct('<2sBBBHIHd')
+# Columns sent as f64, the rest as f32:
+WIDE_COLUMNS = 2
+# IPv4 and UDP headers:
+IP_UDP_OVERHEAD = 28
+# Latencies kept per device by the receiver:
+LATENCY_HISTORY = 10000
+
+
+def sample_dtype(columns: int) -> np.dtype:
+    wide = min(columns, WIDE_COLUMNS)
+    return np.dtype([('t', '<f8', (wide,)), ('v', '<f4', (columns - wide,))])
+
+
+def pack_samples(device_id: int, seq: int, rows: np.ndarray, send_time: float) -> bytes:
+    samples = np.empty(len(rows), dtype=sample_dtype(rows.shape[1]))
+    samples['t'] = rows[:, :WIDE_COLUMNS]
+    samples['v'] = rows[:, WIDE_COLUMNS:]
+    return HEADER.pack(MAGIC, VERSION, TYPE_SAMPLES, rows.shape[1], device_id, seq & 0xFFFFFFFF, len(rows), send_time) + samples.tobytes()
+
+
+def pack_announcement(device_id: int, name: str, send_time: float) -> bytes:
+    return HEADER.pack(MAGIC, VERSION, TYPE_ANNOUNCE, 0, device_id, 0, 0, send_time) + name.encode()
+
+
+def parse_frame(frame: bytes) -> Tuple[int, int, int, float, Union[np.ndarray, str]]:
+    """Returns (type, device_id, seq, send_time, payload), where payload is the samples (as a
+    float64 array of shape [count, columns]) or the announced device name."""
+    if len(frame) < HEADER.size:
+        raise ValueError('Frame too short')
+    magic, version, frame_type, columns, device_id, seq, count, send_time = HEADER.unpack_from(frame)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('Not a sample stream frame')
+    if frame_type == TYPE_ANNOUNCE:
+        return frame_type, device_id, seq, send_time, frame[HEADER.size:].decode()
+    samples = np.frombuffer(frame, dtype=sample_dtype(columns), count=count, offset=HEADER.size)
+    rows = np.empty((count, columns))
+    rows[:, :WIDE_COLUMNS] = samples['t']
+    rows[:, WIDE_COLUMNS:] = samples['v']
+    return frame_type, device_id, seq, send_time, rows
+
+
+def _create_socket(address: str, port: int, ttl: int, bind: bool) -> socket.socket:
+    multicast = ipaddress.ip_address(address).is_multicast
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    if bind:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(('' if multicast else address, port))
+        if multicast:
+            group = struct.pack('4s4s', socket.inet_aton(address), socket.inet_aton('0.0.0.0'))
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, group)
+    elif multicast:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+    return sock
+
+
+class _SendProtocol(asyncio.DatagramProtocol):
+    def __init__(self, streamer: 'UDPStreamer'):
+        self.streamer = streamer
+
+    def error_received(self, exc: Exception) -> None:
+        # Errors of sendto() on the non-blocking socket are reported here
+        self.streamer._send_failed(exc)
+
+
+class UDPStreamer(Consumer):
+    """
+    Consumer sending all sample blocks to 'udp_address':'udp_port'. Blocks that are queued at the
+    same time are merged per device, and packed into as few datagrams as the MTU allows. Sending
+    never blocks: if the socket buffer is full, frames are dropped and counted in 'dropped'.
+    Frames that cannot be sent are counted in 'send_errors', streaming continues.
+    """
+    announce_interval = 1.0
+    # Frames are dropped while more than this many bytes wait to be sent
+    max_buffered_bytes = 1 << 20
+
+    def __init__(self, config: Configuration, halt_event: asyncio.Event):
+        super().__init__()
+        self.log = logging.getLogger('log')
+        self.config = config
+        self.halt_event = halt_event
+        self.address = (config.udp_address, config.udp_port)
+        self.transport = None  # type: Union[asyncio.DatagramTransport, None]
+        self.device_ids = {}  # type: Dict[str, int]
+        self.sequence = {}  # type: Dict[int, int]
+        self.last_announcement = {}  # type: Dict[int, float]
+        self.frames_sent = 0
+        self.dropped = 0
+        self.send_errors = 0
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            sock = _create_socket(self.config.udp_address, self.config.udp_port, self.config.udp_multicast_ttl, bind=False)
+            self.transport, _ = await loop.create_datagram_endpoint(lambda: _SendProtocol(self), sock=sock)
+            self.log.info(f'Streaming samples to udp://{self.address[0]}:{self.address[1]}')
+            while not self.halt_event.is_set() or not self.input_queue.empty():
+                try:
+                    blocks = [await asyncio.wait_for(self.input_queue.get(), timeout=0.5)]  # type: List[NotifData]
+                except asyncio.TimeoutError:
+                    continue
+                # Take everything else that is already waiting, to fill the datagrams
+                while not self.input_queue.empty():
+                    blocks.append(self.input_queue.get_nowait())
+                self._send_blocks(blocks)
+        except Exception as e:
+            self.log.error(f'UDPStreamer encountered an exception: {e}')
+        finally:
+            if self.transport is not None:
+                self.transport.close()
+            if self.dropped:
+                self.log.warning(f'UDPStreamer dropped {self.dropped} frames')
+            if self.send_errors:
+                self.log.warning(f'UDPStreamer failed to send {self.send_errors} frames')
+            self.log.info('UDPStreamer shut down')
+
+    def _send_blocks(self, blocks: List[NotifData]) -> None:
+        merged = {}  # type: Dict[Tuple[str, str], List[NotifData]]
+        for block in blocks:
+            merged.setdefault((block.device_adr, block.characteristic.uuid), []).append(block)
+
+        now = time.time()
+        for (adr, _), device_blocks in merged.items():
+            device_id = self.device_ids.setdefault(adr, len(self.device_ids))
+            if now - self.last_announcement.get(device_id, 0) >= self.announce_interval:
+                self._send(pack_announcement(device_id, device_blocks[0].device_name_repr, now))
+                self.last_announcement[device_id] = now
+
+            try:
+                rows = np.array([row for b in device_blocks for row in b.data], dtype=np.float64)
+            except ValueError as e:
+                self.log.warning(f'UDPStreamer skipped a block of {device_blocks[0].device_name_repr}: {e}')
+                continue
+            if rows.shape[1] == len(SCALING_FACTORS):
+                rows *= SCALING_FACTORS
+            per_frame = max(1, (self.config.udp_mtu - IP_UDP_OVERHEAD - HEADER.size) // sample_dtype(rows.shape[1]).itemsize)
+            for start in range(0, len(rows), per_frame):
+                seq = self.sequence.get(device_id, 0)
+                self.sequence[device_id] = seq + 1
+                self._send(pack_samples(device_id, seq, rows[start:start + per_frame], now))
+
+    def _send(self, frame: bytes) -> None:
+        if self.transport.get_write_buffer_size() > self.max_buffered_bytes:
+            self.dropped += 1
+            return
+        try:
+            self.transport.sendto(frame, self.address)
+        except OSError as e:
+            self._send_failed(e)
+            return
+        self.frames_sent += 1
+
+    def _send_failed(self, e: Exception) -> None:
+        if not self.send_errors:
+            self.log.warning(f'UDPStreamer could not send to {self.address[0]}:{self.address[1]}: {e}')
+        self.send_errors += 1
+
+
+@dataclass
+class DeviceStreamStats:
+    name: Union[str, None] = None
+    frames: int = 0
+    samples: int = 0
+    lost: int = 0
+    # Frames that arrived after a newer frame (reordered), not counted as lost:
+    late: int = 0
+    next_seq: Union[int, None] = None
+    # Send-to-receive latencies [s] of the most recent sample frames:
+    latencies: Deque[float] = field(default_factory=lambda: deque(maxlen=LATENCY_HISTORY))
+
+
+class UDPReceiver(asyncio.DatagramProtocol):
+    """
+    Reference receiver. Calls callback(device_id, name, rows) for every sample frame and keeps
+    per-device statistics; lost frames are counted from forward gaps in the sequence numbers, a
+    frame older than the newest one received counts as late and no longer as lost.
+    """
+    def __init__(self, callback: Callable[[int, Union[str, None], np.ndarray], None] = None):
+        self.callback = callback
+        self.devices = {}  # type: Dict[int, DeviceStreamStats]
+        self.invalid = 0
+        self.transport = None
+
+    @classmethod
+    async def listen(cls, address: str, port: int, callback: Callable = None) -> 'UDPReceiver':
+        loop = asyncio.get_running_loop()
+        sock = _create_socket(address, port, 1, bind=True)
+        _, receiver = await loop.create_datagram_endpoint(lambda: cls(callback), sock=sock)
+        return receiver
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+
+    def close(self) -> None:
+        if self.transport is not None:
+            self.transport.close()
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        receive_time = time.time()
+        try:
+            frame_type, device_id, seq, send_time, payload = parse_frame(data)
+        except ValueError:
+            self.invalid += 1
+            return
+        stats = self.devices.setdefault(device_id, DeviceStreamStats())
+        if frame_type == TYPE_ANNOUNCE:
+            stats.name = payload
+            return
+        gap = (seq - stats.next_seq) & 0xFFFFFFFF if stats.next_seq is not None else 0
+        if gap < 2**31:
+            stats.lost += gap
+            stats.next_seq = (seq + 1) & 0xFFFFFFFF
+        else:
+            # Reordered: this frame was counted as lost when the newer one arrived
+            stats.late += 1
+            stats.lost = max(0, stats.lost - 1)
+        stats.frames += 1
+        stats.samples += len(payload)
+        stats.latencies.append(receive_time - send_time)
+        if self.callback is not None:
+            self.callback(device_id, stats.name, payload)
+
+
+async def _print_stats(address: str, port: int, interval: float) -> None:
+    receiver = await UDPReceiver.listen(address, port)
+    print(f'Listening on udp://{address}:{port}')
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            for device_id, s in sorted(receiver.devices.items()):
+                latency = f'{np.median(s.latencies) * 1e3:.2f} ms' if s.latencies else '-'
+                print(f'{s.name or device_id}: {s.samples / interval:.0f} samples/s, {s.lost} frames lost, '
+                      f'{s.late} late, median latency {latency}')
+                s.samples = 0
+                s.latencies.clear()
+    finally:
+        receiver.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Receive a UDP sample stream and print statistics.')
+    parser.add_argument('--address', default='0.0.0.0', help='Address to listen on (default: all interfaces)')
+    parser.add_argument('--group', default=None, help='Multicast group to join instead')
+    parser.add_argument('--port', type=int, default=5005)
+    parser.add_argument('--interval', type=float, default=1.0, help='Statistics interval in seconds')
+    args = parser.parse_args()
+    try:
+        asyncio.run(_print_stats(args.group or args.address, args.port, args.interval))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    sys.exit(main())
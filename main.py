@@ -1,9 +1,16 @@
 import sys
 import asyncio
-from gui import MainWindow
-from qasync import QEventLoop, QApplication
 
 if __name__ == "__main__":
+    # Record without a GUI (and without Qt), see library/daemon.py for the options
+    if "--headless" in sys.argv:
+        sys.argv.remove("--headless")
+        from library.daemon import main
+        sys.exit(main())
+
+    from gui import MainWindow
+    from qasync import QEventLoop, QApplication
+
     app = QApplication(sys.argv)
     app.setStyle("Universal")
     window = MainWindow()